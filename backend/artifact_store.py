@@ -0,0 +1,154 @@
+"""
+Store for generated educational artifacts
+Problem sets, assessments, study notes and learning paths keyed by method, topic, difficulty and style
+"""
+import hashlib
+import json
+import logging
+import re
+from typing import Dict, List, Optional
+
+from metrics import record_cache
+from storage import Storage, create_storage, upsert_statement
+
+logger = logging.getLogger(__name__)
+
+# Chat phrasing around the topic, e.g. "give me practice problems on arcs and chords"
+REQUEST_PREFIX = re.compile(
+    r'^(?:(?:please|can you|could you|give me|create|make|generate|teach me|explain|help me with|'
+    r'some|practice|more|a|an)\s+)*'
+    r'(?:(?:problems?|exercises?|problem sets?|questions?|study path|learning path|notes?)\s+'
+    r'(?:on|about|for|in)\s+)?'
+)
+# Topic text kept in the topic column; keys hash the whole topic
+MAX_TOPIC_LENGTH = 200
+
+
+def normalize_topic(topic: str) -> str:
+    """Canonical topic text so 'Arcs and Chords' and 'problems on arcs  and chords?' share an artifact"""
+    topic = re.sub(r'\s+', ' ', (topic or '').lower()).strip()
+    topic = REQUEST_PREFIX.sub('', topic)
+    return topic.strip(' ?.!:')
+
+
+def stored_topic(topic: str) -> str:
+    """Topic column value; invalidate matches on the same value"""
+    return normalize_topic(topic)[:MAX_TOPIC_LENGTH]
+
+
+def content_topic(content: str) -> str:
+    """Topic for an artifact generated from source text; exact, as two different texts must not share it"""
+    return "content:" + hashlib.sha256((content or '').encode()).hexdigest()
+
+
+class ArtifactStore:
+    """Lookup table of LLM-generated study artifacts in the project database"""
+
+    def __init__(self, db_path: str = "chatbot.db", storage: Optional[Storage] = None):
+        self.db_path = db_path
+        # SQLite file at db_path unless DATABASE_URL selects PostgreSQL
+        self.storage = storage or create_storage(db_path)
+        self._init_table()
+
+    def _init_table(self):
+        """Create the artifacts table"""
+        try:
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS educational_artifacts (
+                        artifact_key TEXT PRIMARY KEY,
+                        method TEXT NOT NULL,
+                        topic TEXT NOT NULL,
+                        difficulty TEXT,
+                        style TEXT,
+                        payload TEXT NOT NULL,
+                        hit_count INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_method_topic ON educational_artifacts(method, topic)')
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize artifact store: {e}")
+
+    @staticmethod
+    def make_key(method: str, topic: str, difficulty: str = "", style: str = "", variant: str = "") -> str:
+        """Stable key; variant covers any other input that changes the output"""
+        parts = [method, normalize_topic(topic), difficulty or "", style or "", variant or ""]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, method: str, topic: str, difficulty: str = "", style: str = "", variant: str = "") -> Optional[Dict]:
+        """Return a stored artifact, or None"""
+        key = self.make_key(method, topic, difficulty, style, variant)
+        try:
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                self.storage.execute(cursor, 'SELECT payload FROM educational_artifacts WHERE artifact_key = ?', (key,), prepare=True)
+                row = cursor.fetchone()
+                record_cache("artifacts", row is not None)
+                if not row:
+                    return None
+                cursor.execute(
+                    'UPDATE educational_artifacts SET hit_count = hit_count + 1 WHERE artifact_key = ?',
+                    (key,)
+                )
+                conn.commit()
+                return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Artifact store read error: {e}")
+            return None
+
+    def put(self, method: str, topic: str, payload: Dict, difficulty: str = "", style: str = "", variant: str = ""):
+        """Store or replace an artifact"""
+        key = self.make_key(method, topic, difficulty, style, variant)
+        try:
+            with self.storage.connect() as conn:
+                conn.cursor().execute(
+                    upsert_statement('educational_artifacts',
+                                     ['artifact_key', 'method', 'topic', 'difficulty', 'style', 'payload'],
+                                     ['artifact_key']),
+                    (key, method, stored_topic(topic), difficulty, style, json.dumps(payload))
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Artifact store write error: {e}")
+
+    def invalidate(self, method: Optional[str] = None, topic: Optional[str] = None) -> int:
+        """Delete artifacts, optionally filtered by method and/or topic"""
+        sql = "DELETE FROM educational_artifacts WHERE 1=1"
+        params = []
+        if method:
+            sql += " AND method = ?"
+            params.append(method)
+        if topic:
+            sql += " AND topic = ?"
+            params.append(stored_topic(topic))
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+
+    def list_artifacts(self, method: Optional[str] = None) -> List[Dict]:
+        """Summary of stored artifacts, most requested first"""
+        sql = "SELECT method, topic, difficulty, style, hit_count, created_at FROM educational_artifacts"
+        params = []
+        if method:
+            sql += " WHERE method = ?"
+            params.append(method)
+        sql += " ORDER BY hit_count DESC"
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return [
+                {
+                    'method': row[0],
+                    'topic': row[1],
+                    'difficulty': row[2],
+                    'style': row[3],
+                    'hit_count': row[4],
+                    'created_at': row[5]
+                }
+                for row in cursor.fetchall()
+            ]
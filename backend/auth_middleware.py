@@ -3,18 +3,73 @@ Authentication middleware for user isolation
 """
 from fastapi import HTTPException, Request, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+import hashlib
 import jwt
+import re
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 import os
 
+from database_isolated import USER_ID_PATTERN, user_databases, validate_user_id
+
 security = HTTPBearer()
 
 # In production, use a secure secret key
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 
+SESSION_COOKIE = "session_id"
+ANONYMOUS_COOKIE_MAX_AGE = 60 * 60 * 24 * 365
+# Only ids minted by create_anonymous_session are accepted from the cookie
+ANONYMOUS_ID_PATTERN = re.compile(r"^anon_[0-9a-f]{32}$")
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens, keyed by SHA-256 digest and dropped at their exp"""
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+    
+    def get(self, token: str) -> Optional[str]:
+        """User id of a cached, unexpired token"""
+        key = self._key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if time.time() >= expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user_id
+    
+    def put(self, token: str, user_id: str, expires_at: float):
+        key = self._key(token)
+        with self.lock:
+            self.entries[key] = (user_id, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
 class UserSession:
     """Manages user sessions for isolation"""
     
@@ -36,11 +91,18 @@ class UserSession:
     @staticmethod
     def verify_token(token: str) -> Optional[str]:
         """Verify and decode a JWT token"""
+        user_id = token_cache.get(token)
+        if user_id:
+            return user_id
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload.get("user_id")
         except:
             return None
+        user_id = payload.get("user_id")
+        if user_id:
+            # Tokens without exp never expire in jwt.decode either; recheck them daily anyway
+            token_cache.put(token, user_id, payload.get("exp", time.time() + 86400))
+        return user_id
 
 async def get_current_user(request: Request) -> str:
     """Get current user ID from request"""
@@ -50,23 +112,44 @@ async def get_current_user(request: Request) -> str:
         token = auth_header.split(" ")[1]
         user_id = UserSession.verify_token(token)
         if user_id:
+            # Ids that cannot name a database file are never opened, so they would be warmed on every request
+            if USER_ID_PATTERN.match(user_id) and not user_databases.is_open(user_id):
+                # First request from this user in a while: open their database in the background
+                asyncio.get_running_loop().run_in_executor(None, user_databases.warm, user_id)
             return user_id
     
     # Check for session cookie
-    session_id = request.cookies.get("session_id")
-    if session_id:
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if session_id and ANONYMOUS_ID_PATTERN.match(session_id):
         return session_id
     
-    # Create anonymous session
-    return UserSession.create_anonymous_session()
+    # Create anonymous session once per request; anonymous_session_cookie hands it to the browser
+    anonymous_id = getattr(request.state, "anonymous_user_id", None)
+    if not anonymous_id:
+        anonymous_id = request.state.anonymous_user_id = UserSession.create_anonymous_session()
+    return anonymous_id
+
+async def anonymous_session_cookie(request: Request, call_next):
+    """HTTP middleware that sets the cookie for an anonymous session minted during the request,
+    so later requests from the same browser keep the same user id and storage"""
+    response = await call_next(request)
+    anonymous_id = getattr(request.state, "anonymous_user_id", None)
+    if anonymous_id:
+        response.set_cookie(
+            SESSION_COOKIE, anonymous_id,
+            max_age=ANONYMOUS_COOKIE_MAX_AGE, httponly=True, samesite="lax"
+        )
+    return response
 
 def get_user_db_path(user_id: str) -> str:
     """Get database path for a specific user"""
+    validate_user_id(user_id)
     os.makedirs("data/users", exist_ok=True)
     return f"data/users/{user_id}.db"
 
 def get_user_uploads_path(user_id: str) -> str:
     """Get uploads directory for a specific user"""
+    validate_user_id(user_id)
     path = f"data/uploads/{user_id}"
     os.makedirs(path, exist_ok=True)
     return path
\ No newline at end of file
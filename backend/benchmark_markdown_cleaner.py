@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for markdown_cleaner
+Compares the compiled cleaning pipeline, the streaming cleaner and the link extractor
+with the previous per-call implementation on stored assistant responses
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+
+from markdown_cleaner import StreamingMarkdownCleaner, clean_markdown_response, extract_clean_links
+
+
+def legacy_clean_markdown_response(text: str) -> str:
+    """Previous implementation, kept as the reference"""
+    text = re.sub(r'\s+target="_blank"', '', text)
+    text = re.sub(r'\s+rel="[^"]*"', '', text)
+    text = re.sub(r'\s+class="[^"]*"', '', text)
+    text = re.sub(r'\s+style="[^"]*"', '', text)
+    text = re.sub(r'\s+id="[^"]*"', '', text)
+    text = re.sub(r'</?[a-zA-Z][^>]*>', '', text)
+    text = re.sub(r'\[([^\]]+)\]\(([^)\s]+)[^)]*\)', r'[\1](\2)', text)
+    text = re.sub(r'([.!?])\[', r'\1 [', text)
+    text = re.sub(r' +', ' ', text)
+    text = re.sub(r' +$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[-*]\s*', '- ', text, flags=re.MULTILINE)
+    text = re.sub(r'^(\d+)\.\s*', r'\1. ', text, flags=re.MULTILINE)
+    return text.strip()
+
+
+def legacy_extract_clean_links(text: str) -> list:
+    """Previous implementation, kept as the reference"""
+    links = []
+    for link_text, url in re.findall(r'\[([^\]]+)\]\(([^)]+)\)', text):
+        clean_url = url.split()[0] if ' ' in url else url
+        links.append({'text': link_text, 'url': clean_url})
+    for url in re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', text):
+        if not any(url in link['url'] for link in links):
+            links.append({'text': url, 'url': url})
+    return links
+
+
+def load_corpus(db_path: str) -> list:
+    """Assistant responses stored in the conversations table"""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT content FROM conversations WHERE role = 'assistant'")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def link_heavy_response(count: int) -> str:
+    """Synthetic answer listing many resources, the quadratic case for link extraction"""
+    lines = []
+    for i in range(count):
+        lines.append(f"- [Resource {i}](https://example.org/resources/{i} target=\"_blank\") "
+                     f"mirror: https://mirror.example.org/{i}")
+    return "\n".join(lines)
+
+
+def stream_clean(text: str, chunk_size: int = 4) -> str:
+    """Clean a response fed in token-sized chunks"""
+    cleaner = StreamingMarkdownCleaner()
+    parts = [cleaner.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    parts.append(cleaner.finish())
+    return "".join(parts)
+
+
+def measure(func, texts, repeat: int) -> float:
+    """Best-of-repeat seconds to process every text once"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark markdown_cleaner")
+    parser.add_argument("--db", default="chatbot.db", help="Database with stored assistant responses")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--links", type=int, default=2000, help="Links in the synthetic link-heavy response")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.db)
+    if not corpus:
+        raise SystemExit(f"No assistant responses found in {args.db}")
+    corpus_chars = sum(len(text) for text in corpus)
+    heavy = [link_heavy_response(args.links)]
+
+    # Outputs must match before timings mean anything
+    for text in corpus + heavy:
+        expected = legacy_clean_markdown_response(text)
+        assert clean_markdown_response(text) == expected, "compiled pipeline differs from reference"
+        assert stream_clean(text) == expected, "streaming cleaner differs from reference"
+
+    print(f"Corpus: {len(corpus)} responses, {corpus_chars} characters")
+    print(f"{'benchmark':<40}{'reference':>12}{'current':>12}{'speedup':>10}")
+
+    rows = [
+        ("clean_markdown_response (corpus)", legacy_clean_markdown_response, clean_markdown_response, corpus),
+        ("streaming clean, 4-char chunks", legacy_clean_markdown_response, stream_clean, corpus),
+        ("extract_clean_links (corpus)", legacy_extract_clean_links, extract_clean_links, corpus),
+        (f"extract_clean_links ({args.links} links)", legacy_extract_clean_links, extract_clean_links, heavy),
+    ]
+    for name, reference, current, texts in rows:
+        repeat = args.repeat if texts is corpus else max(1, args.repeat // 10)
+        reference_time = measure(reference, texts, repeat)
+        current_time = measure(current, texts, repeat)
+        print(f"{name:<40}{reference_time * 1000:>10.2f}ms{current_time * 1000:>10.2f}ms"
+              f"{reference_time / current_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the backend hot paths
+Seeds throwaway SQLite databases with deterministic synthetic data, serves saved HTML fixtures
+and a stub search API from a local HTTP server, and answers chat requests with a stub LLM,
+so runs need no network access and can be compared across commits
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BACKEND_DIR, "benchmark_fixtures")
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Words that the benchmark queries search for, mixed into otherwise random text
+TOPIC_WORDS = [
+    "admission", "tuition", "grade", "math", "science", "schedule", "fee", "contact",
+    "algebra", "biology", "enrollment", "requirements", "scholarship", "uniform", "library"
+]
+QUERIES = [
+    "what are the admission requirements",
+    "tuition fee for grade 9",
+    "math schedule",
+    "science library contact",
+    "scholarship enrollment deadline"
+]
+CHAT_QUERIES = [
+    "explain the quadratic formula",
+    "help me study for my biology exam",
+    "what is photosynthesis",
+    "summarize the causes of world war one",
+    "how do I write a thesis statement"
+]
+
+
+class SyntheticData:
+    """Deterministic text and rows for a given seed"""
+
+    def __init__(self, seed: int = 42, vocabulary_size: int = 2000):
+        self.random = random.Random(seed)
+        self.vocabulary = [self._word() for _ in range(vocabulary_size)] + TOPIC_WORDS
+
+    def _word(self) -> str:
+        """Random lowercase word"""
+        return "".join(self.random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(self.random.randint(3, 9)))
+
+    def sentence(self, words: int) -> str:
+        """Random sentence drawn from the vocabulary"""
+        return " ".join(self.random.choice(self.vocabulary) for _ in range(words)).capitalize() + "."
+
+    def timestamp(self, start: datetime, index: int) -> str:
+        """ISO timestamp that increases with index, with jitter"""
+        return (start + timedelta(seconds=index * 60 + self.random.randint(0, 59))).isoformat()
+
+
+def seed_knowledge(db_path: str, rows: int, data: SyntheticData):
+    """Fill knowledge_base with rows entries"""
+    from database import DatabaseManager
+
+    DatabaseManager(db_path)
+    categories = ["Admissions", "Academics", "Finance", "Student Life", "Grade 9"]
+    start = datetime(2024, 1, 1)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO knowledge_base (category, title, content, tags, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (data.random.choice(categories), data.sentence(6), data.sentence(80),
+             json.dumps([data.random.choice(TOPIC_WORDS)]), data.timestamp(start, i), data.timestamp(start, i))
+            for i in range(rows)
+        ))
+        conn.commit()
+
+
+def seed_sessions(db_path: str, rows: int, data: SyntheticData, messages_per_session: int = 2):
+    """Fill chat_sessions with rows sessions and conversations with their messages"""
+    from chat_manager import ChatManager
+    from database import DatabaseManager
+
+    ChatManager(DatabaseManager(db_path))
+    start = datetime(2024, 1, 1)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO chat_sessions (id, title, model, created_at, updated_at, is_starred, is_archived,
+                                       summary, message_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            (f"session-{i}", data.sentence(5), data.random.choice(["general", "everest", "web_scraper"]),
+             data.timestamp(start, i), data.timestamp(start, i), int(data.random.random() < 0.05),
+             int(data.random.random() < 0.1), data.sentence(12), messages_per_session)
+            for i in range(rows)
+        ))
+        conn.executemany('''
+            INSERT INTO chat_metadata (session_id) VALUES (?)
+        ''', ((f"session-{i}",) for i in range(rows)))
+        conn.executemany('''
+            INSERT INTO conversations (session_id, role, content, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            (f"session-{i}", "user" if j % 2 == 0 else "assistant", data.sentence(30), data.timestamp(start, i))
+            for i in range(rows) for j in range(messages_per_session)
+        ))
+        conn.commit()
+
+
+def website_pages(count: int, data: SyntheticData) -> list:
+    """Website content in the shape returned by scrape_everest_website"""
+    return [
+        {
+            "url": f"https://everestmanila.com/page-{i}",
+            "title": data.sentence(5),
+            "content": data.sentence(90)
+        }
+        for i in range(count)
+    ]
+
+
+def load_response_corpus(db_path: str, data: SyntheticData) -> list:
+    """Stored assistant responses, or synthetic markdown when the database has none"""
+    corpus = []
+    if os.path.exists(db_path):
+        try:
+            with sqlite3.connect(db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT content FROM conversations WHERE role = 'assistant'")
+                corpus = [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load response corpus: {e}")
+    if corpus:
+        return corpus
+    return [
+        "\n".join([f"## {data.sentence(4)}", data.sentence(40)] +
+                  [f"-   {data.sentence(10)} [source](https://everestmanila.com/{i} target=\"_blank\")"
+                   for i in range(5)])
+        for _ in range(50)
+    ]
+
+
+class StubHTTPHandler(SimpleHTTPRequestHandler):
+    """Serves the HTML fixtures, and a canned instant-answer response under /ddg"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES_DIR, **kwargs)
+
+    def do_GET(self):
+        if self.path.startswith("/ddg"):
+            body = json.dumps({
+                "Heading": "Stub result",
+                "Abstract": "Canned instant answer served by the benchmark stub server.",
+                "AbstractSource": "Stub",
+                "AbstractURL": "http://127.0.0.1/stub",
+                "RelatedTopics": []
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == "/":
+            self.path = "/index.html"
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """Local HTTP server running in a background thread"""
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHTTPHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubResponse:
+    """Stands in for a LangChain message"""
+
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """Returns a fixed markdown answer with no network call"""
+
+    def __init__(self, answer: str, latency: float = 0.0):
+        self.answer = answer
+        self.latency = latency
+        self.temperature = 0.7
+        self.max_tokens = 400
+
+    def invoke(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        return StubResponse(self.answer)
+
+
+def measure(func, min_time: float, min_runs: int = 3, max_runs: int = 1000) -> list:
+    """Run func until min_time has elapsed (at least min_runs times); per-call seconds"""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (len(timings) < min_runs or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name: str, size, timings: list) -> dict:
+    """Median, p95 and best of the per-call timings in milliseconds"""
+    ordered = sorted(timings)
+    return {
+        "benchmark": name,
+        "size": size,
+        "runs": len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "min_ms": round(ordered[0] * 1000, 4)
+    }
+
+
+def cycle(items: list):
+    """Callable returning the items in turn"""
+    state = {"index": 0}
+
+    def next_item():
+        item = items[state["index"] % len(items)]
+        state["index"] += 1
+        return item
+    return next_item
+
+
+def bench_knowledge(work_dir: str, sizes: list, args) -> list:
+    """DatabaseManager.get_relevant_knowledge and the hybrid retriever (BM25 side)"""
+    from database import DatabaseManager
+    from knowledge_service import KnowledgeService
+
+    results = []
+    for size in sizes:
+        db_path = os.path.join(work_dir, f"knowledge_{size}.db")
+        seed_knowledge(db_path, size, SyntheticData(args.seed))
+        db = DatabaseManager(db_path)
+        query = cycle(QUERIES)
+        timings = measure(lambda: db.get_relevant_knowledge(query(), 5), args.min_time)
+        results.append(summarize("database.get_relevant_knowledge", size, timings))
+        retriever = KnowledgeService(db).retriever
+        retriever.search(QUERIES[0], 5)  # builds the index
+        timings = measure(lambda: retriever.search(query(), 5), args.min_time)
+        results.append(summarize("retrieval.search", size, timings))
+    return results
+
+
+def bench_sessions(work_dir: str, sizes: list, args) -> list:
+    """ChatManager.get_all_sessions and search_sessions"""
+    from chat_manager import ChatManager
+    from database import DatabaseManager
+
+    results = []
+    for size in sizes:
+        db_path = os.path.join(work_dir, f"sessions_{size}.db")
+        seed_sessions(db_path, size, SyntheticData(args.seed))
+        manager = ChatManager(DatabaseManager(db_path))
+        timings = measure(manager.get_all_sessions, args.min_time)
+        results.append(summarize("chat_manager.get_all_sessions", size, timings))
+        term = cycle(TOPIC_WORDS)
+        timings = measure(lambda: manager.search_sessions(term()), args.min_time)
+        results.append(summarize("chat_manager.search_sessions", size, timings))
+    return results
+
+
+def bench_scraper(server: StubServer, args) -> list:
+    """DynamicWebScraper on the saved HTML fixtures"""
+    from bs4 import BeautifulSoup
+    from dynamic_scraper import DynamicWebScraper
+
+    scraper = DynamicWebScraper(server.base_url)
+    results = []
+    for fixture in sorted(os.listdir(FIXTURES_DIR)):
+        path = os.path.join(FIXTURES_DIR, fixture)
+        with open(path, "rb") as f:
+            html = f.read()
+        url = f"{server.base_url}/{fixture}"
+        timings = measure(
+            lambda: scraper.extract_structured_content(BeautifulSoup(html, "html.parser"), url), args.min_time
+        )
+        results.append(summarize(f"scraper.extract_structured_content[{fixture}]", len(html), timings))
+        timings = measure(lambda: scraper.scrape_url_with_context(url, "admission process"), args.min_time)
+        results.append(summarize(f"scraper.scrape_url_with_context[{fixture}]", len(html), timings))
+    return results
+
+
+def bench_website_search(sizes: list, args) -> list:
+    """KnowledgeService._search_website_content"""
+    from knowledge_service import KnowledgeService
+
+    service = KnowledgeService(None)
+    results = []
+    for size in sizes:
+        pages = website_pages(size, SyntheticData(args.seed))
+        query = cycle(QUERIES)
+        timings = measure(lambda: service._search_website_content(query(), pages, 3), args.min_time)
+        results.append(summarize("knowledge_service._search_website_content", size, timings))
+    return results
+
+
+def bench_markdown(args) -> list:
+    """clean_markdown_response over stored responses"""
+    from markdown_cleaner import clean_markdown_response
+
+    corpus = load_response_corpus(args.corpus_db, SyntheticData(args.seed))
+    timings = measure(lambda: [clean_markdown_response(text) for text in corpus], args.min_time)
+    # Per response, so corpora of different sizes stay comparable
+    per_response = [t / len(corpus) for t in timings]
+    return [summarize("markdown_cleaner.clean_markdown_response", len(corpus), per_response)]
+
+
+def bench_chat(work_dir: str, server: StubServer, args) -> list:
+    """POST /api/chat end to end with the stub LLM and stub search API"""
+    try:
+        from fastapi.testclient import TestClient
+        # main opens chatbot.db in the working directory, which is the scratch directory here
+        import main
+    except ImportError as e:
+        logger.error(f"Skipping /api/chat benchmark, backend dependencies are missing: {e}")
+        return []
+
+    import web_search
+    from markdown_cleaner import clean_markdown_response
+
+    answer = load_response_corpus(args.corpus_db, SyntheticData(args.seed))[0]
+    main.chat_processor.qwen_llm = StubLLM(answer, args.llm_latency)
+    web_search.web_searcher.ddg_api_url = f"{server.base_url}/ddg"
+    client = TestClient(main.app)
+    query = cycle(CHAT_QUERIES)
+
+    def post():
+        response = client.post("/api/chat", json={
+            "messages": [{"role": "user", "content": query()}],
+            "session_id": "benchmark",
+            "model": "general"
+        })
+        assert response.status_code == 200 and response.json()["message"] == clean_markdown_response(answer)
+
+    timings = measure(post, args.min_time)
+    return [summarize("api.chat[general]", len(CHAT_QUERIES), timings)]
+
+
+def bench_auth(args) -> list:
+    """get_current_user per request: JWT with a cold and a warm token cache, and the anonymous cookie"""
+    import asyncio
+    from starlette.requests import Request
+    from auth_middleware import UserSession, get_current_user, token_cache
+
+    def request(headers: dict):
+        return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+    loop = asyncio.new_event_loop()
+    token = UserSession.create_user_token("benchmark-user")
+    bearer = {"Authorization": f"Bearer {token}"}
+    anonymous = {"Cookie": f"session_id={UserSession.create_anonymous_session()}"}
+
+    def cold():
+        token_cache.clear()
+        loop.run_until_complete(get_current_user(request(bearer)))
+
+    results = [summarize("auth.get_current_user[jwt_uncached]", 1, measure(cold, args.min_time))]
+    timings = measure(lambda: loop.run_until_complete(get_current_user(request(bearer))), args.min_time)
+    results.append(summarize("auth.get_current_user[jwt_cached]", 1, timings))
+    timings = measure(lambda: loop.run_until_complete(get_current_user(request(anonymous))), args.min_time)
+    results.append(summarize("auth.get_current_user[anonymous_cookie]", 1, timings))
+    loop.close()
+    return results
+
+
+def git_commit() -> str:
+    """Current commit of the repository, if any"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> int:
+    """Print median ratios against a previous run; number of regressions beyond threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["benchmark"], r["size"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nCompared with {baseline['meta'].get('commit', '?')} ({baseline_path})")
+    print(f"{'benchmark':<58}{'size':>9}{'before':>12}{'after':>12}{'ratio':>8}")
+    for result in results:
+        before = previous.get((result["benchmark"], result["size"]))
+        if not before:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  regression"
+            regressions += 1
+        print(f"{result['benchmark']:<58}{result['size']:>9}{before['median_ms']:>10.3f}ms"
+              f"{result['median_ms']:>10.3f}ms{ratio:>7.2f}x{flag}")
+    return regressions
+
+
+SUITES = ["knowledge", "sessions", "scraper", "website_search", "markdown", "auth", "chat"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the backend hot paths")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help="Row counts for the database and website benchmarks (up to 1000000)")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=SUITES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to spend on each measurement")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM waits per call")
+    parser.add_argument("--corpus-db", default=os.path.join(BACKEND_DIR, "chatbot.db"),
+                        help="Database whose assistant responses are used as markdown input")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Previous --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.10,
+                        help="Median ratio above which --compare reports a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, BACKEND_DIR)
+    work_dir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    original_dir = os.getcwd()
+    os.chdir(work_dir)
+    results = []
+    try:
+        with StubServer() as server:
+            if "knowledge" in args.only:
+                results += bench_knowledge(work_dir, args.sizes, args)
+            if "sessions" in args.only:
+                results += bench_sessions(work_dir, args.sizes, args)
+            if "scraper" in args.only:
+                results += bench_scraper(server, args)
+            if "website_search" in args.only:
+                results += bench_website_search(args.sizes, args)
+            if "markdown" in args.only:
+                results += bench_markdown(args)
+            if "auth" in args.only:
+                results += bench_auth(args)
+            if "chat" in args.only:
+                results += bench_chat(work_dir, server, args)
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'benchmark':<58}{'size':>9}{'runs':>7}{'median':>12}{'p95':>12}")
+    for result in results:
+        print(f"{result['benchmark']:<58}{result['size']:>9}{result['runs']:>7}"
+              f"{result['median_ms']:>10.3f}ms{result['p95_ms']:>10.3f}ms")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "sizes": args.sizes
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
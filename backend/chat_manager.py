@@ -3,11 +3,11 @@
 Enhanced chat management system with history, folders, and advanced features
 """
 
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timedelta
+import base64
 import json
 import logging
-import sqlite3
 import time
 from database import DatabaseManager
 
@@ -16,6 +16,8 @@ logger = logging.getLogger(__name__)
 class ChatManager:
     """Manages chat sessions, history, and folders"""
     
+    MAX_PAGE_SIZE = 200
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
         self._init_chat_tables()
@@ -23,11 +25,11 @@ class ChatManager:
     def _init_chat_tables(self):
         """Initialize chat-related tables"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Chat sessions table
-                cursor.execute('''
+                cursor.execute(self.db.storage.ddl('''
                     CREATE TABLE IF NOT EXISTS chat_sessions (
                         id TEXT PRIMARY KEY,
                         title TEXT NOT NULL,
@@ -41,10 +43,10 @@ class ChatManager:
                         tags TEXT,
                         message_count INTEGER DEFAULT 0
                     )
-                ''')
+                '''))
                 
                 # Chat folders table
-                cursor.execute('''
+                cursor.execute(self.db.storage.ddl('''
                     CREATE TABLE IF NOT EXISTS chat_folders (
                         id TEXT PRIMARY KEY,
                         name TEXT NOT NULL,
@@ -54,10 +56,10 @@ class ChatManager:
                         parent_id TEXT,
                         sort_order INTEGER DEFAULT 0
                     )
-                ''')
+                '''))
                 
                 # Chat metadata table
-                cursor.execute('''
+                cursor.execute(self.db.storage.ddl('''
                     CREATE TABLE IF NOT EXISTS chat_metadata (
                         session_id TEXT PRIMARY KEY,
                         total_tokens INTEGER DEFAULT 0,
@@ -67,13 +69,37 @@ class ChatManager:
                         view_count INTEGER DEFAULT 0,
                         FOREIGN KEY (session_id) REFERENCES chat_sessions(id)
                     )
-                ''')
+                '''))
                 
                 # Create indexes
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_updated ON chat_sessions(updated_at DESC)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_folder ON chat_sessions(folder_id)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_starred ON chat_sessions(is_starred)')
                 
+                # Keyset pagination indexes, in session list order: (updated_at, id) descending
+                first_migration = not self.db.storage.index_exists(cursor, 'idx_sessions_archived_keyset')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_sessions_archived_keyset
+                    ON chat_sessions(is_archived, updated_at DESC, id DESC)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_sessions_folder_keyset
+                    ON chat_sessions(folder_id, is_archived, updated_at DESC, id DESC)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_sessions_starred_keyset
+                    ON chat_sessions(is_starred, is_archived, updated_at DESC, id DESC)
+                ''')
+                
+                # message_count is maintained on write from now on; resync it once from existing messages
+                if first_migration:
+                    cursor.execute('''
+                        UPDATE chat_sessions
+                        SET message_count = (
+                            SELECT COUNT(*) FROM conversations WHERE session_id = chat_sessions.id
+                        )
+                    ''')
+                
                 conn.commit()
         except Exception as e:
             logger.error(f"Failed to initialize chat tables: {e}")
@@ -81,7 +107,7 @@ class ChatManager:
     def create_session(self, session_id: str, title: str = "New Chat", model: str = "general") -> Dict:
         """Create a new chat session"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 now_iso = datetime.now().isoformat()
                 cursor.execute('''
@@ -112,14 +138,14 @@ class ChatManager:
     def get_session(self, session_id: str) -> Optional[Dict]:
         """Get a specific chat session"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
+                self.db.storage.execute(cursor, '''
                     SELECT s.*, m.total_tokens, m.view_count
                     FROM chat_sessions s
                     LEFT JOIN chat_metadata m ON s.id = m.session_id
                     WHERE s.id = ?
-                ''', (session_id,))
+                ''', (session_id,), prepare=True)
                 
                 row = cursor.fetchone()
                 if row:
@@ -143,53 +169,107 @@ class ChatManager:
             logger.error(f"Failed to get session: {e}")
             return None
     
-    def get_all_sessions(self, include_archived: bool = False) -> List[Dict]:
-        """Get all chat sessions"""
-        try:
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                
-                query = '''
-                    SELECT s.*, m.total_tokens, 
-                           (SELECT COUNT(*) FROM conversations WHERE session_id = s.id) as actual_count
-                    FROM chat_sessions s
-                    LEFT JOIN chat_metadata m ON s.id = m.session_id
-                '''
-                
-                if not include_archived:
-                    query += ' WHERE s.is_archived = 0'
-                
-                query += ' ORDER BY s.updated_at DESC'
-                
-                cursor.execute(query)
-                rows = cursor.fetchall()
-                
-                sessions = []
-                for row in rows:
-                    sessions.append({
-                        'id': row[0],
-                        'title': row[1],
-                        'model': row[2],
-                        'created_at': row[3],
-                        'updated_at': row[4],
-                        'folder_id': row[5],
-                        'is_starred': bool(row[6]),
-                        'is_archived': bool(row[7]),
-                        'summary': row[8],
-                        'tags': json.loads(row[9]) if row[9] else [],
-                        'message_count': row[12] if len(row) > 12 else row[10],
-                        'total_tokens': row[11] if len(row) > 11 else 0
-                    })
-                
+    def _session_from_row(self, row) -> Dict:
+        """Session dict from a chat_sessions row followed by total_tokens"""
+        return {
+            'id': row[0],
+            'title': row[1],
+            'model': row[2],
+            'created_at': row[3],
+            'updated_at': row[4],
+            'folder_id': row[5],
+            'is_starred': bool(row[6]),
+            'is_archived': bool(row[7]),
+            'summary': row[8],
+            'tags': json.loads(row[9]) if row[9] else [],
+            'message_count': row[10] or 0,
+            'total_tokens': row[11] if len(row) > 11 and row[11] is not None else 0
+        }
+    
+    def get_all_sessions(self, include_archived: bool = False, folder_id: Optional[str] = None,
+                         starred: Optional[bool] = None, archived: Optional[bool] = None) -> List[Dict]:
+        """Get all chat sessions matching the filters; archived overrides include_archived"""
+        if archived is None and not include_archived:
+            archived = False
+        sessions = []
+        cursor = None
+        while True:
+            page = self.get_sessions_page(
+                limit=self.MAX_PAGE_SIZE, cursor=cursor, folder_id=folder_id, starred=starred, archived=archived
+            )
+            sessions.extend(page['sessions'])
+            cursor = page['next_cursor']
+            if not cursor:
                 return sessions
+    
+    @staticmethod
+    def encode_cursor(updated_at: str, session_id: str) -> str:
+        """Opaque cursor for the position after a session"""
+        return base64.urlsafe_b64encode(json.dumps([updated_at, session_id]).encode()).decode()
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """(updated_at, id) of the last session on the previous page"""
+        try:
+            updated_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return str(updated_at), str(session_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+    
+    def get_sessions_page(self, limit: int = 50, cursor: Optional[str] = None, folder_id: Optional[str] = None,
+                          starred: Optional[bool] = None, archived: Optional[bool] = False) -> Dict:
+        """Get one page of sessions, most recently updated first
+        
+        Pages are keyed on (updated_at, id), so each page is an index range scan however
+        many sessions exist. archived=None returns archived and active sessions.
+        """
+        limit = max(1, min(limit, self.MAX_PAGE_SIZE))
+        conditions = []
+        params = []
+        if archived is not None:
+            conditions.append('s.is_archived = ?')
+            params.append(int(archived))
+        if folder_id is not None:
+            conditions.append('s.folder_id = ?')
+            params.append(folder_id)
+        if starred is not None:
+            conditions.append('s.is_starred = ?')
+            params.append(int(starred))
+        if cursor:
+            conditions.append('(s.updated_at, s.id) < (?, ?)')
+            params.extend(self.decode_cursor(cursor))
+        
+        query = '''
+            SELECT s.*, m.total_tokens
+            FROM chat_sessions s
+            LEFT JOIN chat_metadata m ON s.id = m.session_id
+        '''
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY s.updated_at DESC, s.id DESC LIMIT ?'
+        # One extra row tells whether another page follows
+        params.append(limit + 1)
+        
+        try:
+            with self.db.storage.connect() as conn:
+                db_cursor = conn.cursor()
+                db_cursor.execute(query, params)
+                rows = db_cursor.fetchall()
         except Exception as e:
-            logger.error(f"Failed to get sessions: {e}")
-            return []
+            logger.error(f"Failed to get sessions page: {e}")
+            return {'sessions': [], 'next_cursor': None}
+        
+        sessions = [self._session_from_row(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = sessions[-1]
+            next_cursor = self.encode_cursor(last['updated_at'], last['id'])
+        return {'sessions': sessions, 'next_cursor': next_cursor}
     
     def update_session(self, session_id: str, **kwargs) -> bool:
         """Update session properties"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Build update query
@@ -226,7 +306,7 @@ class ChatManager:
     def delete_session(self, session_id: str) -> bool:
         """Delete a chat session and all its messages"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Delete messages first
@@ -239,6 +319,7 @@ class ChatManager:
                 cursor.execute('DELETE FROM chat_sessions WHERE id = ?', (session_id,))
                 
                 conn.commit()
+                self.db.conversation_cache.invalidate(session_id)
                 return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Failed to delete session: {e}")
@@ -262,7 +343,7 @@ class ChatManager:
     def search_sessions(self, query: str) -> List[Dict]:
         """Search through chat sessions and messages"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Search in session titles and messages
@@ -301,7 +382,7 @@ class ChatManager:
                      icon: str = '📁', parent_id: str = None) -> Dict:
         """Create a new folder"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO chat_folders (id, name, color, icon, parent_id)
@@ -323,7 +404,7 @@ class ChatManager:
     def get_folders(self) -> List[Dict]:
         """Get all folders"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM chat_folders
@@ -349,10 +430,25 @@ class ChatManager:
             logger.error(f"Failed to get folders: {e}")
             return []
     
+    def increment_message_count(self, session_id: str, count: int = 1) -> None:
+        """Add newly saved messages to the session's maintained message count"""
+        try:
+            with self.db.storage.connect() as conn:
+                cursor = conn.cursor()
+                self.db.storage.execute(cursor, '''
+                    UPDATE chat_sessions
+                    SET message_count = message_count + ?,
+                    updated_at = ?
+                    WHERE id = ?
+                ''', (count, datetime.now().isoformat(), session_id), prepare=True)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to increment message count: {e}")
+    
     def update_message_count(self, session_id: str) -> None:
-        """Update the message count for a session"""
+        """Recount the messages of a session, e.g. after its history was cleared"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE chat_sessions 
@@ -370,7 +466,7 @@ class ChatManager:
     def get_session_stats(self) -> Dict:
         """Get overall chat statistics"""
         try:
-            with sqlite3.connect(self.db.db_path) as conn:
+            with self.db.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 stats = {}
@@ -392,13 +488,14 @@ class ChatManager:
                 stats['sessions_by_model'] = dict(cursor.fetchall())
                 
                 # Recent activity
+                week_ago = (datetime.now() - timedelta(days=7)).isoformat()
                 cursor.execute('''
                     SELECT DATE(created_at) as date, COUNT(*) as count
                     FROM chat_sessions
-                    WHERE created_at > datetime('now', '-7 days')
+                    WHERE created_at > ?
                     GROUP BY DATE(created_at)
                     ORDER BY date DESC
-                ''')
+                ''', (week_ago,))
                 stats['recent_activity'] = [
                     {'date': row[0], 'count': row[1]} 
                     for row in cursor.fetchall()
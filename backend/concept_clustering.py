@@ -0,0 +1,154 @@
+"""
+Incremental concept clustering for study organization
+Caches concept embeddings and updates persisted mini-batch k-means centroids as new concepts arrive
+"""
+import logging
+import pickle
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ConceptClusteringService:
+    """Clusters concepts with cached embeddings and incrementally updated centroids"""
+
+    def __init__(self, embeddings_handler, state_path: Optional[str] = None, batch_size: int = 256):
+        self.embeddings_handler = embeddings_handler
+        self.state_path = Path(state_path) if state_path else embeddings_handler.cache_dir / "concept_clusters.pkl"
+        self.batch_size = batch_size
+        self.lock = Lock()
+        self.embedding_cache: Dict[str, np.ndarray] = {}
+        self.models = {}  # num_clusters -> fitted MiniBatchKMeans
+        self.fitted_concepts: Dict[int, set] = {}  # num_clusters -> concepts already seen by that model
+        self._kmeans_cls = None
+        self._load_state()
+
+    def _load_state(self):
+        """Load cached embeddings and centroids from a previous run"""
+        if not self.state_path.exists():
+            return
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('model') != self.embeddings_handler.model:
+                logger.info("Embedding model changed, discarding cached clustering state")
+                return
+            self.embedding_cache = state.get('embeddings', {})
+            self.models = state.get('models', {})
+            self.fitted_concepts = state.get('fitted_concepts', {})
+            logger.info(f"Loaded {len(self.embedding_cache)} cached concept embeddings")
+        except Exception as e:
+            logger.error(f"Failed to load clustering state: {e}")
+
+    def _save_state(self):
+        """Persist embeddings and centroids so the next run starts warm"""
+        try:
+            tmp_path = self.state_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({
+                    'model': self.embeddings_handler.model,
+                    'embeddings': self.embedding_cache,
+                    'models': self.models,
+                    'fitted_concepts': self.fitted_concepts
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(self.state_path)
+        except Exception as e:
+            logger.error(f"Failed to save clustering state: {e}")
+
+    def _get_kmeans_cls(self):
+        """Import scikit-learn only when clustering is first needed"""
+        if self._kmeans_cls is None:
+            from sklearn.cluster import MiniBatchKMeans
+            self._kmeans_cls = MiniBatchKMeans
+        return self._kmeans_cls
+
+    def get_embeddings(self, concepts: List[str]) -> Optional[np.ndarray]:
+        """Embed concepts, calling the API only for ones not seen before"""
+        missing = list(dict.fromkeys(c for c in concepts if c not in self.embedding_cache))
+        if missing:
+            new_embeddings = self.embeddings_handler.get_embeddings(missing)
+            if len(new_embeddings) != len(missing):
+                return None
+            for concept, embedding in zip(missing, new_embeddings):
+                self.embedding_cache[concept] = np.asarray(embedding, dtype=np.float32)
+        return np.vstack([self.embedding_cache[c] for c in concepts])
+
+    def add_concepts(self, concepts: List[str], num_clusters: int = 5) -> bool:
+        """Update centroids with concepts the model has not seen yet"""
+        with self.lock:
+            updated = self._partial_fit(concepts, num_clusters)
+            if updated:
+                self._save_state()
+            return updated
+
+    def _partial_fit(self, concepts: List[str], num_clusters: int) -> bool:
+        seen = self.fitted_concepts.setdefault(num_clusters, set())
+        new_concepts = list(dict.fromkeys(c for c in concepts if c not in seen))
+        if not new_concepts:
+            return False
+
+        model = self.models.get(num_clusters)
+        if model is None and len(new_concepts) < num_clusters:
+            # k-means needs at least one sample per cluster for its first batch
+            return False
+
+        embeddings = self.get_embeddings(new_concepts)
+        if embeddings is None:
+            return False
+
+        if model is None:
+            model = self._get_kmeans_cls()(
+                n_clusters=num_clusters,
+                batch_size=self.batch_size,
+                random_state=42,
+                n_init=3
+            )
+            self.models[num_clusters] = model
+
+        for start in range(0, len(embeddings), self.batch_size):
+            model.partial_fit(embeddings[start:start + self.batch_size])
+
+        seen.update(new_concepts)
+        return True
+
+    def cluster(self, concepts: List[str], num_clusters: int = 5) -> Dict[int, List[str]]:
+        """Assign concepts to clusters, updating centroids with any new concepts first"""
+        if not concepts:
+            return {}
+
+        num_clusters = min(num_clusters, len(set(concepts)))
+
+        with self.lock:
+            embeddings = self.get_embeddings(concepts)
+            if embeddings is None:
+                return {}
+
+            updated = self._partial_fit(concepts, num_clusters)
+            model = self.models.get(num_clusters)
+            if model is None:
+                return {}
+
+            labels = model.predict(embeddings)
+            if updated:
+                self._save_state()
+
+        clustered_concepts = {}
+        for concept, cluster_id in zip(concepts, labels):
+            clustered_concepts.setdefault(int(cluster_id), []).append(concept)
+
+        return clustered_concepts
+
+    def reset(self, num_clusters: Optional[int] = None):
+        """Drop fitted centroids (all, or for one cluster count) while keeping cached embeddings"""
+        with self.lock:
+            if num_clusters is None:
+                self.models.clear()
+                self.fitted_concepts.clear()
+            else:
+                self.models.pop(num_clusters, None)
+                self.fitted_concepts.pop(num_clusters, None)
+            self._save_state()
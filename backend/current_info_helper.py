@@ -8,6 +8,8 @@ import logging
 import requests
 from typing import Dict, Optional
 
+from intent_router import classify
+
 logger = logging.getLogger(__name__)
 
 class CurrentInfoHelper:
@@ -45,15 +47,7 @@ class CurrentInfoHelper:
     @staticmethod
     def needs_current_info(query: str) -> bool:
         """Check if query needs current information"""
-        current_info_keywords = [
-            'today', 'current', 'now', 'present', 'latest',
-            'date', 'time', 'president', 'year', 'month',
-            'news', 'recent', 'update', 'happening',
-            'what day', 'what time', 'what year'
-        ]
-        
-        query_lower = query.lower()
-        return any(keyword in query_lower for keyword in current_info_keywords)
+        return classify(query).has('current_info')
     
     @staticmethod
     def get_web_search_context(query: str) -> Optional[str]:
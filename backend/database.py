@@ -1,24 +1,248 @@
-import sqlite3
 import json
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Iterable, List, Dict, Optional, Any, Tuple
 import logging
+from storage import Storage, create_storage
 
 logger = logging.getLogger(__name__)
 
+# Indexes that bulk imports may drop and rebuild once at the end
+KNOWLEDGE_SECONDARY_INDEXES = {
+    'idx_knowledge_category': 'CREATE INDEX IF NOT EXISTS idx_knowledge_category ON knowledge_base(category)',
+    'idx_knowledge_tags': 'CREATE INDEX IF NOT EXISTS idx_knowledge_tags ON knowledge_base(tags)'
+}
+# Errors reported back from one import; the rest are only counted
+MAX_IMPORT_ERRORS = 100
+# Entries of knowledge_changes kept after a bulk import; workers further behind reload everything
+KNOWLEDGE_CHANGE_RETENTION = 100000
+KNOWLEDGE_COLUMNS = 'id, category, title, content, tags, created_at, updated_at'
+
+
+def _knowledge_entry(row) -> Dict:
+    """Snapshot entry of a knowledge_base row"""
+    return {
+        'id': row[0],
+        'category': row[1],
+        'title': row[2],
+        'content': row[3],
+        'tags': json.loads(row[4]) if row[4] else [],
+        'created_at': row[5],
+        'updated_at': row[6],
+        # What "tags LIKE ?" matches against
+        'tags_text': (row[4] or '').lower()
+    }
+
+class ConversationTailCache:
+    """Last messages of recently active sessions, kept in step with writes
+    
+    Each entry holds up to tail_size messages in chronological order and knows whether
+    that is the whole session. It also records the session's highest message id, which
+    readers check against the database: other workers write the same tables, and a seek on
+    the (session_id, id) index tells whether they did. Appends check the id before theirs,
+    so a message another worker saved in between drops the entry instead of leaving a gap.
+    """
+    
+    def __init__(self, tail_size: int = 20, max_sessions: int = 1000):
+        self.tail_size = tail_size
+        self.max_sessions = max_sessions
+        self.entries = OrderedDict()  # session_id -> (deque of messages, complete, last id)
+        self.reads = {}  # session_id -> token of a database read that may still fill the entry
+        self.lock = Lock()
+    
+    def get(self, session_id: str, limit: int) -> Optional[Tuple[List[Dict], Optional[int]]]:
+        """Most recent limit messages and the last id they reflect, or None if the cache cannot answer"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            messages, complete, last_id = entry
+            if len(messages) < limit and not complete:
+                return None
+            self.entries.move_to_end(session_id)
+            tail = [dict(message) for message in list(messages)[-limit:]] if limit > 0 else []
+            return tail, last_id
+    
+    def begin_read(self, session_id: str) -> object:
+        """Token to pass to fill; writes in between make the read stale"""
+        token = object()
+        with self.lock:
+            self.reads[session_id] = token
+        return token
+    
+    def fill(self, session_id: str, messages: List[Dict], complete: bool, token: object,
+             last_id: Optional[int]):
+        """Store the tail read from the database unless the session changed meanwhile"""
+        with self.lock:
+            if self.reads.get(session_id) is not token:
+                return
+            del self.reads[session_id]
+            complete = complete and len(messages) <= self.tail_size
+            self.entries[session_id] = (deque(messages[-self.tail_size:], maxlen=self.tail_size), complete, last_id)
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > self.max_sessions:
+                self.entries.popitem(last=False)
+    
+    def append(self, session_id: str, message: Dict, message_id: int, previous_id: Optional[int]):
+        """Add a newly saved message to a cached session; previous_id is the session's id before it"""
+        with self.lock:
+            self.reads.pop(session_id, None)
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return
+            messages, complete, last_id = entry
+            if last_id != previous_id:
+                # Another worker saved or deleted messages since the entry was filled
+                del self.entries[session_id]
+                return
+            # Once the oldest message falls off, the tail is no longer the whole session
+            complete = complete and len(messages) < self.tail_size
+            messages.append(message)
+            self.entries[session_id] = (messages, complete, message_id)
+    
+    def invalidate(self, session_id: str):
+        """Forget a session whose messages were deleted"""
+        with self.lock:
+            self.reads.pop(session_id, None)
+            self.entries.pop(session_id, None)
+
+class KnowledgeSnapshot:
+    """In-memory copy of knowledge_base, kept current through the knowledge_changes log
+    
+    Every write appends the ids it touched to knowledge_changes; the highest version there is
+    the knowledge version. Readers compare it with the version of their copy and reload only
+    the changed rows, so writes from any worker are seen on the next read. Writers log their
+    changes under the knowledge_write_lock row, so a version is only visible once every lower
+    version has committed and the reader never skips one.
+    """
+    
+    def __init__(self, storage: Storage, check_interval: float = 0.0, full_reload_changes: int = 5000):
+        self.storage = storage
+        self.check_interval = check_interval  # seconds between version checks; 0 checks on every read
+        self.full_reload_changes = full_reload_changes
+        self.entries = None  # id -> entry, in id order
+        self.category_list = None  # sorted categories of entries, built on first use
+        self.version = 0
+        self.next_check = 0.0
+        self.lock = Lock()
+    
+    def mark_stale(self):
+        """Check the version on the next read; called after local writes"""
+        self.next_check = 0.0
+    
+    def _load(self) -> Dict[int, Dict]:
+        with self.lock:
+            if self.entries is not None and time.monotonic() < self.next_check:
+                return self.entries
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                # Read the version before the rows: rows newer than it are simply applied again later
+                cursor.execute('SELECT MIN(version), MAX(version) FROM knowledge_changes')
+                oldest, latest = cursor.fetchone()
+                latest = latest or 0
+                if self.entries is None or (oldest and self.version < oldest - 1) \
+                        or latest - self.version > self.full_reload_changes:
+                    cursor.execute(f'SELECT {KNOWLEDGE_COLUMNS} FROM knowledge_base ORDER BY id')
+                    self.entries = {row[0]: _knowledge_entry(row) for row in cursor.fetchall()}
+                    self.category_list = None
+                elif latest != self.version:
+                    self._apply_changes(cursor)
+                    self.category_list = None
+            self.version = latest
+            self.next_check = time.monotonic() + self.check_interval
+            return self.entries
+    
+    def _apply_changes(self, cursor):
+        """Reload the rows changed since self.version; rows that are gone were deleted"""
+        self.storage.execute(cursor, 'SELECT DISTINCT knowledge_id FROM knowledge_changes WHERE version > ?',
+                             (self.version,))
+        changed = [row[0] for row in cursor.fetchall()]
+        entries = dict(self.entries)
+        for start in range(0, len(changed), 500):
+            batch = changed[start:start + 500]
+            cursor.execute(f'''
+                SELECT {KNOWLEDGE_COLUMNS} FROM knowledge_base WHERE id IN ({', '.join(['?'] * len(batch))})
+            ''', batch)
+            found = {row[0]: _knowledge_entry(row) for row in cursor.fetchall()}
+            for knowledge_id in batch:
+                if knowledge_id in found:
+                    entries[knowledge_id] = found[knowledge_id]
+                else:
+                    entries.pop(knowledge_id, None)
+        # Keep id order, as the queries this replaces returned rows in it
+        self.entries = dict(sorted(entries.items()))
+    
+    @staticmethod
+    def _copy(entry: Dict) -> Dict:
+        copy = {key: value for key, value in entry.items() if key != 'tags_text'}
+        copy['tags'] = list(entry['tags'])
+        return copy
+    
+    def view(self) -> Dict[int, Dict]:
+        """Current entries by id; shared, so read only. Each change replaces the dict"""
+        return self._load()
+    
+    def current_version(self) -> int:
+        """Knowledge version, checked as often as reads are"""
+        self._load()
+        return self.version
+    
+    def get(self, knowledge_id: int) -> Optional[Dict]:
+        """Entry by id"""
+        entry = self._load().get(knowledge_id)
+        return self._copy(entry) if entry else None
+    
+    def search(self, query: str = None, category: str = None, tags: List[str] = None) -> List[Dict]:
+        """Same matching and order as DatabaseManager.search_knowledge"""
+        query = query.lower() if query else None
+        tags = [tag.lower() for tag in tags] if tags else None
+        results = []
+        for entry in self._load().values():
+            if query and query not in entry['title'].lower() and query not in entry['content'].lower():
+                continue
+            if category and entry['category'] != category:
+                continue
+            if tags and not any(tag in entry['tags_text'] for tag in tags):
+                continue
+            results.append(entry)
+        # Stable, so entries updated at the same time stay in id order
+        results.sort(key=lambda entry: entry['updated_at'] or '', reverse=True)
+        return [self._copy(entry) for entry in results]
+    
+    def categories(self) -> List[str]:
+        """All unique categories, sorted"""
+        entries = self._load()
+        with self.lock:
+            if self.entries is not entries:
+                # Reloaded meanwhile
+                return sorted({entry['category'] for entry in entries.values()})
+            if self.category_list is None:
+                self.category_list = sorted({entry['category'] for entry in entries.values()})
+            return list(self.category_list)
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "chatbot.db"):
+    def __init__(self, db_path: str = "chatbot.db", storage: Optional[Storage] = None):
         self.db_path = db_path
+        # SQLite file at db_path unless DATABASE_URL selects PostgreSQL
+        self.storage = storage or create_storage(db_path)
+        # Per process; every hit is checked against the session's message count and last id
+        self.conversation_cache = ConversationTailCache()
         self.init_database()
+        self.knowledge_snapshot = KnowledgeSnapshot(
+            self.storage, check_interval=float(os.getenv("KNOWLEDGE_VERSION_CHECK_SECONDS", "1"))
+        )
     
     def init_database(self):
         """Initialize the database with required tables"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Knowledge base table
-                cursor.execute('''
+                cursor.execute(self.storage.ddl('''
                     CREATE TABLE IF NOT EXISTS knowledge_base (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         category TEXT NOT NULL,
@@ -28,10 +252,29 @@ class DatabaseManager:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
+                '''))
+                
+                # Ids touched by each knowledge write; the highest version is the knowledge version
+                cursor.execute(self.storage.ddl('''
+                    CREATE TABLE IF NOT EXISTS knowledge_changes (
+                        version INTEGER PRIMARY KEY AUTOINCREMENT,
+                        knowledge_id INTEGER NOT NULL,
+                        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                '''))
+                # One row that every knowledge write updates before logging its changes. The row lock is held
+                # until commit, so writers log in commit order: once a version is visible, no lower
+                # version can still appear (PostgreSQL hands out SERIAL values before commit)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS knowledge_write_lock (
+                        id INTEGER PRIMARY KEY,
+                        writes INTEGER NOT NULL
+                    )
                 ''')
+                cursor.execute('INSERT INTO knowledge_write_lock (id, writes) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
                 
                 # Conversation history table
-                cursor.execute('''
+                cursor.execute(self.storage.ddl('''
                     CREATE TABLE IF NOT EXISTS conversations (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         session_id TEXT NOT NULL,
@@ -39,13 +282,17 @@ class DatabaseManager:
                         content TEXT NOT NULL,
                         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
-                ''')
+                '''))
                 
                 # Create indexes for better performance
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_category ON knowledge_base(category)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_tags ON knowledge_base(tags)')
+                for sql in KNOWLEDGE_SECONDARY_INDEXES.values():
+                    cursor.execute(sql)
+                # Natural key of knowledge entries, used by bulk upserts
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_natural_key ON knowledge_base(category, title)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp)')
+                # Recent-window reads: newest messages of a session first
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_session_recent ON conversations(session_id, id DESC)')
                 
                 conn.commit()
                 logger.info("Database initialized successfully")
@@ -57,25 +304,168 @@ class DatabaseManager:
     def add_knowledge(self, category: str, title: str, content: str, tags: Optional[List[str]] = None) -> int:
         """Add a new knowledge entry"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 tags_str = json.dumps(tags) if tags else None
                 
-                cursor.execute('''
+                knowledge_id = self.storage.insert(cursor, '''
                     INSERT INTO knowledge_base (category, title, content, tags)
                     VALUES (?, ?, ?, ?)
                 ''', (category, title, content, tags_str))
+                self._record_knowledge_changes(cursor, [knowledge_id])
                 
                 conn.commit()
-                return cursor.lastrowid
+            self.knowledge_snapshot.mark_stale()
+            return knowledge_id
         except Exception as e:
             logger.error(f"Failed to add knowledge: {e}")
             raise
     
+    def bulk_upsert_knowledge(self, entries: Iterable[Dict], chunk_size: int = 1000,
+                              defer_indexes: bool = False, return_ids: bool = False) -> Dict[str, Any]:
+        """Insert or update knowledge entries keyed by (category, title), one transaction per chunk
+        
+        defer_indexes drops the secondary indexes for the duration of the import and rebuilds
+        them once at the end, which pays off for large imports. With return_ids, stats['ids']
+        has one id per entry in input order, None for entries that failed validation.
+        """
+        stats = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': [], 'ids': []}
+        if defer_indexes:
+            self._drop_secondary_knowledge_indexes()
+        try:
+            chunk = []
+            positions = []  # index in stats['ids'] of each chunk row
+            for number, entry in enumerate(entries, 1):
+                try:
+                    chunk.append(self._knowledge_row(entry))
+                except ValueError as e:
+                    stats['failed'] += 1
+                    if len(stats['errors']) < MAX_IMPORT_ERRORS:
+                        stats['errors'].append(f"Entry {number}: {e}")
+                    if return_ids:
+                        stats['ids'].append(None)
+                    continue
+                if return_ids:
+                    # Filled in once the entry's chunk is written
+                    positions.append(len(stats['ids']))
+                    stats['ids'].append(None)
+                if len(chunk) >= chunk_size:
+                    self._upsert_knowledge_chunk(chunk, stats, positions if return_ids else None)
+                    chunk, positions = [], []
+            if chunk:
+                self._upsert_knowledge_chunk(chunk, stats, positions if return_ids else None)
+        except Exception as e:
+            logger.error(f"Failed to bulk import knowledge: {e}")
+            raise
+        finally:
+            if defer_indexes:
+                self._create_secondary_knowledge_indexes()
+            self.knowledge_snapshot.mark_stale()
+        self._prune_knowledge_changes()
+        if not return_ids:
+            del stats['ids']
+        return stats
+    
+    @staticmethod
+    def _knowledge_row(entry: Dict) -> tuple:
+        """(category, title, content, tags) of an import entry"""
+        category, title, content = (str(entry.get(field) or '').strip() for field in ('category', 'title', 'content'))
+        if not category or not title or not content:
+            raise ValueError("category, title and content are required")
+        tags = entry.get('tags')
+        if isinstance(tags, str):
+            # CSV cells hold either a JSON list or comma-separated tags
+            tags = json.loads(tags) if tags.lstrip().startswith('[') else [tag.strip() for tag in tags.split(',') if tag.strip()]
+        # Readers copy and match tags as a list of strings, so anything else would break every search
+        if tags is not None and not (isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)):
+            raise ValueError("tags must be a list of strings")
+        return category, title, content, json.dumps(tags) if tags else None
+    
+    def _upsert_knowledge_chunk(self, rows: List[tuple], stats: Dict, positions: Optional[List[int]]):
+        """Update rows whose natural key exists and insert the rest, in one transaction
+        
+        positions gives the slot in stats['ids'] that receives each row's id.
+        """
+        # Later duplicates of a key within the chunk win
+        by_key = OrderedDict(((row[0], row[1]), row) for row in rows)
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            existing = self._knowledge_ids(cursor, list(by_key))
+            updates = [(row[2], row[3], row[0], row[1]) for key, row in by_key.items() if key in existing]
+            inserts = [row for key, row in by_key.items() if key not in existing]
+            if updates:
+                self.storage.executemany(cursor, '''
+                    UPDATE knowledge_base SET content = ?, tags = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE category = ? AND title = ?
+                ''', updates)
+            if inserts:
+                self.storage.executemany(cursor, '''
+                    INSERT INTO knowledge_base (category, title, content, tags)
+                    VALUES (?, ?, ?, ?)
+                ''', inserts)
+            if inserts:
+                existing.update(self._knowledge_ids(cursor, [(row[0], row[1]) for row in inserts]))
+            # UPDATE touched every row with the key, so log them all
+            self._record_knowledge_changes(cursor, [i for key in by_key for i in existing[key]])
+            if positions is not None:
+                # Every row gets the id of its key, including duplicates that lost to a later row
+                for position, row in zip(positions, rows):
+                    stats['ids'][position] = existing[(row[0], row[1])][0]
+        stats['updated'] += len(updates)
+        stats['inserted'] += len(inserts)
+    
+    @staticmethod
+    def _knowledge_ids(cursor, keys: List[tuple]) -> Dict[tuple, List[int]]:
+        """Ids, lowest first, of each (category, title) that exists; older data may repeat a key"""
+        ids = {}
+        # Two parameters per key; stays under SQLite's default variable limit
+        for start in range(0, len(keys), 400):
+            batch = keys[start:start + 400]
+            # A join, unlike a row-value IN, looks each key up in idx_knowledge_natural_key
+            cursor.execute(f'''
+                SELECT k.category, k.title, k.id
+                FROM (VALUES {', '.join(['(?, ?)'] * len(batch))}) AS v
+                JOIN knowledge_base k ON k.category = v.column1 AND k.title = v.column2
+                ORDER BY k.id
+            ''', [value for key in batch for value in key])
+            for category, title, knowledge_id in cursor.fetchall():
+                ids.setdefault((category, title), []).append(knowledge_id)
+        return ids
+    
+    def _record_knowledge_changes(self, cursor, knowledge_ids: List[int]):
+        """Log written ids in the same transaction, which advances the knowledge version
+        
+        Call it after the transaction's other writes: the write lock it takes is held until commit.
+        """
+        cursor.execute('UPDATE knowledge_write_lock SET writes = writes + 1 WHERE id = 1')
+        self.storage.executemany(cursor, 'INSERT INTO knowledge_changes (knowledge_id) VALUES (?)',
+                                 [(knowledge_id,) for knowledge_id in knowledge_ids])
+    
+    def _prune_knowledge_changes(self):
+        """Drop old change log entries; the newest one always stays, as it holds the version"""
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(version) FROM knowledge_changes')
+            latest = cursor.fetchone()[0] or 0
+            if latest > KNOWLEDGE_CHANGE_RETENTION:
+                cursor.execute('DELETE FROM knowledge_changes WHERE version <= ?', (latest - KNOWLEDGE_CHANGE_RETENTION,))
+    
+    def _drop_secondary_knowledge_indexes(self):
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            for name in KNOWLEDGE_SECONDARY_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    
+    def _create_secondary_knowledge_indexes(self):
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            for sql in KNOWLEDGE_SECONDARY_INDEXES.values():
+                cursor.execute(sql)
+    
     def get_knowledge_by_id(self, knowledge_id: int) -> Optional[Dict]:
         """Get knowledge entry by ID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT * FROM knowledge_base WHERE id = ?
@@ -100,7 +490,7 @@ class DatabaseManager:
     def search_knowledge(self, query: str = None, category: str = None, tags: List[str] = None) -> List[Dict]:
         """Search knowledge base"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 sql = "SELECT * FROM knowledge_base WHERE 1=1"
@@ -148,7 +538,7 @@ class DatabaseManager:
                         content: str = None, tags: List[str] = None) -> bool:
         """Update knowledge entry"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 updates = []
@@ -176,9 +566,13 @@ class DatabaseManager:
                     
                     sql = f"UPDATE knowledge_base SET {', '.join(updates)} WHERE id = ?"
                     cursor.execute(sql, params)
+                    updated = cursor.rowcount > 0
+                    if updated:
+                        self._record_knowledge_changes(cursor, [knowledge_id])
                     conn.commit()
+                    self.knowledge_snapshot.mark_stale()
                     
-                    return cursor.rowcount > 0
+                    return updated
                 
                 return False
         except Exception as e:
@@ -188,11 +582,15 @@ class DatabaseManager:
     def delete_knowledge(self, knowledge_id: int) -> bool:
         """Delete knowledge entry"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM knowledge_base WHERE id = ?', (knowledge_id,))
+                deleted = cursor.rowcount > 0
+                if deleted:
+                    self._record_knowledge_changes(cursor, [knowledge_id])
                 conn.commit()
-                return cursor.rowcount > 0
+            self.knowledge_snapshot.mark_stale()
+            return deleted
         except Exception as e:
             logger.error(f"Failed to delete knowledge: {e}")
             raise
@@ -200,7 +598,7 @@ class DatabaseManager:
     def get_all_categories(self) -> List[str]:
         """Get all unique categories"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT DISTINCT category FROM knowledge_base ORDER BY category')
                 return [row[0] for row in cursor.fetchall()]
@@ -212,33 +610,56 @@ class DatabaseManager:
     def save_conversation(self, session_id: str, role: str, content: str) -> int:
         """Save a conversation message"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Same format as CURRENT_TIMESTAMP, so cached and stored messages match
+            timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO conversations (session_id, role, content)
-                    VALUES (?, ?, ?)
-                ''', (session_id, role, content))
+                message_id = self.storage.insert(cursor, '''
+                    INSERT INTO conversations (session_id, role, content, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (session_id, role, content, timestamp))
+                self.storage.execute(cursor, '''
+                    SELECT MAX(id) FROM conversations WHERE session_id = ? AND id < ?
+                ''', (session_id, message_id), prepare=True)
+                previous_id = cursor.fetchone()[0]
                 conn.commit()
-                return cursor.lastrowid
+            self.conversation_cache.append(session_id, {
+                'role': role,
+                'content': content,
+                'timestamp': timestamp
+            }, message_id, previous_id)
+            return message_id
         except Exception as e:
             logger.error(f"Failed to save conversation: {e}")
             raise
     
     def get_conversation_history(self, session_id: str, limit: int = 50) -> List[Dict]:
-        """Get conversation history for a session"""
+        """Get the most recent limit messages of a session, oldest first"""
+        cached = self.conversation_cache.get(session_id, limit)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # Read at least a full tail so the next requests for this session hit the cache
+            fetch = max(limit, self.conversation_cache.tail_size)
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
+                # One seek on the (session_id, id) index; any insert or clear changes it
+                self.storage.execute(cursor, '''
+                    SELECT MAX(id) FROM conversations WHERE session_id = ?
+                ''', (session_id,), prepare=True)
+                last_id = cursor.fetchone()[0]
+                if cached is not None and cached[1] == last_id:
+                    return cached[0]
+                
+                token = self.conversation_cache.begin_read(session_id)
+                self.storage.execute(cursor, '''
                     SELECT role, content, timestamp 
                     FROM conversations 
                     WHERE session_id = ? 
-                    ORDER BY timestamp ASC 
+                    ORDER BY id DESC 
                     LIMIT ?
-                ''', (session_id, limit))
+                ''', (session_id, fetch), prepare=True)
                 
                 rows = cursor.fetchall()
-                return [
+                messages = [
                     {
                         'role': row[0],
                         'content': row[1],
@@ -246,6 +667,8 @@ class DatabaseManager:
                     }
                     for row in reversed(rows)  # Reverse to get chronological order
                 ]
+            self.conversation_cache.fill(session_id, messages, len(rows) < fetch, token, last_id)
+            return messages[-limit:] if limit > 0 else []
         except Exception as e:
             logger.error(f"Failed to get conversation history: {e}")
             raise
@@ -253,10 +676,11 @@ class DatabaseManager:
     def clear_conversation_history(self, session_id: str) -> bool:
         """Clear conversation history for a session"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM conversations WHERE session_id = ?', (session_id,))
                 conn.commit()
+                self.conversation_cache.invalidate(session_id)
                 return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Failed to clear conversation history: {e}")
@@ -266,7 +690,7 @@ class DatabaseManager:
         """Get relevant knowledge based on query similarity"""
         try:
             # Simple relevance scoring based on keyword matching
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.connect() as conn:
                 cursor = conn.cursor()
                 
                 # Split query into keywords
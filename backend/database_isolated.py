@@ -1,127 +1,307 @@
 """
 Isolated database management for multi-user support
+Each user has a SQLite file under data/users/<id>/chat.db; open handles are kept in an LRU cache
+bounded by an idle timeout and a file-descriptor budget
 """
 import sqlite3
 import json
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
 import logging
 
+from metrics import record_cache
+from storage import SQLiteStorage
+
 logger = logging.getLogger(__name__)
 
-class IsolatedDatabase:
-    """Database manager with user isolation"""
-    
-    def __init__(self, user_id: str):
+# Bump when the statements in _init_schema change; stored in each file's PRAGMA user_version
+SCHEMA_VERSION = 1
+# The database file plus its rollback journal while a write is in progress
+FDS_PER_HANDLE = 2
+# User ids name per-user files and directories, so they may not contain path separators or dots
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def validate_user_id(user_id: str) -> str:
+    """Return the user id if it is safe to use in a file path, else raise ValueError"""
+    if not USER_ID_PATTERN.match(user_id or ""):
+        raise ValueError("Invalid user id")
+    return user_id
+
+
+def _get_user_db_path(user_id: str) -> str:
+    """Get isolated database path for user"""
+    validate_user_id(user_id)
+    return os.path.join(f"data/users/{user_id}", "chat.db")
+
+
+def _init_schema(conn: sqlite3.Connection):
+    """Create the user's tables unless the file is already at SCHEMA_VERSION"""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA user_version')
+    if cursor.fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # Create sessions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            model TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_starred BOOLEAN DEFAULT 0,
+            folder_id TEXT
+        )
+    ''')
+
+    # Create messages table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT,
+            content TEXT,
+            model TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata TEXT,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    ''')
+
+    # Create folders table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS folders (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            parent_id TEXT
+        )
+    ''')
+
+    # Create user settings table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # PRAGMA does not take parameters
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+
+
+class UserDatabaseHandle:
+    """An open connection to one user's database"""
+
+    def __init__(self, user_id: str, conn: sqlite3.Connection):
         self.user_id = user_id
-        self.db_path = self._get_user_db_path()
-        self._init_db()
-    
-    def _get_user_db_path(self) -> str:
-        """Get isolated database path for user"""
+        self.conn = conn
+        # One unit of work at a time per connection
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class UserDatabasePool:
+    """LRU cache of open per-user SQLite handles"""
+
+    def __init__(self, fd_budget: int = 256, idle_timeout: float = 300.0):
+        self.max_handles = max(1, fd_budget // FDS_PER_HANDLE)
+        self.idle_timeout = idle_timeout
+        self.handles = OrderedDict()  # user_id -> UserDatabaseHandle, least recently used first
+        self.lock = threading.Lock()
+
+    def _open(self, user_id: str) -> UserDatabaseHandle:
+        """Open the user's file, creating its schema on first use"""
+        db_path = _get_user_db_path(user_id)
         # Create user directory if it doesn't exist
-        user_dir = f"data/users/{self.user_id}"
-        os.makedirs(user_dir, exist_ok=True)
-        return os.path.join(user_dir, "chat.db")
-    
-    def _init_db(self):
-        """Initialize user's database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                title TEXT,
-                model TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_starred BOOLEAN DEFAULT 0,
-                folder_id TEXT
-            )
-        ''')
-        
-        # Create messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                role TEXT,
-                content TEXT,
-                model TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                metadata TEXT,
-                FOREIGN KEY (session_id) REFERENCES sessions(id)
-            )
-        ''')
-        
-        # Create folders table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS folders (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                parent_id TEXT
-            )
-        ''')
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        try:
+            _init_schema(conn)
+        except Exception:
+            conn.close()
+            raise
+        return UserDatabaseHandle(user_id, conn)
+
+    def _checkout(self, user_id: str) -> UserDatabaseHandle:
+        """Cached or newly opened handle, marked in use
         
-        # Create user settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        Files are opened outside the pool lock, so a slow or locked file only delays its own user.
+        """
+        with self.lock:
+            handle = self.handles.get(user_id)
+            if handle is not None:
+                self.handles.move_to_end(user_id)
+                handle.in_use += 1
+        record_cache("user_db", handle is not None)
+        if handle is not None:
+            return handle
         
-        conn.commit()
-        conn.close()
-    
+        opened = self._open(user_id)
+        with self.lock:
+            handle = self.handles.get(user_id)
+            if handle is None:
+                handle = self.handles[user_id] = opened
+            else:
+                # Another thread opened the same user meanwhile; use its handle
+                self.handles.move_to_end(user_id)
+            handle.in_use += 1
+        if handle is not opened:
+            opened.conn.close()
+        return handle
+
+    def _checkin(self, handle: UserDatabaseHandle):
+        with self.lock:
+            handle.in_use -= 1
+            handle.last_used = time.monotonic()
+            self._evict()
+
+    def _evict(self):
+        """Close idle handles and the least recently used ones beyond the budget; caller holds the lock"""
+        now = time.monotonic()
+        for user_id, handle in list(self.handles.items()):
+            over_budget = len(self.handles) > self.max_handles
+            idle = now - handle.last_used > self.idle_timeout
+            if not over_budget and not idle:
+                # Handles are in LRU order, so the rest were used more recently
+                break
+            if handle.in_use:
+                continue
+            del self.handles[user_id]
+            handle.conn.close()
+
+    @contextmanager
+    def connect(self, user_id: str):
+        """The user's connection for one unit of work; committed on success, rolled back on error"""
+        handle = self._checkout(user_id)
+        try:
+            with handle.lock:
+                try:
+                    yield handle.conn
+                    handle.conn.commit()
+                except Exception:
+                    handle.conn.rollback()
+                    raise
+        finally:
+            self._checkin(handle)
+
+    def is_open(self, user_id: str) -> bool:
+        """Whether the user's handle is cached"""
+        return user_id in self.handles
+
+    def warm(self, user_id: str):
+        """Open the user's database ahead of their first query"""
+        if self.is_open(user_id):
+            return
+        try:
+            handle = self._checkout(user_id)
+            self._checkin(handle)
+        except Exception as e:
+            logger.error(f"Failed to warm database for user {user_id}: {e}")
+
+    def close(self, user_id: str):
+        """Close the user's handle, e.g. before their files are removed"""
+        with self.lock:
+            handle = self.handles.get(user_id)
+            if handle is not None and not handle.in_use:
+                del self.handles[user_id]
+                handle.conn.close()
+
+    def close_all(self):
+        """Close every handle that is not in use"""
+        with self.lock:
+            for user_id, handle in list(self.handles.items()):
+                if not handle.in_use:
+                    del self.handles[user_id]
+                    handle.conn.close()
+
+    def stats(self) -> Dict:
+        """Open handle count against the budget"""
+        with self.lock:
+            return {
+                'open_handles': len(self.handles),
+                'max_handles': self.max_handles,
+                'in_use': sum(1 for handle in self.handles.values() if handle.in_use)
+            }
+
+
+class UserStorage(SQLiteStorage):
+    """Storage for one user's SQLite file, on the pool's cached handle
+
+    Per-user files are SQLite by design, so DATABASE_URL does not apply to them.
+    """
+
+    def __init__(self, user_id: str, pool: UserDatabasePool):
+        super().__init__(_get_user_db_path(user_id))
+        self.user_id = user_id
+        self.pool = pool
+
+    def connect(self):
+        return self.pool.connect(self.user_id)
+
+
+class IsolatedDatabase:
+    """Database manager with user isolation"""
+
+    def __init__(self, user_id: str, pool: Optional[UserDatabasePool] = None):
+        self.user_id = user_id
+        self.pool = pool or user_databases
+        self.storage = UserStorage(user_id, self.pool)
+        self.db_path = self.storage.db_path
+
+    def _connect(self):
+        """Pooled connection to the user's database"""
+        return self.storage.connect()
+
     def get_sessions(self, limit: int = 50) -> List[Dict]:
         """Get user's chat sessions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT s.id, s.title, s.model, s.created_at, s.updated_at, s.is_starred,
-                   COUNT(m.id) as message_count
-            FROM sessions s
-            LEFT JOIN messages m ON s.id = m.session_id
-            GROUP BY s.id
-            ORDER BY s.updated_at DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        sessions = []
-        for row in cursor.fetchall():
-            sessions.append({
-                'id': row[0],
-                'title': row[1],
-                'model': row[2],
-                'created_at': row[3],
-                'updated_at': row[4],
-                'is_starred': bool(row[5]),
-                'message_count': row[6]
-            })
-        
-        conn.close()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT s.id, s.title, s.model, s.created_at, s.updated_at, s.is_starred,
+                       COUNT(m.id) as message_count
+                FROM sessions s
+                LEFT JOIN messages m ON s.id = m.session_id
+                GROUP BY s.id
+                ORDER BY s.updated_at DESC
+                LIMIT ?
+            ''', (limit,))
+
+            sessions = []
+            for row in cursor.fetchall():
+                sessions.append({
+                    'id': row[0],
+                    'title': row[1],
+                    'model': row[2],
+                    'created_at': row[3],
+                    'updated_at': row[4],
+                    'is_starred': bool(row[5]),
+                    'message_count': row[6]
+                })
+
         return sessions
-    
+
     def create_session(self, session_id: str, title: str, model: str) -> Dict:
         """Create a new session for user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO sessions (id, title, model)
-            VALUES (?, ?, ?)
-        ''', (session_id, title, model))
-        
-        conn.commit()
-        conn.close()
-        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                INSERT INTO sessions (id, title, model)
+                VALUES (?, ?, ?)
+            ''', (session_id, title, model))
+
         return {
             'id': session_id,
             'title': title,
@@ -129,103 +309,94 @@ class IsolatedDatabase:
             'created_at': datetime.now().isoformat(),
             'updated_at': datetime.now().isoformat()
         }
-    
-    def add_message(self, session_id: str, role: str, content: str, 
+
+    def add_message(self, session_id: str, role: str, content: str,
                    model: str = None, metadata: Dict = None):
         """Add message to user's session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if session exists, create if not
-        cursor.execute('SELECT id FROM sessions WHERE id = ?', (session_id,))
-        if not cursor.fetchone():
-            # Auto-create session
-            title = content[:50] + "..." if len(content) > 50 else content
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            # Check if session exists, create if not
+            cursor.execute('SELECT id FROM sessions WHERE id = ?', (session_id,))
+            if not cursor.fetchone():
+                # Auto-create session
+                title = content[:50] + "..." if len(content) > 50 else content
+                cursor.execute('''
+                    INSERT INTO sessions (id, title, model)
+                    VALUES (?, ?, ?)
+                ''', (session_id, title, model or 'general'))
+
+            # Insert message
+            metadata_str = json.dumps(metadata) if metadata else None
             cursor.execute('''
-                INSERT INTO sessions (id, title, model)
-                VALUES (?, ?, ?)
-            ''', (session_id, title, model or 'general'))
-        
-        # Insert message
-        metadata_str = json.dumps(metadata) if metadata else None
-        cursor.execute('''
-            INSERT INTO messages (session_id, role, content, model, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session_id, role, content, model, metadata_str))
-        
-        # Update session timestamp
-        cursor.execute('''
-            UPDATE sessions 
-            SET updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (session_id,))
-        
-        conn.commit()
-        conn.close()
-    
+                INSERT INTO messages (session_id, role, content, model, metadata)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (session_id, role, content, model, metadata_str))
+
+            # Update session timestamp
+            cursor.execute('''
+                UPDATE sessions
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (session_id,))
+
     def get_messages(self, session_id: str) -> List[Dict]:
         """Get messages for a specific session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT role, content, model, timestamp, metadata
-            FROM messages
-            WHERE session_id = ?
-            ORDER BY timestamp ASC
-        ''', (session_id,))
-        
-        messages = []
-        for row in cursor.fetchall():
-            message = {
-                'role': row[0],
-                'content': row[1],
-                'model': row[2],
-                'timestamp': row[3]
-            }
-            if row[4]:
-                message['metadata'] = json.loads(row[4])
-            messages.append(message)
-        
-        conn.close()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT role, content, model, timestamp, metadata
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY timestamp ASC
+            ''', (session_id,))
+
+            messages = []
+            for row in cursor.fetchall():
+                message = {
+                    'role': row[0],
+                    'content': row[1],
+                    'model': row[2],
+                    'timestamp': row[3]
+                }
+                if row[4]:
+                    message['metadata'] = json.loads(row[4])
+                messages.append(message)
+
         return messages
-    
+
     def delete_session(self, session_id: str):
         """Delete a session and its messages"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Delete messages first
-        cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
-        # Delete session
-        cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            # Delete messages first
+            cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            # Delete session
+            cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
     def get_user_stats(self) -> Dict:
         """Get user statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Total sessions
-        cursor.execute('SELECT COUNT(*) FROM sessions')
-        total_sessions = cursor.fetchone()[0]
-        
-        # Total messages
-        cursor.execute('SELECT COUNT(*) FROM messages')
-        total_messages = cursor.fetchone()[0]
-        
-        # Model usage
-        cursor.execute('''
-            SELECT model, COUNT(*) as count
-            FROM sessions
-            GROUP BY model
-        ''')
-        model_usage = {row[0]: row[1] for row in cursor.fetchall()}
-        
-        conn.close()
-        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+
+            # Total sessions
+            cursor.execute('SELECT COUNT(*) FROM sessions')
+            total_sessions = cursor.fetchone()[0]
+
+            # Total messages
+            cursor.execute('SELECT COUNT(*) FROM messages')
+            total_messages = cursor.fetchone()[0]
+
+            # Model usage
+            cursor.execute('''
+                SELECT model, COUNT(*) as count
+                FROM sessions
+                GROUP BY model
+            ''')
+            model_usage = {row[0]: row[1] for row in cursor.fetchall()}
+
         return {
             'total_sessions': total_sessions,
             'total_messages': total_messages,
@@ -233,7 +404,13 @@ class IsolatedDatabase:
             'user_id': self.user_id
         }
 
+# Shared handle cache; USER_DB_FD_BUDGET bounds the file descriptors held open by user databases
+user_databases = UserDatabasePool(
+    fd_budget=int(os.getenv("USER_DB_FD_BUDGET", "256")),
+    idle_timeout=float(os.getenv("USER_DB_IDLE_SECONDS", "300"))
+)
+
 # Factory function
 def get_user_database(user_id: str) -> IsolatedDatabase:
     """Get database instance for a specific user"""
-    return IsolatedDatabase(user_id)
\ No newline at end of file
+    return IsolatedDatabase(user_id)
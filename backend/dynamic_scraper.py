@@ -7,14 +7,53 @@ import requests
 from bs4 import BeautifulSoup
 import logging
 from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Optional
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+import os
 import time
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import json
 
+from metrics import record_cache
+from shared_cache import SharedCache, shared_cache
+from text_dedup import BlockIndex
+
 logger = logging.getLogger(__name__)
 
+# Pages one crawl may fetch, relevant or not
+MAX_CRAWL_VISITS = int(os.getenv("SCRAPE_MAX_CRAWL_VISITS", "20"))
+
+
+class CrawlPool:
+    """Threads for crawls, tracking how many crawls are waiting for one"""
+    
+    def __init__(self, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crawl")
+        self.waiting = 0
+        self.lock = threading.Lock()
+    
+    def submit(self, task: Callable[[], None]):
+        with self.lock:
+            self.waiting += 1
+        
+        def run():
+            with self.lock:
+                self.waiting -= 1
+            task()
+        
+        return self.executor.submit(run)
+    
+    def busy(self) -> bool:
+        """Whether a crawl is queued behind the running ones"""
+        return self.waiting > 0
+
+
+# Primary page fetches get their own threads, so a crawl still running for an earlier question
+# never delays the page the next question asks about
+primary_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="scrape")
+crawl_pool = CrawlPool(max_workers=4)
+
 class DynamicWebScraper:
     def __init__(self, base_url: str = "https://everestmanila.com"):
         self.base_url = base_url
@@ -53,20 +92,22 @@ class DynamicWebScraper:
                         'order': i
                     })
         
-        # Extract paragraphs
+        # Extract paragraphs, each distinct one once
+        paragraphs = BlockIndex()
         for p in soup.find_all('p'):
             text = self.clean_text(p.get_text())
-            if text and len(text) > 20:
+            if text and len(text) > 20 and paragraphs.add(text)[1]:
                 content_structure['paragraphs'].append(text)
         
-        # Extract lists (often contain steps or requirements)
+        # Extract lists (often contain steps or requirements); repeated lists such as menus once
+        lists = BlockIndex()
         for list_tag in soup.find_all(['ul', 'ol']):
             list_items = []
             for li in list_tag.find_all('li'):
                 text = self.clean_text(li.get_text())
                 if text:
                     list_items.append(text)
-            if list_items:
+            if list_items and lists.add("\n".join(list_items))[1]:
                 content_structure['lists'].append({
                     'type': 'ordered' if list_tag.name == 'ol' else 'unordered',
                     'items': list_items
@@ -118,9 +159,15 @@ class DynamicWebScraper:
             r'(?i)first|second|third|then|next|finally'
         ]
         
+        seen = BlockIndex()
         for element in soup.find_all(['li', 'p', 'div']):
             text = self.clean_text(element.get_text())
-            if any(re.search(pattern, text) for pattern in step_patterns):
+            if not any(re.search(pattern, text) for pattern in step_patterns):
+                continue
+            # A div around other blocks only repeats their text
+            if element.name == 'div' and element.find(['li', 'p', 'div']):
+                continue
+            if seen.add(text)[1]:
                 steps.append(text)
         
         return steps
@@ -149,39 +196,39 @@ class DynamicWebScraper:
             response = self.session.get(url, timeout=5)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove non-content elements
-            for tag in soup(['script', 'style', 'nav', 'footer', 'header']):
-                tag.decompose()
-            
-            # Extract title and meta
-            title = soup.find('title')
-            page_title = self.clean_text(title.get_text()) if title else ""
-            
-            meta_desc = soup.find('meta', {'name': 'description'})
-            description = self.clean_text(meta_desc.get('content', '')) if meta_desc else ""
-            
-            # Extract structured content
-            structured_content = self.extract_structured_content(soup, url)
-            
-            # Build comprehensive content
-            result = {
-                'url': url,
-                'title': page_title,
-                'description': description,
-                'structured_content': structured_content,
-                'full_text': self._build_full_text(structured_content),
-                'relevance_score': self._calculate_relevance(structured_content, query),
-                'scraped_at': time.time()
-            }
-            
-            return result
+            return self._page_from_soup(url, BeautifulSoup(response.content, 'html.parser'), query)
             
         except Exception as e:
             logger.error(f"Error scraping {url}: {e}")
             return None
     
+    def _page_from_soup(self, url: str, soup: BeautifulSoup, query: str) -> Dict:
+        """Page record from a parsed page; strips non-content elements from the soup"""
+        # Remove non-content elements
+        for tag in soup(['script', 'style', 'nav', 'footer', 'header']):
+            tag.decompose()
+        
+        # Extract title and meta
+        title = soup.find('title')
+        page_title = self.clean_text(title.get_text()) if title else ""
+        
+        meta_desc = soup.find('meta', {'name': 'description'})
+        description = self.clean_text(meta_desc.get('content', '')) if meta_desc else ""
+        
+        # Extract structured content
+        structured_content = self.extract_structured_content(soup, url)
+        
+        # Build comprehensive content
+        return {
+            'url': url,
+            'title': page_title,
+            'description': description,
+            'structured_content': structured_content,
+            'full_text': self._build_full_text(structured_content),
+            'relevance_score': self._calculate_relevance(structured_content, query),
+            'scraped_at': time.time()
+        }
+    
     def _build_full_text(self, structured_content: Dict) -> str:
         """Build full text from structured content"""
         parts = []
@@ -234,16 +281,24 @@ class DynamicWebScraper:
         
         return score
     
-    def find_relevant_urls(self, query: str, max_depth: int = 2) -> List[str]:
-        """Find relevant URLs by crawling the website"""
-        relevant_urls = []
+    def iter_relevant_pages(self, query: str, max_depth: int = 2, limit: int = 10,
+                            max_visits: int = MAX_CRAWL_VISITS,
+                            should_stop: Optional[Callable[[], bool]] = None) -> Iterator[Tuple[str, BeautifulSoup]]:
+        """Crawl the website and yield each relevant page with its parsed HTML as it is found
+        
+        Stops after limit relevant pages, max_visits fetched pages, or once should_stop returns True.
+        """
+        found = 0
         visited = set()
         to_visit = [(self.base_url, 0)]
         
         # Keywords to prioritize
         query_words = query.lower().split()
         
-        while to_visit and len(relevant_urls) < 10:
+        while to_visit and found < limit and len(visited) < max_visits:
+            if should_stop is not None and should_stop():
+                logger.info(f"Stopping crawl of {self.base_url} after {len(visited)} pages")
+                return
             url, depth = to_visit.pop(0)
             
             if url in visited or depth > max_depth:
@@ -257,8 +312,7 @@ class DynamicWebScraper:
                 
                 # Check if current page is relevant
                 page_text = soup.get_text().lower()
-                if any(word in page_text for word in query_words):
-                    relevant_urls.append(url)
+                relevant = any(word in page_text for word in query_words)
                 
                 # Find more URLs to visit
                 if depth < max_depth:
@@ -273,133 +327,314 @@ class DynamicWebScraper:
                             else:
                                 to_visit.append((href, depth + 1))
                 
+                if relevant:
+                    found += 1
+                    # Links are collected first, as the consumer may strip the soup
+                    yield url, soup
+                
             except Exception as e:
                 logger.error(f"Error crawling {url}: {e}")
             
             time.sleep(0.1)  # Be respectful
-        
-        return relevant_urls
     
-    def scrape_for_query(self, query: str, max_pages: int = 5) -> List[Dict]:
-        """Main method to scrape relevant content for a query"""
+    def find_relevant_urls(self, query: str, max_depth: int = 2) -> List[str]:
+        """Find relevant URLs by crawling the website"""
+        return [url for url, _ in self.iter_relevant_pages(query, max_depth)]
+    
+    def start_scrape(self, query: str, max_pages: int = 5, primary_url: Optional[str] = None) -> "PageStream":
+        """Scrape in the background; pages are available from the stream as soon as each is parsed
+        
+        The primary URL, when given, is fetched right away alongside the crawl for related pages.
+        Crawled pages are parsed from the crawl's own response instead of being fetched again.
+        Once the reader of the stream has stopped, the crawl only goes on to fill the cache, and
+        gives up its thread as soon as another crawl is waiting for one.
+        """
+        stream = PageStream(primary_url)
         logger.info(f"Starting dynamic scraping for query: {query}")
         
-        # Find relevant URLs
-        relevant_urls = self.find_relevant_urls(query, max_depth=2)
-        logger.info(f"Found {len(relevant_urls)} relevant URLs")
-        
-        # Scrape URLs concurrently for speed
-        scraped_data = []
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_url = {
-                executor.submit(self.scrape_url_with_context, url, query): url 
-                for url in relevant_urls[:max_pages]
-            }
-            
-            for future in as_completed(future_to_url):
-                result = future.result()
-                if result:
-                    scraped_data.append(result)
-        
-        # Sort by relevance
-        scraped_data.sort(key=lambda x: x['relevance_score'], reverse=True)
+        def scrape_primary():
+            try:
+                stream.add_primary(self.scrape_url_with_context(primary_url, query))
+            finally:
+                stream.finish_task()
         
-        return scraped_data
+        def crawl():
+            try:
+                pages = self.iter_relevant_pages(
+                    query, max_depth=2, limit=max_pages,
+                    should_stop=lambda: stream.detached and crawl_pool.busy()
+                )
+                for url, soup in pages:
+                    if url != primary_url:
+                        stream.add(self._page_from_soup(url, soup, query))
+            except Exception as e:
+                logger.error(f"Error crawling {self.base_url}: {e}")
+            finally:
+                stream.finish_task()
+        
+        stream.tasks = 2 if primary_url else 1
+        if primary_url:
+            primary_executor.submit(scrape_primary)
+        crawl_pool.submit(crawl)
+        return stream
+    
+    def scrape_for_query(self, query: str, max_pages: int = 5) -> List[Dict]:
+        """Main method to scrape relevant content for a query"""
+        stream = self.start_scrape(query, max_pages)
+        stream.wait()
+        logger.info(f"Scraped {len(stream.pages)} relevant pages")
+        return stream.result()
     
     def format_for_context(self, scraped_data: List[Dict], query: str) -> str:
         """Format scraped data for LLM context with deduplication"""
-        if not scraped_data:
-            return ""
-        
-        # Track seen URLs to avoid duplicates
-        seen_urls = set()
-        
-        context_parts = ["=== LIVE WEBSITE CONTENT ==="]
-        context_parts.append(f"Query: {query}")
-        context_parts.append(f"Found {len(scraped_data)} relevant pages:\n")
-        
+        formatter = ContextFormatter(query)
         for data in scraped_data:
-            # Skip if we've already seen this URL
-            if data['url'] in seen_urls:
-                continue
-            seen_urls.add(data['url'])
-            
-            context_parts.append(f"\n[Page: {data['title']}]")
-            context_parts.append(f"(Source: {data['url']})")
-            
-            if data['description']:
-                context_parts.append(f"Description: {data['description']}")
-            
-            # Add structured content
-            structured = data['structured_content']
-            
-            # Add steps if found
-            if structured['steps'] and len(structured['steps']) > 0:
-                context_parts.append("\nStep-by-step instructions:")
-                for i, step in enumerate(structured['steps'][:5], 1):  # Limit to 5 steps
-                    context_parts.append(f"{i}. {step}")
-            
-            # Add only the most relevant list
-            for lst in structured['lists'][:2]:  # Max 2 lists
-                if any(word in str(lst).lower() for word in query.lower().split()):
-                    context_parts.append(f"\n{lst['type'].title()} list:")
-                    for item in lst['items'][:3]:  # Max 3 items
-                        context_parts.append(f"- {item}")
-                    break
-            
-            # Add relevant links (deduplicated)
-            link_urls_seen = set()
-            relevant_links = []
-            for link in structured['links']:
-                if link['url'] not in link_urls_seen and link['url'] not in seen_urls:
-                    if any(word in link['text'].lower() or word in link['url'].lower() 
-                          for word in query.lower().split()):
-                        relevant_links.append(link)
-                        link_urls_seen.add(link['url'])
-            
-            if relevant_links:
-                context_parts.append("\nRelated pages:")
-                for link in relevant_links[:3]:  # Max 3 links
-                    context_parts.append(f"- {link['text']}: {link['url']}")
-                    seen_urls.add(link['url'])
-            
-            # Add brief content snippet
-            content_snippet = data['full_text'][:300]  # Reduced from 500
-            if content_snippet:
+            formatter.add(data)
+        return formatter.render()
+
+
+class PageStream:
+    """Pages of a running scrape in arrival order, the primary URL's page first"""
+    
+    def __init__(self, primary_url: Optional[str] = None):
+        self.primary_url = primary_url
+        self.pages: List[Dict] = []
+        self.urls = set()
+        self.awaiting_primary = primary_url is not None
+        self.tasks = 0
+        self.done = False
+        self.detached = False  # the reader has what it needs; the rest is only cached
+        self.callbacks: List[Callable[[List[Dict]], None]] = []
+        self.condition = threading.Condition()
+    
+    @classmethod
+    def completed(cls, pages: List[Dict]) -> "PageStream":
+        """Stream over pages that are already known, e.g. from the cache"""
+        stream = cls()
+        stream.pages = list(pages)
+        stream.done = True
+        return stream
+    
+    def add(self, page: Optional[Dict]):
+        with self.condition:
+            if page and page['url'] not in self.urls:
+                self.urls.add(page['url'])
+                self.pages.append(page)
+                self.condition.notify_all()
+    
+    def add_primary(self, page: Optional[Dict]):
+        with self.condition:
+            if page and page['url'] not in self.urls:
+                self.urls.add(page['url'])
+                self.pages.insert(0, page)
+            self.awaiting_primary = False
+            self.condition.notify_all()
+    
+    def finish_task(self):
+        with self.condition:
+            self.tasks -= 1
+            if self.tasks > 0:
+                return
+            self.done = True
+            self.awaiting_primary = False
+            self.condition.notify_all()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+    
+    def _run_callback(self, callback: Callable[[List[Dict]], None]):
+        try:
+            callback(self.result())
+        except Exception as e:
+            logger.error(f"Scrape completion callback failed: {e}")
+    
+    def on_done(self, callback: Callable[[List[Dict]], None]):
+        """Call with the final pages once every task has finished, or now if they have"""
+        with self.condition:
+            if not self.done:
+                self.callbacks.append(callback)
+                return
+        self._run_callback(callback)
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done, timeout)
+    
+    def result(self) -> List[Dict]:
+        """Pages so far: the primary page, then the rest by relevance"""
+        with self.condition:
+            pages = list(self.pages)
+        primary = [p for p in pages if p['url'] == self.primary_url]
+        rest = sorted((p for p in pages if p['url'] != self.primary_url),
+                      key=lambda x: x['relevance_score'], reverse=True)
+        return primary + rest
+    
+    def iter_pages(self, budget: float, first_timeout: float = 10.0) -> Iterator[Dict]:
+        """Yield pages as they arrive: the first one (the primary page, when there is one) and
+        then any others that arrive within budget seconds of it"""
+        index = 0
+        deadline = time.monotonic() + first_timeout
+        first = True
+        try:
+            while True:
+                with self.condition:
+                    ready = lambda: self.done or (not self.awaiting_primary and len(self.pages) > index)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.condition.wait_for(ready, remaining) or len(self.pages) <= index:
+                        return
+                    page = self.pages[index]
+                index += 1
+                if first:
+                    deadline = time.monotonic() + budget
+                    first = False
+                yield page
+        finally:
+            self.detached = True
+
+
+class ContextFormatter:
+    """Builds the format_for_context text one page at a time
+    
+    Steps, lists and excerpts already given for an earlier page are left out or referenced.
+    """
+    
+    def __init__(self, query: str):
+        self.query = query
+        self.query_words = query.lower().split()
+        # Track seen URLs to avoid duplicates
+        self.seen_urls = set()
+        # Steps and lists already in the context, and excerpts with the page they came from
+        self.blocks = BlockIndex()
+        self.excerpts = BlockIndex()
+        self.excerpt_pages: List[str] = []
+        self.page_count = 0
+        self.parts: List[str] = []
+    
+    def add(self, data: Dict):
+        """Format one page; pages whose URL was already seen are counted but skipped"""
+        self.page_count += 1
+        # Skip if we've already seen this URL
+        if data['url'] in self.seen_urls:
+            return
+        self.seen_urls.add(data['url'])
+        context_parts = self.parts
+        
+        context_parts.append(f"\n[Page: {data['title']}]")
+        context_parts.append(f"(Source: {data['url']})")
+        
+        if data['description']:
+            context_parts.append(f"Description: {data['description']}")
+        
+        # Add structured content
+        structured = data['structured_content']
+        
+        # Add steps if found, other than those given for earlier pages
+        steps = [step for step in structured['steps'] if self.blocks.add(step)[1]]
+        if steps:
+            context_parts.append("\nStep-by-step instructions:")
+            for i, step in enumerate(steps[:5], 1):  # Limit to 5 steps
+                context_parts.append(f"{i}. {step}")
+        
+        # Add only the most relevant list not already given
+        for lst in structured['lists'][:2]:  # Max 2 lists
+            if any(word in str(lst).lower() for word in self.query_words):
+                if not self.blocks.add("\n".join(lst['items']))[1]:
+                    continue
+                context_parts.append(f"\n{lst['type'].title()} list:")
+                for item in lst['items'][:3]:  # Max 3 items
+                    context_parts.append(f"- {item}")
+                break
+        
+        # Add relevant links (deduplicated)
+        link_urls_seen = set()
+        relevant_links = []
+        for link in structured['links']:
+            if link['url'] not in link_urls_seen and link['url'] not in self.seen_urls:
+                if any(word in link['text'].lower() or word in link['url'].lower() 
+                      for word in self.query_words):
+                    relevant_links.append(link)
+                    link_urls_seen.add(link['url'])
+        
+        if relevant_links:
+            context_parts.append("\nRelated pages:")
+            for link in relevant_links[:3]:  # Max 3 links
+                context_parts.append(f"- {link['text']}: {link['url']}")
+                self.seen_urls.add(link['url'])
+        
+        # Add brief content snippet
+        content_snippet = data['full_text'][:300]  # Reduced from 500
+        if content_snippet:
+            excerpt_id, new = self.excerpts.add(content_snippet)
+            if new:
+                self.excerpt_pages.append(data['title'])
                 context_parts.append(f"\nBrief excerpt: {content_snippet}...")
-            
-            context_parts.append("\n---")
+            else:
+                context_parts.append(f"\nBrief excerpt: same as [Page: {self.excerpt_pages[excerpt_id]}]")
         
-        context_parts.append("\n=== END LIVE WEBSITE CONTENT ===")
-        return "\n".join(context_parts)
+        context_parts.append("\n---")
+    
+    def render(self) -> str:
+        if not self.page_count:
+            return ""
+        header = ["=== LIVE WEBSITE CONTENT ===", f"Query: {self.query}",
+                  f"Found {self.page_count} relevant pages:\n"]
+        return "\n".join(header + self.parts + ["\n=== END LIVE WEBSITE CONTENT ==="])
 
 
 # Cache to avoid repeated scraping
 class ScrapingCache:
-    def __init__(self, ttl: int = 900):  # 15 minutes TTL
-        self.cache = {}
+    """Scrape results by site and query, kept in the cache tier shared by all workers"""
+    
+    def __init__(self, ttl: int = 900, cache: Optional[SharedCache] = None):  # 15 minutes TTL
         self.ttl = ttl
+        self.cache = cache or shared_cache
+    
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"scrape:{key}"
     
     def get(self, key: str) -> Optional[List[Dict]]:
-        if key in self.cache:
-            data, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                return data
-            else:
-                del self.cache[key]
-        return None
+        data = self.cache.get(self._key(key))
+        record_cache("scraping", data is not None)
+        return data
     
     def set(self, key: str, data: List[Dict]):
-        self.cache[key] = (data, time.time())
+        self.cache.set(self._key(key), data, self.ttl)
     
-    def clear_old(self):
-        current_time = time.time()
-        to_delete = [
-            key for key, (_, timestamp) in self.cache.items()
-            if current_time - timestamp > self.ttl
-        ]
-        for key in to_delete:
-            del self.cache[key]
+    def get_or_scrape(self, key: str, scrape: Callable[[], List[Dict]]) -> List[Dict]:
+        """Cached results, or scrape in one worker while the others wait for its results"""
+        data, cached = self.cache.get_or_compute(self._key(key), scrape, self.ttl, lease=120, wait=60)
+        record_cache("scraping", cached)
+        return data or []
+    
+    def stream(self, key: str, start: Callable[[], PageStream], wait: float = 2.0) -> PageStream:
+        """Cached pages, or a scrape in progress whose pages are cached once it completes
+        
+        When another worker is already scraping the same key, its results are awaited for up to
+        wait seconds before scraping here as well.
+        """
+        cache_key = self._key(key)
+        data = self.cache.get(cache_key)
+        token = None
+        if data is None:
+            token = self.cache.acquire(cache_key, lease=120)
+            if token is None:
+                data = self.cache.wait(cache_key, wait)
+        record_cache("scraping", data is not None)
+        if data is not None:
+            return PageStream.completed(data)
+        
+        def store(pages: List[Dict]):
+            try:
+                if pages:
+                    self.set(key, pages)
+            finally:
+                if token is not None:
+                    self.cache.release(cache_key, token)
+        
+        stream = start()
+        stream.on_done(store)
+        return stream
 
 
 # Global cache instance
@@ -408,25 +643,11 @@ scraping_cache = ScrapingCache()
 
 def get_dynamic_content_for_query(query: str, base_url: str = "https://everestmanila.com") -> str:
     """Optimized function to get dynamic content for a query"""
-    # Check cache first
-    cache_key = f"{base_url}:{query}"
-    cached_data = scraping_cache.get(cache_key)
-    
-    if cached_data:
-        logger.info(f"Using cached data for query: {query}")
-        scraper = DynamicWebScraper(base_url)
-        return scraper.format_for_context(cached_data, query)
-    
-    # Scrape fresh data with reduced pages for speed
     scraper = DynamicWebScraper(base_url)
-    scraped_data = scraper.scrape_for_query(query, max_pages=3)  # Reduced from 5
-    
-    # Cache the results
-    scraping_cache.set(cache_key, scraped_data)
-    
-    # Clear old cache entries
-    scraping_cache.clear_old()
-    
+    # Scrape with reduced pages for speed, unless any worker has recent results
+    scraped_data = scraping_cache.get_or_scrape(
+        f"{base_url}:{query}", lambda: scraper.scrape_for_query(query, max_pages=3)
+    )
     return scraper.format_for_context(scraped_data, query)
 
 
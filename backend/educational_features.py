@@ -2,16 +2,41 @@
 Educational Features Handler
 Implements learning methodologies from top universities
 """
+import atexit
 import logging
 import json
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 import random
+import re
+import time
+import zlib
+from threading import Lock
 from dataclasses import dataclass
 from enum import Enum
 
+from artifact_store import ArtifactStore, content_topic
+from storage import Storage, create_storage, upsert_statement
+
 logger = logging.getLogger(__name__)
 
+# Profile used when the chat path has no information about the student
+DEFAULT_STUDENT_PROFILE = {
+    "learning_style": "mixed",
+    "knowledge_level": "intermediate",
+    "available_time": "flexible",
+    "goals": "comprehensive understanding"
+}
+
+
+def _text(response) -> str:
+    """Plain text of an LLM response so artifacts can be stored and served as JSON"""
+    return getattr(response, "content", response)
+
+
+# Answers that should not move a Socratic dialogue to the next depth
+NON_ANSWER_PATTERN = re.compile(r"\b(i don'?t know|not sure|no idea|idk|i'?m stuck|confused)\b")
+
 class TeachingMethod(Enum):
     SOCRATIC = "socratic"  # Harvard - Question-based learning
     TUTORIAL = "tutorial"  # Oxford - One-on-one tutoring
@@ -29,13 +54,118 @@ class LearningSession:
     start_time: datetime
     interactions: List[Dict]
     assessment_score: Optional[float] = None
+    depth_level: int = 1
+    answers_at_depth: int = 0  # substantive answers given at the current depth
+    turns: int = 0
+    summary: str = ""  # rolling summary carried in the prompt instead of the transcript
+    last_active: float = 0.0
     
 class EducationalFeaturesHandler:
-    def __init__(self, llm_handler):
+    ANSWERS_PER_DEPTH = 2
+    RECENT_INTERACTIONS = 4  # interactions kept on the in-memory session object
+    
+    def __init__(self, llm_handler, artifact_store: Optional[ArtifactStore] = None,
+                 session_store: Optional["LearningSessionStore"] = None):
         self.llm = llm_handler
         self.active_sessions = {}
+        self.artifacts = artifact_store or ArtifactStore()
+        self.session_store = session_store or LearningSessionStore()
+        
+    def get_learning_session(self, session_id: str) -> Optional[LearningSession]:
+        """Return the active learning session for a chat session, loading it from the store if needed"""
+        session = self.active_sessions.get(session_id)
+        if session is None:
+            session = self.session_store.load(session_id)
+            if session is None:
+                return None
+            self.active_sessions[session_id] = session
+        
+        if time.time() - session.last_active > self.session_store.idle_timeout:
+            self.end_learning_session(session_id)
+            return None
+        return session
+    
+    def start_learning_session(self, session_id: str, topic: str, method: TeachingMethod,
+                               student_id: str = "default") -> LearningSession:
+        """Start (or restart) a tracked learning session"""
+        session = LearningSession(
+            session_id=session_id,
+            student_id=student_id,
+            topic=topic,
+            method=method,
+            start_time=datetime.now(),
+            interactions=[],
+            last_active=time.time()
+        )
+        self._evict_idle_sessions()
+        self.active_sessions[session_id] = session
+        self.session_store.save(session)
+        return session
+    
+    def _evict_idle_sessions(self):
+        """Drop idle sessions from this process; their stored state is reloaded on demand"""
+        cutoff = time.time() - self.session_store.idle_timeout
+        for session_id, session in list(self.active_sessions.items()):
+            if session.last_active < cutoff:
+                self.active_sessions.pop(session_id, None)
+    
+    def end_learning_session(self, session_id: str):
+        """Stop tracking a learning session"""
+        self.active_sessions.pop(session_id, None)
+        self.session_store.end(session_id)
+    
+    def continue_socratic_dialogue(self, session_id: str, student_response: str = "",
+                                   topic: Optional[str] = None, student_id: str = "default") -> Dict:
+        """
+        Socratic dialogue that remembers where the student is across turns
+        """
+        session = self.get_learning_session(session_id)
+        if session is None or session.method != TeachingMethod.SOCRATIC or (topic and topic != session.topic):
+            if not topic:
+                # The opening message names the topic rather than answering a question
+                topic, student_response = student_response, ""
+            session = self.start_learning_session(session_id, topic, TeachingMethod.SOCRATIC, student_id)
+        
+        if student_response:
+            self._advance_depth(session, student_response)
+        
+        result = self.create_socratic_dialogue(
+            session.topic, student_response, session.depth_level, summary=session.summary
+        )
+        
+        interaction = {
+            "turn": session.turns,
+            "depth_level": session.depth_level,
+            "student_response": student_response,
+            "tutor_response": result["response"]
+        }
+        session.interactions = (session.interactions + [interaction])[-self.RECENT_INTERACTIONS:]
+        session.summary = self.session_store.roll_summary(session.summary, student_response, result["response"])
+        session.turns += 1
+        session.last_active = time.time()
+        self.session_store.record_interaction(session, interaction)
         
-    def create_socratic_dialogue(self, topic: str, student_response: str, depth_level: int = 1) -> Dict:
+        result["next_depth"] = session.depth_level
+        result["session"] = {
+            "session_id": session_id,
+            "topic": session.topic,
+            "depth_level": session.depth_level,
+            "turns": session.turns
+        }
+        return result
+    
+    def _advance_depth(self, session: LearningSession, student_response: str):
+        """Count substantive answers and move to the next depth after enough of them"""
+        answer = student_response.lower()
+        if len(answer.split()) < 5 or NON_ANSWER_PATTERN.search(answer):
+            return
+        session.answers_at_depth += 1
+        if session.answers_at_depth >= self.ANSWERS_PER_DEPTH and session.depth_level < 3:
+            session.depth_level += 1
+            session.answers_at_depth = 0
+    
+    def create_socratic_dialogue(self, topic: str, student_response: str, depth_level: int = 1,
+                                 summary: str = "") -> Dict:
         """
         Harvard's Socratic Method - Guide learning through questions
         """
@@ -74,11 +204,13 @@ Push their thinking further by:
         }
         
         prompt = prompts.get(depth_level, prompts[1])
+        if summary:
+            prompt = f"Dialogue so far (summary):\n{summary}\n\n{prompt}"
         response = self.llm.invoke(prompt)
         
         return {
             "method": "socratic",
-            "response": response,
+            "response": _text(response),
             "next_depth": min(depth_level + 1, 3),
             "learning_objective": "Critical thinking through guided questions"
         }
@@ -139,6 +271,10 @@ Encourage debate and multiple viewpoints. There's rarely one right answer."""
         """
         MIT-style Problem Sets with increasing complexity
         """
+        cached = self.artifacts.get("mit_problem_sets", topic, difficulty=difficulty)
+        if cached:
+            return {**cached, "cached": True}
+        
         prompt = f"""Create an MIT-style problem set for: {topic}
 Difficulty: {difficulty}
 
@@ -158,12 +294,14 @@ Make problems engaging and connected to real applications when possible."""
         
         problems = self.llm.invoke(prompt)
         
-        return {
+        result = {
             "method": "mit_problem_sets",
-            "problems": problems,
+            "problems": _text(problems),
             "style": "Hands-on problem solving",
             "skills_developed": ["Technical mastery", "Problem decomposition", "Creative solutions"]
         }
+        self.artifacts.put("mit_problem_sets", topic, result, difficulty=difficulty)
+        return result
     
     def stanford_design_thinking(self, challenge: str, current_stage: str = "empathize") -> Dict:
         """
@@ -220,6 +358,11 @@ Be creative, human-centered, and action-oriented."""
             "mixed": "Combination of different assessment types"
         }
         
+        objectives_key = "\n".join(sorted(learning_objectives))
+        cached = self.artifacts.get("generate_assessment", topic, style=style, variant=objectives_key)
+        if cached:
+            return {**cached, "cached": True}
+        
         prompt = f"""Create an assessment for: {topic}
 Learning Objectives: {', '.join(learning_objectives)}
 Style: {styles[style]}
@@ -235,18 +378,30 @@ Make questions thought-provoking and aligned with top university standards."""
         
         assessment = self.llm.invoke(prompt)
         
-        return {
-            "assessment": assessment,
+        result = {
+            "method": "generate_assessment",
+            "assessment": _text(assessment),
             "style": style,
             "objectives_tested": learning_objectives,
             "estimated_time": "60-90 minutes",
             "grading_approach": "Holistic with emphasis on reasoning"
         }
+        self.artifacts.put("generate_assessment", topic, result, style=style, variant=objectives_key)
+        return result
     
     def adaptive_learning_path(self, student_profile: Dict, topic: str) -> Dict:
         """
         Create personalized learning path based on student profile
         """
+        level = str(student_profile.get("knowledge_level", ""))
+        learning_style = str(student_profile.get("learning_style", ""))
+        profile_key = json.dumps(student_profile, sort_keys=True)
+        cached = self.artifacts.get(
+            "adaptive_learning_path", topic, difficulty=level, style=learning_style, variant=profile_key
+        )
+        if cached:
+            return {**cached, "cached": True}
+        
         prompt = f"""Design an adaptive learning path for:
 Topic: {topic}
 Student Profile: {json.dumps(student_profile, indent=2)}
@@ -267,12 +422,17 @@ Consider the student's:
         
         path = self.llm.invoke(prompt)
         
-        return {
-            "learning_path": path,
+        result = {
+            "method": "adaptive_learning_path",
+            "learning_path": _text(path),
             "personalization_factors": list(student_profile.keys()),
             "adaptive_elements": ["Pace", "Difficulty", "Method", "Content"],
             "success_metrics": "Mastery-based progression"
         }
+        self.artifacts.put(
+            "adaptive_learning_path", topic, result, difficulty=level, style=learning_style, variant=profile_key
+        )
+        return result
     
     def peer_learning_session(self, topic: str, participant_inputs: List[str]) -> Dict:
         """
@@ -311,6 +471,11 @@ Foster collaborative learning where students learn from each other."""
             "question": "Question-and-answer format"
         }
         
+        # Keyed by a digest of the text: topic normalization would merge different sources
+        cached = self.artifacts.get("generate_study_notes", content_topic(content), style=style)
+        if cached:
+            return {**cached, "cached": True}
+        
         prompt = f"""Convert this content into {styles[style]} study notes:
 {content}
 
@@ -325,82 +490,460 @@ Format should aid in both learning and review."""
         
         notes = self.llm.invoke(prompt)
         
-        return {
-            "notes": notes,
+        result = {
+            "method": "generate_study_notes",
+            "notes": _text(notes),
             "style": style,
             "features": ["Organized structure", "Active recall prompts", "Visual elements"],
             "study_tips": "Review within 24 hours, then weekly"
         }
+        self.artifacts.put("generate_study_notes", content_topic(content), result, style=style)
+        return result
+
+class LearningSessionStore:
+    """Durable learning sessions
+    
+    Each turn is one compact row (tutor text zlib-compressed); the session row keeps
+    the depth, counters and a bounded rolling summary, which is all the next prompt needs.
+    """
+    
+    def __init__(self, db_path: str = "chatbot.db", summary_lines: int = 12,
+                 idle_timeout: int = 30 * 60, storage: Optional[Storage] = None):
+        self.db_path = db_path
+        # SQLite file at db_path unless DATABASE_URL selects PostgreSQL
+        self.storage = storage or create_storage(db_path)
+        self.summary_lines = summary_lines
+        self.idle_timeout = idle_timeout
+        self._init_tables()
+    
+    def _init_tables(self):
+        """Create learning session tables"""
+        try:
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self.storage.ddl('''
+                    CREATE TABLE IF NOT EXISTS learning_sessions (
+                        session_id TEXT PRIMARY KEY,
+                        student_id TEXT NOT NULL,
+                        topic TEXT NOT NULL,
+                        method TEXT NOT NULL,
+                        start_time TEXT NOT NULL,
+                        last_active REAL NOT NULL,
+                        depth_level INTEGER DEFAULT 1,
+                        answers_at_depth INTEGER DEFAULT 0,
+                        turns INTEGER DEFAULT 0,
+                        summary TEXT DEFAULT '',
+                        assessment_score REAL,
+                        active INTEGER DEFAULT 1
+                    )
+                '''))
+                cursor.execute(self.storage.ddl('''
+                    CREATE TABLE IF NOT EXISTS learning_interactions (
+                        session_id TEXT NOT NULL,
+                        turn INTEGER NOT NULL,
+                        depth_level INTEGER NOT NULL,
+                        student_response TEXT,
+                        tutor_response BLOB,
+                        created REAL NOT NULL,
+                        PRIMARY KEY (session_id, turn)
+                    )
+                '''))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize learning session tables: {e}")
+    
+    def roll_summary(self, summary: str, student_response: str, tutor_response: str) -> str:
+        """Append one short line per speaker and keep only the most recent lines"""
+        lines = summary.splitlines() if summary else []
+        if student_response:
+            lines.append(f"- Student: {self._shorten(student_response)}")
+        questions = re.findall(r'[^.!?\n]*\?', tutor_response or "")
+        lines.append(f"- Tutor asked: {self._shorten(questions[-1] if questions else tutor_response)}")
+        return "\n".join(lines[-self.summary_lines:])
+    
+    @staticmethod
+    def _shorten(text: str, limit: int = 160) -> str:
+        """Single line, at most limit characters"""
+        text = " ".join((text or "").split())
+        return text if len(text) <= limit else text[:limit - 3] + "..."
+    
+    def save(self, session: LearningSession):
+        """Start a new run of a session: replace its row and drop the previous run's turns"""
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            # Turns restart at 0, so the old rows would otherwise be read back as this run's
+            cursor.execute('DELETE FROM learning_interactions WHERE session_id = ?', (session.session_id,))
+            cursor.execute(
+                upsert_statement('learning_sessions',
+                                 ['session_id', 'student_id', 'topic', 'method', 'start_time', 'last_active',
+                                  'depth_level', 'answers_at_depth', 'turns', 'summary', 'assessment_score',
+                                  'active'],
+                                 ['session_id']),
+                (session.session_id, session.student_id, session.topic, session.method.value,
+                 session.start_time.isoformat(), session.last_active, session.depth_level,
+                 session.answers_at_depth, session.turns, session.summary, session.assessment_score, 1)
+            )
+            conn.commit()
+    
+    def record_interaction(self, session: LearningSession, interaction: Dict):
+        """Store one turn and the updated session state in a single transaction"""
+        try:
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(upsert_statement(
+                    'learning_interactions',
+                    ['session_id', 'turn', 'depth_level', 'student_response', 'tutor_response', 'created'],
+                    ['session_id', 'turn']
+                ), (session.session_id, interaction["turn"], interaction["depth_level"],
+                      interaction["student_response"],
+                      zlib.compress(str(interaction["tutor_response"]).encode()), session.last_active))
+                cursor.execute('''
+                    UPDATE learning_sessions
+                    SET last_active = ?, depth_level = ?, answers_at_depth = ?, turns = ?, summary = ?
+                    WHERE session_id = ?
+                ''', (session.last_active, session.depth_level, session.answers_at_depth,
+                      session.turns, session.summary, session.session_id))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to record learning interaction: {e}")
+    
+    def load(self, session_id: str) -> Optional[LearningSession]:
+        """Load an active session with its most recent interactions"""
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT student_id, topic, method, start_time, last_active, depth_level,
+                       answers_at_depth, turns, summary, assessment_score
+                FROM learning_sessions WHERE session_id = ? AND active = 1
+            ''', (session_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            cursor.execute('''
+                SELECT turn, depth_level, student_response, tutor_response
+                FROM learning_interactions WHERE session_id = ?
+                ORDER BY turn DESC LIMIT ?
+            ''', (session_id, EducationalFeaturesHandler.RECENT_INTERACTIONS))
+            interactions = [
+                {
+                    "turn": r[0],
+                    "depth_level": r[1],
+                    "student_response": r[2],
+                    "tutor_response": zlib.decompress(r[3]).decode()
+                }
+                for r in reversed(cursor.fetchall())
+            ]
+        
+        return LearningSession(
+            session_id=session_id,
+            student_id=row[0],
+            topic=row[1],
+            method=TeachingMethod(row[2]),
+            start_time=datetime.fromisoformat(row[3]),
+            interactions=interactions,
+            assessment_score=row[9],
+            depth_level=row[5],
+            answers_at_depth=row[6],
+            turns=row[7],
+            summary=row[8],
+            last_active=row[4]
+        )
+    
+    def end(self, session_id: str):
+        """Mark a session finished; its history is kept"""
+        with self.storage.connect() as conn:
+            conn.cursor().execute('UPDATE learning_sessions SET active = 0 WHERE session_id = ?', (session_id,))
+            conn.commit()
+    
+    def get_history(self, session_id: str) -> List[Dict]:
+        """Full interaction history of a session"""
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT turn, depth_level, student_response, tutor_response, created
+                FROM learning_interactions WHERE session_id = ? ORDER BY turn
+            ''', (session_id,))
+            return [
+                {
+                    "turn": r[0],
+                    "depth_level": r[1],
+                    "student_response": r[2],
+                    "tutor_response": zlib.decompress(r[3]).decode(),
+                    "timestamp": datetime.fromtimestamp(r[4]).isoformat()
+                }
+                for r in cursor.fetchall()
+            ]
 
 class SpacedRepetitionSystem:
-    """Implement spaced repetition for optimal retention"""
-    
-    def __init__(self):
-        self.cards = {}
-        self.review_history = {}
-        
-    def add_card(self, card_id: str, front: str, back: str, topic: str):
-        """Add a new flashcard"""
-        self.cards[card_id] = {
-            "front": front,
-            "back": back,
-            "topic": topic,
-            "created": datetime.now(),
-            "interval": 1,  # Days until next review
-            "ease_factor": 2.5,
-            "reviews": 0
-        }
+    """Implement spaced repetition for optimal retention
     
-    def review_card(self, card_id: str, quality: int):
+    Cards live in the project database keyed by (student, card) with an index on
+    (student, topic, next_review), so due-card lookups are index range scans. Reviews are
+    buffered and written in batches, at the latest flush_interval seconds after the first
+    buffered review, and at interpreter exit.
+    """
+    
+    def __init__(self, db_path: str = "chatbot.db", batch_size: int = 100, flush_interval: float = 5.0,
+                 storage: Optional[Storage] = None):
+        self.db_path = db_path
+        # SQLite file at db_path unless DATABASE_URL selects PostgreSQL
+        self.storage = storage or create_storage(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.pending_cards = {}  # (student_id, card_id) -> updated card state not yet written
+        self.pending_reviews = []  # review history rows not yet written
+        self.pending_since = None  # monotonic time of the oldest buffered review
+        self._init_tables()
+        atexit.register(self.flush)
+    
+    def _init_tables(self):
+        """Create flashcard tables and indexes"""
+        try:
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                if self.storage.dialect == "sqlite":
+                    cursor.execute('PRAGMA journal_mode=WAL')
+                    self._migrate_card_key(cursor)
+                
+                cursor.execute(self.storage.ddl('''
+                    CREATE TABLE IF NOT EXISTS flashcards (
+                        student_id TEXT NOT NULL,
+                        card_id TEXT NOT NULL,
+                        topic TEXT NOT NULL,
+                        front TEXT NOT NULL,
+                        back TEXT NOT NULL,
+                        created REAL NOT NULL,
+                        interval INTEGER DEFAULT 1,
+                        ease_factor REAL DEFAULT 2.5,
+                        reviews INTEGER DEFAULT 0,
+                        next_review REAL NOT NULL,
+                        PRIMARY KEY (student_id, card_id)
+                    )
+                '''))
+                
+                cursor.execute(self.storage.ddl('''
+                    CREATE TABLE IF NOT EXISTS flashcard_reviews (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        student_id TEXT NOT NULL DEFAULT 'default',
+                        card_id TEXT NOT NULL,
+                        reviewed_at REAL NOT NULL,
+                        quality INTEGER NOT NULL,
+                        interval INTEGER NOT NULL
+                    )
+                '''))
+                
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcards_due ON flashcards(student_id, topic, next_review)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcards_student_due ON flashcards(student_id, next_review)')
+                cursor.execute('DROP INDEX IF EXISTS idx_flashcard_reviews_card')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcard_reviews_student_card ON flashcard_reviews(student_id, card_id)')
+                
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize flashcard tables: {e}")
+            raise
+    
+    @staticmethod
+    def _migrate_card_key(cursor):
+        """Rebuild SQLite tables created when card_id alone was the key, so students no longer share cards"""
+        cursor.execute('PRAGMA table_info(flashcards)')
+        key_columns = [row[1] for row in cursor.fetchall() if row[5]]
+        if key_columns != ['card_id']:
+            return
+        
+        logger.info("Migrating flashcards to a (student_id, card_id) key")
+        cursor.execute('ALTER TABLE flashcards RENAME TO flashcards_old')
+        cursor.execute('DROP INDEX IF EXISTS idx_flashcards_due')
+        cursor.execute('DROP INDEX IF EXISTS idx_flashcards_student_due')
+        cursor.execute('''
+            CREATE TABLE flashcards (
+                student_id TEXT NOT NULL,
+                card_id TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                front TEXT NOT NULL,
+                back TEXT NOT NULL,
+                created REAL NOT NULL,
+                interval INTEGER DEFAULT 1,
+                ease_factor REAL DEFAULT 2.5,
+                reviews INTEGER DEFAULT 0,
+                next_review REAL NOT NULL,
+                PRIMARY KEY (student_id, card_id)
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO flashcards
+            SELECT student_id, card_id, topic, front, back, created, interval, ease_factor, reviews, next_review
+            FROM flashcards_old
+        ''')
+        cursor.execute("ALTER TABLE flashcard_reviews ADD COLUMN student_id TEXT NOT NULL DEFAULT 'default'")
+        cursor.execute('''
+            UPDATE flashcard_reviews SET student_id = (
+                SELECT student_id FROM flashcards_old WHERE flashcards_old.card_id = flashcard_reviews.card_id
+            )
+            WHERE card_id IN (SELECT card_id FROM flashcards_old)
+        ''')
+        cursor.execute('DROP TABLE flashcards_old')
+    
+    def add_card(self, card_id: str, front: str, back: str, topic: str, student_id: str = "default"):
+        """Add a new flashcard (due immediately)"""
+        now = datetime.now().timestamp()
+        with self.lock:
+            # A replaced card starts over, so a buffered review of the old one must not overwrite it
+            self.pending_cards.pop((student_id, card_id), None)
+            with self.storage.connect() as conn:
+                conn.cursor().execute(
+                    upsert_statement('flashcards',
+                                     ['student_id', 'card_id', 'topic', 'front', 'back', 'created',
+                                      'interval', 'ease_factor', 'reviews', 'next_review'],
+                                     ['student_id', 'card_id']),
+                    (student_id, card_id, topic, front, back, now, 1, 2.5, 0, now)
+                )
+                conn.commit()
+    
+    def _load_card(self, student_id: str, card_id: str) -> Optional[Dict]:
+        """Current card state, including reviews not yet flushed"""
+        if (student_id, card_id) in self.pending_cards:
+            return self.pending_cards[(student_id, card_id)]
+        
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            self.storage.execute(
+                cursor,
+                'SELECT interval, ease_factor, reviews FROM flashcards WHERE student_id = ? AND card_id = ?',
+                (student_id, card_id), prepare=True
+            )
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        return {'interval': row[0], 'ease_factor': row[1], 'reviews': row[2]}
+    
+    def review_card(self, card_id: str, quality: int, student_id: str = "default"):
         """
         Review a card and update spacing
         Quality: 0-5 (0=complete fail, 5=perfect recall)
         """
-        if card_id not in self.cards:
-            return
+        with self.lock:
+            card = self._load_card(student_id, card_id)
+            if card is None:
+                return
+            card = dict(card)
             
-        card = self.cards[card_id]
-        
-        # SuperMemo SM-2 algorithm
-        if quality < 3:
-            card['interval'] = 1
-            card['ease_factor'] = max(1.3, card['ease_factor'] - 0.2)
-        else:
-            if card['reviews'] == 0:
+            # SuperMemo SM-2 algorithm
+            if quality < 3:
                 card['interval'] = 1
-            elif card['reviews'] == 1:
-                card['interval'] = 6
+                card['ease_factor'] = max(1.3, card['ease_factor'] - 0.2)
             else:
-                card['interval'] = round(card['interval'] * card['ease_factor'])
+                if card['reviews'] == 0:
+                    card['interval'] = 1
+                elif card['reviews'] == 1:
+                    card['interval'] = 6
+                else:
+                    card['interval'] = round(card['interval'] * card['ease_factor'])
+                
+                card['ease_factor'] = max(1.3, card['ease_factor'] + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
             
-            card['ease_factor'] = max(1.3, card['ease_factor'] + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
-        
-        card['reviews'] += 1
-        card['next_review'] = datetime.now() + timedelta(days=card['interval'])
+            now = datetime.now()
+            card['reviews'] += 1
+            card['next_review'] = (now + timedelta(days=card['interval'])).timestamp()
+            
+            # Buffer the state change and history row
+            self.pending_cards[(student_id, card_id)] = card
+            self.pending_reviews.append((student_id, card_id, now.timestamp(), quality, card['interval']))
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            
+            if len(self.pending_reviews) >= self.batch_size or \
+                    time.monotonic() - self.pending_since >= self.flush_interval:
+                self._flush_locked()
+    
+    def flush(self):
+        """Write buffered reviews to the database"""
+        with self.lock:
+            try:
+                self._flush_locked()
+            except Exception as e:
+                logger.error(f"Failed to flush flashcard reviews: {e}")
+    
+    def _flush_locked(self):
+        if not self.pending_reviews:
+            return
         
-        # Record history
-        if card_id not in self.review_history:
-            self.review_history[card_id] = []
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            self.storage.executemany(cursor, '''
+                UPDATE flashcards
+                SET interval = ?, ease_factor = ?, reviews = ?, next_review = ?
+                WHERE student_id = ? AND card_id = ?
+            ''', [
+                (card['interval'], card['ease_factor'], card['reviews'], card['next_review'], student_id, card_id)
+                for (student_id, card_id), card in self.pending_cards.items()
+            ])
+            self.storage.executemany(cursor, '''
+                INSERT INTO flashcard_reviews (student_id, card_id, reviewed_at, quality, interval)
+                VALUES (?, ?, ?, ?, ?)
+            ''', self.pending_reviews)
+            conn.commit()
         
-        self.review_history[card_id].append({
-            "date": datetime.now(),
-            "quality": quality,
-            "interval": card['interval']
-        })
+        self.pending_cards.clear()
+        self.pending_reviews.clear()
+        self.pending_since = None
     
-    def get_due_cards(self, topic: Optional[str] = None) -> List[Dict]:
-        """Get cards due for review"""
-        due_cards = []
-        now = datetime.now()
-        
-        for card_id, card in self.cards.items():
-            if topic and card['topic'] != topic:
-                continue
-                
-            if 'next_review' not in card or card['next_review'] <= now:
-                due_cards.append({
-                    "id": card_id,
-                    **card
-                })
+    def get_due_cards(self, topic: Optional[str] = None, student_id: str = "default", limit: int = 50) -> List[Dict]:
+        """Get cards due for review, most overdue first"""
+        with self.lock:
+            # Due-ness depends on buffered reviews, so write them first
+            self._flush_locked()
+            
+            now = datetime.now().timestamp()
+            with self.storage.connect() as conn:
+                cursor = conn.cursor()
+                if topic:
+                    cursor.execute('''
+                        SELECT card_id, front, back, topic, created, interval, ease_factor, reviews, next_review
+                        FROM flashcards
+                        WHERE student_id = ? AND topic = ? AND next_review <= ?
+                        ORDER BY next_review
+                        LIMIT ?
+                    ''', (student_id, topic, now, limit))
+                else:
+                    cursor.execute('''
+                        SELECT card_id, front, back, topic, created, interval, ease_factor, reviews, next_review
+                        FROM flashcards
+                        WHERE student_id = ? AND next_review <= ?
+                        ORDER BY next_review
+                        LIMIT ?
+                    ''', (student_id, now, limit))
+                rows = cursor.fetchall()
         
-        return due_cards
\ No newline at end of file
+        return [
+            {
+                "id": row[0],
+                "front": row[1],
+                "back": row[2],
+                "topic": row[3],
+                "created": datetime.fromtimestamp(row[4]),
+                "interval": row[5],
+                "ease_factor": row[6],
+                "reviews": row[7],
+                "next_review": datetime.fromtimestamp(row[8])
+            }
+            for row in rows
+        ]
+    
+    def get_review_history(self, card_id: str, student_id: str = "default") -> List[Dict]:
+        """Review history for a student's card, oldest first"""
+        self.flush()
+        with self.storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT reviewed_at, quality, interval
+                FROM flashcard_reviews
+                WHERE student_id = ? AND card_id = ?
+                ORDER BY id
+            ''', (student_id, card_id))
+            return [
+                {"date": datetime.fromtimestamp(row[0]), "quality": row[1], "interval": row[2]}
+                for row in cursor.fetchall()
+            ]
@@ -11,6 +11,9 @@ import json
 import pickle
 from pathlib import Path
 
+from concept_clustering import ConceptClusteringService
+from similarity import normalize_rows, similarity_matrix, thresholded_pairs, max_similarity, rank_top_k
+
 logger = logging.getLogger(__name__)
 
 class EmbeddingsHandler:
@@ -20,6 +23,14 @@ class EmbeddingsHandler:
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.model = "text-embedding-v3"
+        self._clustering_service = None
+    
+    @property
+    def clustering_service(self) -> ConceptClusteringService:
+        """Incremental clustering service, created on first use"""
+        if self._clustering_service is None:
+            self._clustering_service = ConceptClusteringService(self)
+        return self._clustering_service
         
     def get_embeddings(self, texts: Union[str, List[str]]) -> np.ndarray:
         """Get embeddings for text(s) using Qwen's embedding model"""
@@ -72,20 +83,14 @@ class EmbeddingsHandler:
         doc_texts = [doc.get('content', '') for doc in documents]
         doc_embeddings = self.get_embeddings(doc_texts)
         
-        # Calculate similarities
-        similarities = []
-        for i, doc_embedding in enumerate(doc_embeddings):
-            similarity = self.cosine_similarity(query_embedding, doc_embedding)
-            similarities.append((i, similarity))
-        
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        if len(doc_embeddings) == 0:
+            return []
         
-        # Return top results
+        # Rank all documents with one matrix product
         results = []
-        for idx, score in similarities[:top_k]:
+        for idx, score in rank_top_k(query_embedding, doc_embeddings, top_k):
             result = documents[idx].copy()
-            result['similarity_score'] = float(score)
+            result['similarity_score'] = score
             results.append(result)
         
         return results
@@ -96,27 +101,8 @@ class EmbeddingsHandler:
     
     def cluster_concepts(self, concepts: List[str], num_clusters: int = 5) -> Dict[int, List[str]]:
         """Cluster related concepts together for study organization"""
-        from sklearn.cluster import KMeans
-        
-        # Get embeddings for all concepts
-        embeddings = self.get_embeddings(concepts)
-        
-        if len(embeddings) == 0:
-            return {}
-        
-        # Perform clustering
-        num_clusters = min(num_clusters, len(concepts))
-        kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-        clusters = kmeans.fit_predict(embeddings)
-        
-        # Organize results
-        clustered_concepts = {}
-        for idx, cluster_id in enumerate(clusters):
-            if cluster_id not in clustered_concepts:
-                clustered_concepts[cluster_id] = []
-            clustered_concepts[cluster_id].append(concepts[idx])
-        
-        return clustered_concepts
+        # Cached embeddings and persisted centroids live in the clustering service
+        return self.clustering_service.cluster(concepts, num_clusters)
     
     def create_concept_map(self, main_topic: str, subtopics: List[str]) -> Dict:
         """Create a concept map showing relationships between topics"""
@@ -126,25 +112,23 @@ class EmbeddingsHandler:
         if len(embeddings) == 0:
             return {}
         
-        main_embedding = embeddings[0]
-        relationships = {}
+        # Normalize once; every relationship below is a row of one Gram matrix
+        gram = similarity_matrix(embeddings)
         
         # Calculate relationship strength between main topic and subtopics
+        relationships = {}
         for i, subtopic in enumerate(subtopics):
-            similarity = self.cosine_similarity(main_embedding, embeddings[i + 1])
+            similarity = float(gram[0, i + 1])
             relationships[subtopic] = {
-                'strength': float(similarity),
+                'strength': similarity,
                 'relationship': self._classify_relationship(similarity)
             }
         
-        # Find relationships between subtopics
-        subtopic_relationships = {}
-        for i in range(len(subtopics)):
-            for j in range(i + 1, len(subtopics)):
-                similarity = self.cosine_similarity(embeddings[i + 1], embeddings[j + 1])
-                if similarity > 0.7:  # Strong relationship threshold
-                    key = f"{subtopics[i]} <-> {subtopics[j]}"
-                    subtopic_relationships[key] = float(similarity)
+        # Find strong relationships between subtopics
+        subtopic_relationships = {
+            f"{subtopics[i]} <-> {subtopics[j]}": similarity
+            for i, j, similarity in thresholded_pairs(gram[1:, 1:], 0.7)
+        }
         
         return {
             'main_topic': main_topic,
@@ -179,20 +163,18 @@ class EmbeddingsHandler:
         known_indices = [concept_indices[k] for k in current_knowledge if k in concept_indices]
         topic_indices = [concept_indices[t] for t in topics if t in concept_indices]
         
-        # Calculate difficulty based on distance from known concepts
-        topic_difficulties = []
-        for t_idx in topic_indices:
-            if known_indices:
-                # Find similarity to closest known concept
-                max_similarity = max(
-                    self.cosine_similarity(embeddings[t_idx], embeddings[k_idx])
-                    for k_idx in known_indices
-                )
-                difficulty = 1 - max_similarity  # Less similar = more difficult
-            else:
-                difficulty = 0.5  # Default difficulty
-            
-            topic_difficulties.append((all_concepts[t_idx], difficulty))
+        # Calculate difficulty based on distance from the closest known concept
+        if known_indices:
+            normalized = normalize_rows(embeddings)
+            closest = max_similarity(normalized[topic_indices], normalized[known_indices], normalized=True)
+            difficulties = 1 - closest  # Less similar = more difficult
+        else:
+            difficulties = np.full(len(topic_indices), 0.5)  # Default difficulty
+        
+        topic_difficulties = [
+            (all_concepts[t_idx], float(difficulty))
+            for t_idx, difficulty in zip(topic_indices, difficulties)
+        ]
         
         # Sort by difficulty (easiest first)
         topic_difficulties.sort(key=lambda x: x[1])
@@ -245,22 +227,11 @@ class StudyMaterialsIndex:
         # Get query embedding
         query_embedding = self.embeddings_handler.get_embeddings(query)[0]
         
-        # Calculate similarities
-        similarities = []
-        for idx in filtered_indices:
-            similarity = self.embeddings_handler.cosine_similarity(
-                query_embedding, 
-                self.embeddings[idx]
-            )
-            similarities.append((idx, similarity))
-        
-        # Sort and return top results
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
+        # Score only the filtered rows in one pass
         results = []
-        for idx, score in similarities[:top_k]:
-            result = self.materials[idx].copy()
-            result['similarity_score'] = float(score)
+        for pos, score in rank_top_k(query_embedding, self.embeddings[filtered_indices], top_k):
+            result = self.materials[filtered_indices[pos]].copy()
+            result['similarity_score'] = score
             results.append(result)
         
-        return results
\ No newline at end of file
+        return results
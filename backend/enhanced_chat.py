@@ -15,7 +15,9 @@ from dynamic_scraper import get_dynamic_content_for_query
 from general_web_assistant import enhance_query_with_website_context
 from web_search import enhance_with_web_search
 from grade9_knowledge_indexer import grade9_indexer
+from intent_router import classify
 from markdown_cleaner import clean_markdown_response
+from metrics import TRACE_RESPONSES, current_spans, set_request_model, timed
 from simple_vision_handler import analyze_image_with_qwen_vl
 
 logger = logging.getLogger(__name__)
@@ -23,30 +25,47 @@ logger = logging.getLogger(__name__)
 class ChatProcessor:
     """Handles chat processing for different models"""
     
-    def __init__(self, qwen_llm, knowledge_service, conversation_service):
+    def __init__(self, qwen_llm, knowledge_service, conversation_service, semantic_cache=None):
         self.qwen_llm = qwen_llm
         self.knowledge_service = knowledge_service
         self.conversation_service = conversation_service
+        self.semantic_cache = semantic_cache
     
-    def process_chat(self, request, memory) -> dict:
-        """Process chat based on selected model"""
+    def process_chat(self, request, memory, images: Optional[List[str]] = None) -> dict:
+        """Process chat based on selected model
+        
+        images are vision-ready references (file:// paths or URLs) for uploaded images.
+        """
         start_time = time.time()
         
         # Get model configuration
         model_type = get_model_by_id(request.model) or ModelType.GENERAL
         model_config = model_selector.get_model_config(model_type)
+        set_request_model(model_type.value)
         
         logger.info(f"Processing with {model_config.display_name}")
         
         # Get latest message
         latest_message = request.messages[-1]
         
-        # Check if message contains image data
+        # Uploaded images are referenced by id and resolved to files by the caller
+        if images:
+            return self._process_uploaded_images(latest_message.content, images)
+        
+        # Legacy path: base64 data URLs embedded in the message text
         if 'data:image' in latest_message.content:
             return self._process_image_query(latest_message.content)
         
+        # Paraphrases of a recent standalone question get its answer
+        cache_lookup = None
+        if self._is_cacheable(request, model_type):
+            with timed("semantic_cache"):
+                cache_lookup = self.semantic_cache.lookup(model_type.value, latest_message.content)
+        
         # Process based on model type
-        if model_type == ModelType.GENERAL:
+        if cache_lookup is not None and cache_lookup.answer is not None:
+            result = self.semantic_cache.serve(cache_lookup)
+        elif model_type == ModelType.GENERAL:
             result = self._process_general(request, latest_message, model_config)
         elif model_type == ModelType.EVEREST:
             result = self._process_everest(request, latest_message, model_config)
@@ -55,16 +74,34 @@ class ChatProcessor:
         else:
             raise ValueError(f"Unknown model type: {model_type}")
         
+        # Live web search results are not worth repeating
+        if cache_lookup is not None and cache_lookup.answer is None and result.get('success') \
+                and 'web_search' not in result.get('features_used', []):
+            llm_spans = [span['duration_ms'] for span in current_spans() if span['stage'] == 'llm_call']
+            llm_seconds = sum(llm_spans) / 1000 if llm_spans else time.time() - start_time
+            self.semantic_cache.store(cache_lookup, result, llm_seconds)
+        
         # Add metadata
+        processing_time = time.time() - start_time
+        model_selector.record_usage(model_type, processing_time)
         result['metadata'] = {
             'model': model_config.display_name,
             'model_id': model_type.value,
-            'processing_time': time.time() - start_time,
+            'processing_time': processing_time,
             'features_used': result.get('features_used', [])
         }
+        if TRACE_RESPONSES:
+            result['metadata']['trace'] = list(current_spans())
         
         return result
     
+    def _is_cacheable(self, request, model_type: ModelType) -> bool:
+        """Only answers that depend on the question alone can be shared"""
+        if self.semantic_cache is None or model_type == ModelType.WEB_SCRAPER:
+            return False
+        # Earlier turns shape the answer, so follow-up questions are not cached
+        return len(request.messages) == 1
+    
     def _process_general(self, request, latest_message, model_config) -> dict:
         """Process general queries with web search capability"""
         features_used = []
@@ -81,7 +118,8 @@ class ChatProcessor:
             current_president = "Joe Biden (46th President)"
         
         # Check if web search is needed
-        web_search_result = enhance_with_web_search(latest_message.content)
+        with timed("web_search"):
+            web_search_result = enhance_with_web_search(latest_message.content)
         
         # Build dynamic system prompt with current date
         system_prompt = f"""You are a helpful, fast AI assistant with access to current information through web search.
@@ -124,7 +162,10 @@ Instructions:
         self.qwen_llm.max_tokens = model_config.max_tokens
         
         try:
-            response = self.qwen_llm.invoke(messages)
+            with timed("llm_call"):
+                response = self.qwen_llm.invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             # Extract any sources from the response
             sources = []
@@ -134,7 +175,7 @@ Instructions:
                     sources.append("Web Search Results")
             
             return {
-                'message': clean_markdown_response(response.content),
+                'message': answer,
                 'success': True,
                 'features_used': features_used,
                 'sources': sources if sources else None
@@ -152,27 +193,28 @@ Instructions:
         features_used = []
         
         # Check if query is about Grade 9 resources
-        query_lower = latest_message.content.lower()
-        grade9_keywords = ['grade 9', 'grade nine', 'g9', 'study', 'lesson', 'chapter', 'topic', 'subject', 'math', 'science']
-        is_grade9_query = any(keyword in query_lower for keyword in grade9_keywords)
+        with timed("routing"):
+            routing = classify(latest_message.content)
+        is_grade9_query = routing.has('grade9')
         
         # Get knowledge base context with reduced limit for speed
-        context = self.conversation_service.get_recent_context(
-            request.session_id,
-            latest_message.content,
-            self.knowledge_service
-        )
+        with timed("db_context"):
+            context = self.conversation_service.get_recent_context(
+                request.session_id,
+                latest_message.content,
+                self.knowledge_service
+            )
         features_used.append('knowledge_base')
         
         # Only scrape if question likely needs fresh data
         dynamic_content = ""
-        scraping_keywords = ['admission', 'apply', 'tuition', 'fee', 'contact', 'schedule', 'process']
-        should_scrape = any(keyword in latest_message.content.lower() for keyword in scraping_keywords)
+        should_scrape = routing.has('school_info')
         
         if should_scrape:
             try:
                 logger.info("Fetching targeted Everest Academy data...")
-                dynamic_content = get_dynamic_content_for_query(latest_message.content)
+                with timed("dynamic_scrape"):
+                    dynamic_content = get_dynamic_content_for_query(latest_message.content)
                 if dynamic_content:
                     features_used.append('web_scraping')
             except Exception as e:
@@ -182,7 +224,8 @@ Instructions:
         grade9_context = ""
         if is_grade9_query:
             # Search for relevant Grade 9 resources
-            grade9_results = grade9_indexer.search_resources(latest_message.content)
+            with timed("grade9_search"):
+                grade9_results = grade9_indexer.search_resources(latest_message.content)
             if grade9_results:
                 grade9_context = grade9_indexer.format_for_context(grade9_results)
                 features_used.append('grade9_resources')
@@ -219,13 +262,16 @@ User Question: {latest_message.content}"""
         messages = [HumanMessage(content=system_prompt)]
         
         try:
-            response = self.qwen_llm.invoke(messages)
+            with timed("llm_call"):
+                response = self.qwen_llm.invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             # Extract sources from response
             sources = self._extract_sources(response.content)
             
             return {
-                'message': clean_markdown_response(response.content),
+                'message': answer,
                 'success': True,
                 'features_used': features_used,
                 'sources': sources
@@ -243,7 +289,8 @@ User Question: {latest_message.content}"""
         features_used = ['web_scraping']
         
         # Check for website context
-        web_enhancement = enhance_query_with_website_context(latest_message.content)
+        with timed("dynamic_scrape"):
+            web_enhancement = enhance_query_with_website_context(latest_message.content)
         
         if not web_enhancement['has_website_context']:
             # No URL found - provide guidance
@@ -289,7 +336,10 @@ User's Research Query: {cleaned_query}"""
         messages = [HumanMessage(content=system_prompt)]
         
         try:
-            response = self.qwen_llm.invoke(messages)
+            with timed("llm_call"):
+                response = self.qwen_llm.invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             # Extract all sources
             sources = self._extract_sources(response.content)
@@ -299,7 +349,7 @@ User's Research Query: {cleaned_query}"""
             sources = list(dict.fromkeys(sources))
             
             return {
-                'message': clean_markdown_response(response.content),
+                'message': answer,
                 'success': True,
                 'features_used': features_used,
                 'sources': sources,
@@ -335,6 +385,34 @@ User's Research Query: {cleaned_query}"""
         
         return list(set(sources))
     
+    def _process_uploaded_images(self, text: str, images: List[str]) -> dict:
+        """Process queries whose images were uploaded through /api/images"""
+        try:
+            logger.info(f"Processing {len(images)} uploaded image(s) with Qwen-VL")
+            response = analyze_image_with_qwen_vl(
+                images,
+                text.strip() or "What is in this image?",
+                self.qwen_llm.openai_api_key
+            )
+            
+            return {
+                'message': clean_markdown_response(response),
+                'success': True,
+                'features_used': ['vision', 'image_analysis'],
+                'metadata': {
+                    'model': 'qwen-vl-max',
+                    'capabilities': ['image_understanding', 'ocr', 'visual_qa']
+                }
+            }
+            
+        except Exception as e:
+            logger.error(f"Image processing error: {e}")
+            return {
+                'message': f"I encountered an error analyzing the image: {str(e)}",
+                'success': False,
+                'error': str(e)
+            }
+    
     def _process_image_query(self, content: str) -> dict:
         """Process queries containing images using Qwen-VL"""
         try:
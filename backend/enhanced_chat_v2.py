@@ -3,6 +3,7 @@ Enhanced Chat Processor V2 with Full Qwen Capabilities
 Includes vision, embeddings, educational features, and multiple models
 """
 import logging
+import re
 import time
 import json
 from typing import List, Dict, Optional, Union
@@ -17,14 +18,31 @@ from dynamic_scraper import get_dynamic_content_for_query
 from general_web_assistant import enhance_query_with_website_context
 from web_search import enhance_with_web_search
 from grade9_knowledge_indexer import grade9_indexer
+from intent_router import classify
 from markdown_cleaner import clean_markdown_response
+from metrics import TRACE_RESPONSES, current_spans, set_request_model, timed
 from vision_handler import VisionHandler, ImageProcessor
+from image_pipeline import image_preprocessor
 from embeddings_handler import EmbeddingsHandler, StudyMaterialsIndex
-from educational_features import EducationalFeaturesHandler, TeachingMethod
+from educational_features import DEFAULT_STUDENT_PROFILE, EducationalFeaturesHandler, TeachingMethod
 from qwen_models import QwenModelType, QWEN_MODEL_CONFIGS
 
 logger = logging.getLogger(__name__)
 
+# Messages that close an ongoing tutoring session
+END_SESSION_PATTERN = re.compile(
+    r"^(ok(ay)?,? )?(thanks?( you)?,? )?(let'?s )?(stop|end( the)?( session)?|quit|exit|(i'?m |we'?re )?done|"
+    r"that'?s (all|enough)|no more questions|change (the )?topic|something else)\b"
+)
+# Requests that start something new rather than answer the tutor
+NEW_REQUEST_PATTERN = re.compile(
+    r"^(can you|could you|would you|please|tell me|give me|show me|write|search|find|look up|what'?s the (weather|date|time))\b"
+)
+# Routed intents that take priority over an ongoing tutoring session
+SESSION_OVERRIDE_INTENTS = ('math', 'school_info', 'url')
+# Answers to a tutor's question are short; a long message is a new task pasted in
+MAX_SESSION_ANSWER_CHARS = 1500
+
 class EnhancedChatProcessor:
     """Enhanced chat processor with full Qwen capabilities"""
     
@@ -69,6 +87,9 @@ class EnhancedChatProcessor:
         # Services
         self.knowledge_service = knowledge_service
         self.conversation_service = conversation_service
+        # Semantic retrieval uses this processor's embeddings unless the service brought its own
+        if knowledge_service and knowledge_service.retriever and knowledge_service.retriever.vectors is None:
+            knowledge_service.retriever.set_embeddings_handler(self.embeddings_handler)
         
         # Cache for embeddings
         self.embeddings_cache = {}
@@ -84,29 +105,41 @@ class EnhancedChatProcessor:
             session_id = request.get("session_id", "default")
             model = request.get("model", "general")
             
+            model_type = get_model_by_id(model) or ModelType.GENERAL
+            set_request_model(model_type.value)
+            
+            with timed("routing"):
+                routing = classify(message)
+            logger.debug(f"Routing scores: {routing.matches} ({routing.timings['total_ms']:.3f} ms)")
+            
             # Check if this is an image query
             if images:
-                return self._process_vision_query(message, images)
+                result = self._process_vision_query(message, images)
+            
+            # An ongoing tutoring session keeps messages that read as answers to its last question
+            elif self._continues_learning_session(message, routing, model_type, session_id):
+                result = self._process_educational_query(message, session_id, routing, in_session=True)
             
             # Check for educational features
-            if any(keyword in message.lower() for keyword in ["teach me", "explain", "tutor", "study", "learn"]):
-                return self._process_educational_query(message, session_id)
+            elif routing.has('educational') or routing.has('tutor_session'):
+                result = self._process_educational_query(message, session_id, routing)
             
             # Check for math problems
-            if any(keyword in message.lower() for keyword in ["solve", "calculate", "equation", "math", "formula"]):
-                return self._process_math_query(message)
+            elif routing.has('math'):
+                result = self._process_math_query(message)
             
             # Regular chat processing based on model
-            model_type = get_model_by_id(model) or ModelType.GENERAL
-            
-            if model_type == ModelType.GENERAL:
-                return self._process_general_enhanced(message)
             elif model_type == ModelType.EVEREST:
-                return self._process_everest_enhanced(message, session_id)
+                result = self._process_everest_enhanced(message, session_id)
             elif model_type == ModelType.WEB_SCRAPER:
-                return self._process_web_enhanced(message)
+                result = self._process_web_enhanced(message)
             else:
-                return self._process_general_enhanced(message)
+                result = self._process_general_enhanced(message)
+            
+            model_selector.record_usage(model_type, time.time() - start_time)
+            if TRACE_RESPONSES:
+                result["trace"] = list(current_spans())
+            return result
                 
         except Exception as e:
             logger.error(f"Enhanced chat processor error: {e}")
@@ -121,14 +154,8 @@ class EnhancedChatProcessor:
         """Process queries with images using Qwen-VL"""
         logger.info("Processing vision query")
         
-        # Compress images if needed
-        processed_images = []
-        for img in images:
-            if img.startswith('data:image'):
-                compressed = ImageProcessor.compress_image(img)
-                processed_images.append(compressed)
-            else:
-                processed_images.append(img)
+        # Compress images in the worker pool (cached by content hash)
+        processed_images = image_preprocessor.preprocess(images)
         
         # Analyze with vision model
         result = self.vision_handler.analyze_image(
@@ -153,16 +180,49 @@ class EnhancedChatProcessor:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def _process_educational_query(self, message: str, session_id: str) -> dict:
+    def _continues_learning_session(self, message: str, routing, model_type: ModelType, session_id: str) -> bool:
+        """Whether a message belongs to the session's tutoring dialogue rather than another route
+        
+        The web scraper model, math, school and URL intents, requests phrased as a new task and
+        long pasted text all go to their own handlers; the session stays open for the next answer.
+        """
+        if model_type == ModelType.WEB_SCRAPER:
+            return False
+        if not self.educational_handler.get_learning_session(session_id):
+            return False
+        text = message.lower().strip()
+        if END_SESSION_PATTERN.match(text):
+            return True
+        if any(routing.has(intent) for intent in SESSION_OVERRIDE_INTENTS):
+            return False
+        return len(text) <= MAX_SESSION_ANSWER_CHARS and not NEW_REQUEST_PATTERN.match(text)
+    
+    def _process_educational_query(self, message: str, session_id: str, routing, in_session: bool = False) -> dict:
         """Process educational queries with advanced teaching methods"""
         logger.info("Processing educational query")
         
-        # Determine teaching method based on query
-        if "socratic" in message.lower() or "question" in message.lower():
-            result = self.educational_handler.create_socratic_dialogue(
-                topic=message,
-                student_response="",
-                depth_level=1
+        learning_session = self.educational_handler.get_learning_session(session_id) if in_session else None
+        if learning_session and END_SESSION_PATTERN.match(message.lower().strip()):
+            self.educational_handler.end_learning_session(session_id)
+            return {
+                "response": f"Great work on {learning_session.topic}! Our session is finished - start a new one any time.",
+                "success": True,
+                "model": "qwen-max",
+                "features_used": ["educational", "socratic"],
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        # Determine teaching method based on query; only an explicit request starts a tutoring session
+        if routing.has('tutor_session'):
+            result = self.educational_handler.continue_socratic_dialogue(
+                session_id=session_id,
+                topic=message
+            )
+        elif learning_session:
+            # The message answers the tutor's last question
+            result = self.educational_handler.continue_socratic_dialogue(
+                session_id=session_id,
+                student_response=message
             )
         elif "tutor" in message.lower() or "feedback" in message.lower():
             result = self.educational_handler.oxford_tutorial(
@@ -181,18 +241,13 @@ class EnhancedChatProcessor:
             )
         else:
             # Default to adaptive learning path
-            student_profile = {
-                "learning_style": "mixed",
-                "knowledge_level": "intermediate",
-                "available_time": "flexible",
-                "goals": "comprehensive understanding"
-            }
             result = self.educational_handler.adaptive_learning_path(
-                student_profile=student_profile,
+                student_profile=DEFAULT_STUDENT_PROFILE,
                 topic=message
             )
         
-        response = result.get("response") or result.get("feedback") or result.get("learning_path", "")
+        response = (result.get("response") or result.get("feedback") or
+                    result.get("problems") or result.get("learning_path", ""))
         
         return {
             "response": clean_markdown_response(str(response)),
@@ -221,10 +276,13 @@ Provide:
         messages = [HumanMessage(content=prompt)]
         
         try:
-            response = self.models["qwen-math-plus"].invoke(messages)
+            with timed("llm_call"):
+                response = self.models["qwen-math-plus"].invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             return {
-                "response": clean_markdown_response(response.content),
+                "response": answer,
                 "success": True,
                 "model": "qwen-math-plus",
                 "features_used": ["mathematical_reasoning", "step_by_step_solution"],
@@ -242,7 +300,8 @@ Provide:
         day_name = current_date.strftime("%A")
         
         # Check if query needs web search
-        web_search_result = enhance_with_web_search(message, self.api_key)
+        with timed("web_search"):
+            web_search_result = enhance_with_web_search(message, self.api_key)
         features_used = []
         
         context = ""
@@ -267,10 +326,13 @@ Provide helpful, accurate, and engaging responses."""
         messages = [HumanMessage(content=system_prompt + "\n\nUser: " + message)]
         
         try:
-            response = self.models["qwen-max"].invoke(messages)
+            with timed("llm_call"):
+                response = self.models["qwen-max"].invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             return {
-                "response": clean_markdown_response(response.content),
+                "response": answer,
                 "success": True,
                 "model": "qwen-max",
                 "features_used": features_used,
@@ -290,41 +352,36 @@ Provide helpful, accurate, and engaging responses."""
         features_used = ['everest_knowledge', 'grade9_resources']
         
         # Search Grade 9 resources
-        grade9_results = grade9_indexer.search_resources(message)
+        with timed("grade9_search"):
+            grade9_results = grade9_indexer.search_resources(message)
         grade9_context = grade9_indexer.format_for_context(grade9_results) if grade9_results else ""
         
-        # Get knowledge base context
+        # Get knowledge base context; both paths rank entries with the hybrid retriever
         context = ""
         if self.conversation_service:
-            context = self.conversation_service.get_recent_context(
-                session_id,
-                message,
-                self.knowledge_service
-            )
+            with timed("db_context"):
+                context = self.conversation_service.get_recent_context(
+                    session_id,
+                    message,
+                    self.knowledge_service
+                )
+        elif self.knowledge_service:
+            with timed("db_context"):
+                knowledge = self.knowledge_service.get_relevant_knowledge_for_query(message, limit=3, session_id=session_id)
+            context = self.knowledge_service.format_knowledge_for_context(knowledge)
+        if self.knowledge_service and self.knowledge_service.retriever.has_vectors():
+            features_used.append('semantic_search')
         
         # Try web scraping for current info
         dynamic_content = ""
         try:
-            dynamic_content = get_dynamic_content_for_query(message)
+            with timed("dynamic_scrape"):
+                dynamic_content = get_dynamic_content_for_query(message)
             if dynamic_content:
                 features_used.append('web_scraping')
         except Exception as e:
             logger.error(f"Scraping error: {e}")
         
-        # Use embeddings for semantic search if available
-        if self.knowledge_service:
-            # Search knowledge base using embeddings
-            knowledge_docs = []
-            # Convert knowledge to searchable format
-            # This would need to be implemented in knowledge_service
-            semantic_results = self.embeddings_handler.semantic_search(
-                message,
-                knowledge_docs,
-                top_k=3
-            )
-            if semantic_results:
-                features_used.append('semantic_search')
-        
         # Combine all context
         full_context = f"""
 {context}
@@ -343,10 +400,13 @@ Provide helpful, accurate responses for students, parents, and teachers."""
         messages = [HumanMessage(content=full_context + "\n\nUser: " + message)]
         
         try:
-            response = self.models["qwen-max"].invoke(messages)
+            with timed("llm_call"):
+                response = self.models["qwen-max"].invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             return {
-                "response": clean_markdown_response(response.content),
+                "response": answer,
                 "success": True,
                 "model": "qwen-max",
                 "features_used": features_used,
@@ -366,7 +426,8 @@ Provide helpful, accurate responses for students, parents, and teachers."""
         """Enhanced web processing with better scraping"""
         features_used = ['web_scraping']
         
-        web_enhancement = enhance_query_with_website_context(message)
+        with timed("dynamic_scrape"):
+            web_enhancement = enhance_query_with_website_context(message)
         
         if not web_enhancement['has_website_context']:
             return {
@@ -405,7 +466,10 @@ User Query: {cleaned_query}"""
         messages = [HumanMessage(content=system_prompt)]
         
         try:
-            response = self.models["qwen-max"].invoke(messages)
+            with timed("llm_call"):
+                response = self.models["qwen-max"].invoke(messages)
+            with timed("markdown_clean"):
+                answer = clean_markdown_response(response.content)
             
             # Extract sources
             sources = self._extract_sources(response.content)
@@ -413,7 +477,7 @@ User Query: {cleaned_query}"""
             sources = list(dict.fromkeys(sources))
             
             return {
-                "response": clean_markdown_response(response.content),
+                "response": answer,
                 "success": True,
                 "model": "qwen-max",
                 "features_used": features_used,
@@ -4,12 +4,18 @@ General web assistant that can scrape and provide information from any website
 """
 
 import re
+import os
+from typing import Optional
 from urllib.parse import urlparse
-from dynamic_scraper import DynamicWebScraper, scraping_cache
+from dynamic_scraper import ContextFormatter, DynamicWebScraper, scraping_cache
+from intent_router import classify
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Seconds related pages may add to a URL question once its own page is scraped
+RELATED_PAGES_BUDGET = float(os.getenv("RELATED_PAGES_BUDGET_MS", "1000")) / 1000
+
 def extract_url_from_query(query: str) -> tuple[str, str]:
     """Extract URL from query and return (url, cleaned_query)"""
     # Common URL patterns
@@ -50,22 +56,13 @@ def analyze_query_intent(query: str) -> dict:
         'specific_info': []
     }
     
-    # Instruction indicators
-    instruction_keywords = ['how to', 'steps', 'process', 'guide', 'tutorial', 
-                          'procedure', 'instructions', 'apply', 'fill', 'submit']
-    intent['needs_instructions'] = any(kw in query.lower() for kw in instruction_keywords)
-    
-    # URL/navigation indicators
-    url_keywords = ['url', 'link', 'page', 'where', 'find', 'locate', 'navigate', 'access']
-    intent['needs_urls'] = any(kw in query.lower() for kw in url_keywords)
+    routing = classify(query)
     
-    # Form-related
-    form_keywords = ['form', 'application', 'registration', 'submit', 'fill out', 'apply']
-    intent['needs_form_help'] = any(kw in query.lower() for kw in form_keywords)
-    
-    # Navigation help
-    nav_keywords = ['navigate', 'find', 'where is', 'location of', 'how to get to']
-    intent['needs_navigation'] = any(kw in query.lower() for kw in nav_keywords)
+    # Instruction, URL, form and navigation indicators
+    intent['needs_instructions'] = routing.has('instructions')
+    intent['needs_urls'] = routing.has('urls')
+    intent['needs_form_help'] = routing.has('form_help')
+    intent['needs_navigation'] = routing.has('navigation')
     
     # Extract specific topics
     topic_patterns = [
@@ -81,8 +78,11 @@ def analyze_query_intent(query: str) -> dict:
     
     return intent
 
-def get_context_for_any_website(query: str) -> tuple[str, str]:
-    """Get context for any website mentioned in the query"""
+def get_context_for_any_website(query: str, related_budget: Optional[float] = None) -> tuple[str, str]:
+    """Get context for any website mentioned in the query
+    
+    related_budget is how many seconds related pages may take after the first page is in.
+    """
     # Extract URL from query
     url, cleaned_query = extract_url_from_query(query)
     
@@ -104,42 +104,28 @@ def get_context_for_any_website(query: str) -> tuple[str, str]:
     if intent['needs_form_help']:
         scraping_query += " form application submit"
     
-    # Check cache
-    cache_key = f"{base_url}:{scraping_query}"
-    cached_data = scraping_cache.get(cache_key)
-    
-    if cached_data:
-        logger.info(f"Using cached data for {base_url}")
-        scraper = DynamicWebScraper(base_url)
-        formatted = scraper.format_for_context(cached_data, scraping_query)
-    else:
-        # Scrape the website
-        try:
-            logger.info(f"Scraping {base_url} for: {scraping_query}")
-            scraper = DynamicWebScraper(base_url)
-            
-            # If specific URL provided, start with that
-            if url != base_url:
-                # Scrape the specific page first
-                specific_data = scraper.scrape_url_with_context(url, scraping_query)
-                if specific_data:
-                    scraped_data = [specific_data]
-                    # Then find related pages
-                    related = scraper.scrape_for_query(scraping_query, max_pages=3)
-                    scraped_data.extend(related)
-                else:
-                    scraped_data = scraper.scrape_for_query(scraping_query, max_pages=5)
-            else:
-                scraped_data = scraper.scrape_for_query(scraping_query, max_pages=5)
-            
-            # Cache results
-            scraping_cache.set(cache_key, scraped_data)
-            
-            formatted = scraper.format_for_context(scraped_data, scraping_query)
-            
-        except Exception as e:
-            logger.error(f"Failed to scrape {base_url}: {e}")
-            formatted = f"Unable to retrieve content from {base_url}. Error: {str(e)}"
+    scraper = DynamicWebScraper(base_url)
+    primary_url = url if url != base_url else None
+    if related_budget is None:
+        related_budget = RELATED_PAGES_BUDGET
+    
+    # Pages are formatted as they arrive: the requested page first (if it was given), then
+    # related pages until the budget runs out; the rest of the scrape finishes in the
+    # background and is cached for the next question
+    try:
+        stream = scraping_cache.stream(
+            f"{url}:{scraping_query}",
+            lambda: scraper.start_scrape(scraping_query, max_pages=3 if primary_url else 5, primary_url=primary_url)
+        )
+        formatter = ContextFormatter(scraping_query)
+        for page in stream.iter_pages(related_budget):
+            formatter.add(page)
+        formatted = formatter.render()
+        if not stream.done:
+            logger.info(f"Using {formatter.page_count} pages from {base_url}, the rest arrive after the budget")
+    except Exception as e:
+        logger.error(f"Failed to scrape {base_url}: {e}")
+        formatted = f"Unable to retrieve content from {base_url}. Error: {str(e)}"
     
     # Add intent-specific guidance
     guidance = f"\n\nUser Query Analysis:\n"
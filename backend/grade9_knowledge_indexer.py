@@ -171,6 +171,13 @@ class Grade9KnowledgeIndexer:
         
         return subjects_with_resources
     
+    def get_all_topics(self) -> List[Dict]:
+        """Get every indexed resource title with its subject"""
+        return sorted(
+            ({"title": info["title"], "subject": info["subject"]} for info in self.indexed_content.values()),
+            key=lambda topic: (topic["subject"], topic["title"])
+        )
+    
     def format_for_context(self, resources: List[Dict]) -> str:
         """Format resources for LLM context"""
         if not resources:
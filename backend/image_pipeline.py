@@ -0,0 +1,188 @@
+"""
+Image preprocessing pipeline for vision requests
+Compresses uploads in a process pool with size-aware fast paths and a content-hash cache
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from threading import Lock
+from typing import List, Optional
+
+from PIL import Image
+
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 1024 * 1024
+MAX_IMAGE_DIMENSION = 1920
+PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+BASE64_PATTERN = re.compile(r'[A-Za-z0-9+/\s]+={0,2}\s*')
+# Shorter strings are ids or names; even a 1x1 PNG encodes to more than this
+MIN_BASE64_LENGTH = 64
+
+
+def split_data_url(image_data: str) -> tuple:
+    """Split a data URL into (prefix, base64 payload); prefix is '' for bare base64"""
+    if image_data.startswith('data:') and ',' in image_data:
+        prefix, payload = image_data.split(',', 1)
+        return prefix, payload
+    return '', image_data
+
+
+def compress_image_data(image_data: str, max_size: int = MAX_IMAGE_BYTES,
+                        max_dimension: int = MAX_IMAGE_DIMENSION) -> str:
+    """Compress a base64 image, returning it untouched when it is already small enough"""
+    try:
+        prefix, payload = split_data_url(image_data)
+        image_bytes = base64.b64decode(payload)
+
+        # Opening only reads the header; pixels are decoded on first access
+        image = Image.open(BytesIO(image_bytes))
+        fits = image.width <= max_dimension and image.height <= max_dimension
+
+        # Fast path: small, already web-friendly images are sent as-is
+        if len(image_bytes) <= max_size and fits and image.format in PASSTHROUGH_FORMATS:
+            if prefix:
+                return image_data
+            return f"data:image/{image.format.lower()};base64,{payload}"
+
+        # Let the JPEG decoder downscale by a power of two while decoding
+        if image.format == 'JPEG' and not fits:
+            image.draft('RGB', (max_dimension, max_dimension))
+
+        # Flatten transparency onto white; JPEG has no alpha channel
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[3])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        if image.width > max_dimension or image.height > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=85, optimize=True)
+        compressed_data = base64.b64encode(output.getvalue()).decode()
+
+        return f"data:image/jpeg;base64,{compressed_data}"
+
+    except Exception as e:
+        logger.error(f"Image compression error: {e}")
+        return image_data  # Return original if compression fails
+
+
+class ImagePreprocessor:
+    """Runs image compression off the request thread and caches results by content hash"""
+
+    def __init__(self, max_workers: Optional[int] = None, cache_size: int = 64):
+        self.max_workers = max_workers or int(os.getenv("IMAGE_WORKERS", "2"))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Process pool, started on first use"""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    @staticmethod
+    def content_hash(image_data: str) -> str:
+        """Hash of the base64 payload, independent of the data URL prefix"""
+        return hashlib.sha256(split_data_url(image_data)[1].encode()).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+        record_cache("image_preprocess", result is not None)
+        return result
+
+    def _cache_put(self, key: str, result: str):
+        with self.lock:
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            # Already-processed output maps to itself so a second pass is a lookup
+            result_key = self.content_hash(result)
+            if result_key != key:
+                self.cache[result_key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    @staticmethod
+    def _needs_processing(image: str) -> bool:
+        """Only inline image data is compressed; URLs, file:// paths and image ids are read by the vision API"""
+        if image.startswith('data:'):
+            return True
+        return len(image) >= MIN_BASE64_LENGTH and BASE64_PATTERN.fullmatch(image) is not None
+
+    def preprocess(self, images: List[str]) -> List[str]:
+        """Compress images, blocking the caller but not its CPU"""
+        results = list(images)
+        pending = {}
+        for i, image in enumerate(images):
+            if not self._needs_processing(image):
+                continue
+            key = self.content_hash(image)
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending[i] = (key, self.executor.submit(compress_image_data, image))
+
+        for i, (key, future) in pending.items():
+            try:
+                results[i] = future.result()
+                self._cache_put(key, results[i])
+            except Exception as e:
+                logger.error(f"Image preprocessing failed: {e}")
+
+        return results
+
+    async def preprocess_async(self, images: List[str]) -> List[str]:
+        """Compress images without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        results = list(images)
+        pending = {}
+        for i, image in enumerate(images):
+            if not self._needs_processing(image):
+                continue
+            key = self.content_hash(image)
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending[i] = (key, loop.run_in_executor(self.executor, compress_image_data, image))
+
+        for i, (key, future) in pending.items():
+            try:
+                results[i] = await future
+                self._cache_put(key, results[i])
+            except Exception as e:
+                logger.error(f"Image preprocessing failed: {e}")
+
+        return results
+
+    def shutdown(self):
+        """Stop worker processes"""
+        with self.lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+# Global preprocessor instance
+image_preprocessor = ImagePreprocessor()
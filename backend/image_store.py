@@ -0,0 +1,85 @@
+"""
+Per-user image storage for vision requests
+Stores uploaded image bytes once under the user's uploads directory and addresses them by content hash
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import List, Optional
+
+from auth_middleware import USER_ID_PATTERN, get_user_uploads_path
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+IMAGE_REFERENCE_PATTERN = re.compile(r'!\[[^\]]*\]\(/api/images/([0-9a-f]{32})\)')
+
+
+class ImageStore:
+    """Content-addressed image files under data/uploads/<user_id>"""
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+
+    def save(self, user_id: str, data: bytes, content_type: str) -> str:
+        """Store image bytes and return their id; identical uploads share one file"""
+        extension = ALLOWED_CONTENT_TYPES.get(content_type)
+        if not extension:
+            raise ValueError(f"Unsupported image type: {content_type}")
+        if not data:
+            raise ValueError("Empty image upload")
+        if len(data) > self.max_bytes:
+            raise ValueError(f"Image exceeds {self.max_bytes // (1024 * 1024)} MB limit")
+
+        image_id = hashlib.sha256(data).hexdigest()[:32]
+        path = os.path.join(get_user_uploads_path(user_id), f"{image_id}.{extension}")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            logger.info(f"Stored image {image_id} ({len(data)} bytes) for {user_id}")
+        return image_id
+
+    def get_path(self, user_id: str, image_id: str) -> Optional[str]:
+        """Absolute path of a stored image, or None if the id is unknown"""
+        if not IMAGE_ID_PATTERN.match(image_id or '') or not USER_ID_PATTERN.match(user_id or ''):
+            return None
+        user_dir = get_user_uploads_path(user_id)
+        for extension in ALLOWED_CONTENT_TYPES.values():
+            path = os.path.join(user_dir, f"{image_id}.{extension}")
+            if os.path.exists(path):
+                return os.path.abspath(path)
+        return None
+
+    def resolve(self, user_id: str, image_ids: List[str]) -> List[str]:
+        """Turn image ids into file:// references the vision API reads directly"""
+        references = []
+        for image_id in image_ids:
+            path = self.get_path(user_id, image_id)
+            if path is None:
+                raise ValueError(f"Unknown image id: {image_id}")
+            references.append(f"file://{path}")
+        return references
+
+    @staticmethod
+    def format_reference(image_id: str) -> str:
+        """Markdown reference stored in chat history instead of the image bytes"""
+        return f"![image](/api/images/{image_id})"
+
+    @staticmethod
+    def extract_ids(content: str) -> List[str]:
+        """Image ids referenced in a stored chat message"""
+        return IMAGE_REFERENCE_PATTERN.findall(content or '')
+
+
+# Global image store instance
+image_store = ImageStore()
@@ -0,0 +1,180 @@
+"""
+Intent router for chat queries
+Matches every routing keyword set in one pass over the lowercased query with an Aho-Corasick automaton
+"""
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Keyword sets previously scanned one by one at each call site.
+# Matching is by substring, as before: 'now' also matches inside 'know'.
+INTENT_KEYWORDS = {
+    # EnhancedChatProcessor.process_chat
+    'educational': ['teach me', 'explain', 'tutor', 'study', 'learn'],
+    'math': ['solve', 'calculate', 'equation', 'math', 'formula'],
+    # Explicit requests for a question-led tutoring session; only these start one
+    'tutor_session': ['socratic', 'quiz me', 'ask me questions', 'question me', 'test my understanding',
+                      'test me on', 'tutoring session', 'tutor me'],
+    'url': ['http://', 'https://', 'www.'],
+    # ChatProcessor._process_everest
+    'grade9': ['grade 9', 'grade nine', 'g9', 'study', 'lesson', 'chapter', 'topic', 'subject', 'math', 'science'],
+    'school_info': ['admission', 'apply', 'tuition', 'fee', 'contact', 'schedule', 'process'],
+    # WebSearcher.should_search_web
+    'time_sensitive': [
+        'today', 'current', 'latest', 'now', 'weather', 'news',
+        'price', 'stock', 'score', 'result', 'update', 'recent',
+        'happening', 'temperature', 'forecast', 'trending',
+        'live', 'real-time', 'at the moment', 'right now'
+    ],
+    # WebSearchHelper.needs_web_search
+    'current_events': [
+        'today', 'current', 'latest', 'now', 'recent',
+        'news', 'update', 'price', 'weather', 'score',
+        'president', 'election', 'stock', 'covid',
+        'ukraine', 'ai news', 'openai', 'anthropic',
+        'this year', 'this month', 'this week',
+        '2024', '2025', 'happening'
+    ],
+    'date_question': ['when', 'what time', 'what date'],
+    # CurrentInfoHelper.needs_current_info
+    'current_info': [
+        'today', 'current', 'now', 'present', 'latest',
+        'date', 'time', 'president', 'year', 'month',
+        'news', 'recent', 'update', 'happening',
+        'what day', 'what time', 'what year'
+    ],
+    # general_web_assistant.analyze_query_intent
+    'instructions': ['how to', 'steps', 'process', 'guide', 'tutorial',
+                     'procedure', 'instructions', 'apply', 'fill', 'submit'],
+    'urls': ['url', 'link', 'page', 'where', 'find', 'locate', 'navigate', 'access'],
+    'form_help': ['form', 'application', 'registration', 'submit', 'fill out', 'apply'],
+    'navigation': ['navigate', 'find', 'where is', 'location of', 'how to get to'],
+}
+
+
+@dataclass(frozen=True)
+class RoutingDecision:
+    """Result of classifying one query"""
+    text: str
+    scores: Dict[str, int]  # intent -> number of keyword occurrences
+    matches: Dict[str, List[str]]  # intent -> distinct keywords found
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> milliseconds
+
+    def has(self, intent: str) -> bool:
+        """Whether any keyword of the intent occurs in the query"""
+        return self.scores.get(intent, 0) > 0
+
+    def best(self, intents: Optional[Iterable[str]] = None) -> Optional[str]:
+        """Highest-scoring intent, optionally among a subset"""
+        candidates = [(self.scores[i], i) for i in (intents or self.scores) if self.scores.get(i)]
+        return max(candidates)[1] if candidates else None
+
+
+class IntentRouter:
+    """Aho-Corasick automaton over all intent keyword sets"""
+
+    def __init__(self, intents: Dict[str, Iterable[str]] = None, cache_size: int = 512):
+        self.intents = {name: list(keywords) for name, keywords in (intents or INTENT_KEYWORDS).items()}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._build()
+
+    def _build(self):
+        """Compile the automaton into a DFA transition table"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # state -> [(intent, keyword)]
+
+        for intent, keywords in self.intents.items():
+            for keyword in keywords:
+                state = 0
+                for char in keyword.lower():
+                    if char not in self.goto[state]:
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.output.append([])
+                        self.goto[state][char] = len(self.goto) - 1
+                    state = self.goto[state][char]
+                self.output[state].append((intent, keyword))
+
+        # Breadth-first, so every failure state is complete before its dependants
+        self.delta = [dict(self.goto[0])] + [None] * (len(self.goto) - 1)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # Fold failure links into the transitions: one dict lookup per character when matching
+            self.delta[state] = {**self.delta[self.fail[state]], **self.goto[state]}
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+        self.cache.clear()
+
+    def add_intent(self, intent: str, keywords: Iterable[str]):
+        """Add or replace an intent and recompile"""
+        self.intents[intent] = list(keywords)
+        self._build()
+
+    def classify(self, text: str) -> RoutingDecision:
+        """Score every intent in a single pass over the query"""
+        text = text or ""
+        cached = self.cache.get(text)
+        if cached is not None:
+            self.cache.move_to_end(text)
+            return cached
+
+        start = time.perf_counter()
+        lowered = text.lower()
+        normalized = time.perf_counter()
+
+        delta, output = self.delta, self.output
+        hits = []
+        state = 0
+        for char in lowered:
+            state = delta[state].get(char, 0)
+            if output[state]:
+                hits.extend(output[state])
+        matched = time.perf_counter()
+
+        scores = dict.fromkeys(self.intents, 0)
+        matches = {}
+        for intent, keyword in hits:
+            scores[intent] += 1
+            found = matches.setdefault(intent, [])
+            if keyword not in found:
+                found.append(keyword)
+        scored = time.perf_counter()
+
+        decision = RoutingDecision(
+            text=text,
+            scores=scores,
+            matches=matches,
+            timings={
+                'normalize_ms': (normalized - start) * 1000,
+                'match_ms': (matched - normalized) * 1000,
+                'score_ms': (scored - matched) * 1000,
+                'total_ms': (scored - start) * 1000
+            }
+        )
+
+        # Several call sites classify the same message during one request
+        self.cache[text] = decision
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return decision
+
+
+# Global router instance
+intent_router = IntentRouter()
+
+
+def classify(text: str) -> RoutingDecision:
+    """Classify a query with the global router"""
+    return intent_router.classify(text)
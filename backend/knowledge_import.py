@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Bulk knowledge import from JSONL or CSV
+Entries are streamed from the file and upserted on (category, title) in chunked transactions.
+CSV files need category, title and content columns; tags may be a JSON list or comma-separated.
+
+Usage: python knowledge_import.py entries.jsonl [--format csv] [--chunk-size 1000]
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+from typing import Dict, IO, Iterator
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["jsonl", "csv"]
+
+
+class ImportFormatError(ValueError):
+    """The input could not be parsed in the requested format"""
+
+
+def read_jsonl(stream: IO[str]) -> Iterator[Dict]:
+    """One JSON object per line; blank lines are skipped"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"Line {number} is not valid JSON: {e}")
+        if not isinstance(entry, dict):
+            raise ImportFormatError(f"Line {number} is not a JSON object")
+        yield entry
+
+
+def read_csv(stream: IO[str]) -> Iterator[Dict]:
+    """Rows of a CSV file with a header line"""
+    reader = csv.DictReader(stream)
+    missing = {"category", "title", "content"} - set(reader.fieldnames or [])
+    if missing:
+        raise ImportFormatError(f"CSV header is missing: {', '.join(sorted(missing))}")
+    yield from reader
+
+
+def detect_format(name: str = "", content_type: str = "") -> str:
+    """Format from a file name or content type; JSONL unless it looks like CSV"""
+    if (name or "").lower().endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    return "jsonl"
+
+
+def read_entries(stream: IO, fmt: str) -> Iterator[Dict]:
+    """Entries of a text or binary stream in the given format"""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unknown import format: {fmt}")
+    if not isinstance(stream, io.TextIOBase):
+        # newline='' as the csv module expects; also fine for JSONL
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    return read_csv(stream) if fmt == "csv" else read_jsonl(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import knowledge entries from JSONL or CSV")
+    parser.add_argument("path", help="Input file, or - for standard input")
+    parser.add_argument("--format", choices=FORMATS, help="Input format (default: from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Entries per transaction")
+    parser.add_argument("--db", default="chatbot.db", help="SQLite database (ignored when DATABASE_URL is set)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from database import DatabaseManager
+    from knowledge_service import KnowledgeService
+
+    knowledge_service = KnowledgeService(DatabaseManager(args.db))
+    fmt = args.format or detect_format(args.path)
+    started = time.perf_counter()
+    try:
+        if args.path == "-":
+            stats = knowledge_service.import_knowledge(read_entries(sys.stdin, fmt), args.chunk_size)
+        else:
+            with open(args.path, "rb") as f:
+                stats = knowledge_service.import_knowledge(read_entries(f, fmt), args.chunk_size)
+    except ImportFormatError as e:
+        logger.error(f"Import stopped: {e}")
+        sys.exit(1)
+
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {stats['inserted']}, updated {stats['updated']}, failed {stats['failed']} "
+          f"in {elapsed:.2f}s")
+    for error in stats["errors"]:
+        print(f"  {error}")
+    if stats["failed"]:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
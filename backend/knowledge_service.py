@@ -1,13 +1,21 @@
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional
 import logging
+import os
 from database import DatabaseManager
 from website_cache import get_website_content
+from metrics import timed
+from retrieval import HybridRetriever
 
 logger = logging.getLogger(__name__)
 
 class KnowledgeService:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, embeddings_handler=None):
         self.db = db_manager
+        # BM25 always; embeddings too when a handler is given
+        self.retriever = HybridRetriever(
+            db_manager.knowledge_snapshot, embeddings_handler,
+            budget_ms=float(os.getenv("RETRIEVAL_BUDGET_MS", "150"))
+        ) if db_manager is not None else None
     
     def add_knowledge_entry(self, category: str, title: str, content: str, tags: Optional[List[str]] = None) -> int:
         """Add a new knowledge entry"""
@@ -15,11 +23,11 @@ class KnowledgeService:
     
     def get_knowledge_by_id(self, knowledge_id: int) -> Optional[Dict]:
         """Get knowledge entry by ID"""
-        return self.db.get_knowledge_by_id(knowledge_id)
+        return self.db.knowledge_snapshot.get(knowledge_id)
     
     def search_knowledge(self, query: str = None, category: str = None, tags: List[str] = None) -> List[Dict]:
         """Search knowledge base"""
-        return self.db.search_knowledge(query, category, tags)
+        return self.db.knowledge_snapshot.search(query, category, tags)
     
     def update_knowledge_entry(self, knowledge_id: int, category: str = None, title: str = None, 
                              content: str = None, tags: List[str] = None) -> bool:
@@ -32,26 +40,26 @@ class KnowledgeService:
     
     def get_all_categories(self) -> List[str]:
         """Get all unique categories"""
-        return self.db.get_all_categories()
+        return self.db.knowledge_snapshot.categories()
     
     def get_relevant_knowledge_for_query(self, query: str, limit: int = 3, session_id: str = None) -> List[Dict]:
         """Get relevant knowledge entries for a given query, including website content"""
-        # Get knowledge from database (reduced limit)
-        db_knowledge = self.db.get_relevant_knowledge(query, limit)
-        
         # Get website content if session_id provided
-        website_knowledge = []
+        website_content = []
         if session_id:
             try:
-                website_content = get_website_content(session_id)
-                # Simple text matching for website content
-                website_knowledge = self._search_website_content(query, website_content, limit)
+                with timed("website_cache"):
+                    website_content = get_website_content(session_id)
             except Exception as e:
                 logger.error(f"Error getting website content: {e}")
         
-        # Combine and return (prioritize database content, then website)
-        combined = db_knowledge + website_knowledge
-        return combined[:limit + 2]  # Return limited results for speed
+        # One ranking over both sources, so only the best limit entries reach the prompt
+        try:
+            return self.retriever.search(query, limit, website_content)
+        except Exception as e:
+            logger.error(f"Hybrid retrieval failed, falling back to keyword matching: {e}")
+            db_knowledge = self.db.get_relevant_knowledge(query, limit)
+            return (db_knowledge + self._search_website_content(query, website_content, limit))[:limit]
     
     def _search_website_content(self, query: str, website_content: List[Dict], limit: int) -> List[Dict]:
         """Search website content for relevant information"""
@@ -103,24 +111,23 @@ class KnowledgeService:
         
         return "\n".join(context_parts)
     
-    def bulk_add_knowledge(self, knowledge_entries: List[Dict]) -> List[int]:
-        """Add multiple knowledge entries at once"""
-        added_ids = []
-        
-        for entry in knowledge_entries:
-            try:
-                knowledge_id = self.add_knowledge_entry(
-                    category=entry['category'],
-                    title=entry['title'],
-                    content=entry['content'],
-                    tags=entry.get('tags', [])
-                )
-                added_ids.append(knowledge_id)
-                logger.info(f"Added knowledge entry: {entry['title']}")
-            except Exception as e:
-                logger.error(f"Failed to add knowledge entry '{entry['title']}': {e}")
-        
-        return added_ids
+    def bulk_add_knowledge(self, knowledge_entries: List[Dict]) -> List[Optional[int]]:
+        """Add multiple knowledge entries at once, updating entries with the same category and title
+        
+        Returns one id per entry in order, None for entries that were rejected.
+        """
+        stats = self.db.bulk_upsert_knowledge(knowledge_entries, return_ids=True)
+        for error in stats['errors']:
+            logger.error(f"Failed to add knowledge entry: {error}")
+        logger.info(f"Added {stats['inserted']} and updated {stats['updated']} knowledge entries")
+        return stats['ids']
+    
+    def import_knowledge(self, entries: Iterable[Dict], chunk_size: int = 1000) -> Dict:
+        """Stream a large import; indexes are rebuilt once at the end"""
+        stats = self.db.bulk_upsert_knowledge(entries, chunk_size=chunk_size, defer_indexes=True)
+        logger.info(f"Knowledge import: {stats['inserted']} inserted, {stats['updated']} updated, "
+                    f"{stats['failed']} failed")
+        return stats
 
 
 class ConversationService:
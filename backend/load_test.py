@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Load-test harness for the chat backend
+Sends an open-loop mix of /api/chat, /api/sessions and /api/knowledge requests at a target rate
+and reports p50/p95/p99 latency and error rates per endpoint and model.
+Run the backend against mock_llm_server.py (LLM_API_BASE) so no API quota is used.
+"""
+
+import argparse
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHAT_QUERIES = [
+    "explain the quadratic formula",
+    "what are the admission requirements",
+    "help me study for my biology exam",
+    "tuition fee for grade 9",
+    "how do I write a thesis statement",
+    "what is photosynthesis"
+]
+KNOWLEDGE_QUERIES = ["admission", "tuition", "grade 9 math", "schedule", "contact"]
+MODELS = ["general", "everest", "web_scraper"]
+
+_local = threading.local()
+
+
+def http_session() -> requests.Session:
+    """One connection pool per worker thread"""
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+class LoadTest:
+    """Schedules requests at a fixed rate and collects their outcomes"""
+
+    def __init__(self, base_url: str, rps: float, duration: float, mix: dict, models: list,
+                 sessions: int = 50, concurrency: int = 64, timeout: float = 60.0, seed: int = 42):
+        self.base_url = base_url.rstrip("/")
+        self.rps = rps
+        self.duration = duration
+        self.mix = mix
+        self.models = models
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def _next_request(self, index: int):
+        """Endpoint label, model, and the call to make for the index-th request"""
+        endpoint = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if endpoint == "chat":
+            model = self.models[index % len(self.models)]
+            payload = {
+                "messages": [{"role": "user", "content": self.random.choice(CHAT_QUERIES)}],
+                "session_id": f"load-{index % self.sessions}",
+                "model": model
+            }
+            return endpoint, model, ("POST", "/api/chat", {"json": payload})
+        if endpoint == "sessions":
+            return endpoint, "-", ("GET", "/api/sessions", {})
+        query = self.random.choice(KNOWLEDGE_QUERIES)
+        return endpoint, "-", ("GET", "/api/knowledge", {"params": {"query": query}})
+
+    def _send(self, endpoint: str, model: str, call, scheduled: float):
+        """Make one request; latency is measured from its scheduled time, so client backlog counts"""
+        method, path, kwargs = call
+        status = "error"
+        ok = False
+        try:
+            response = http_session().request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            status = response.status_code
+            ok = response.ok
+            if ok and endpoint == "chat":
+                # The chat endpoint reports failures in the body with HTTP 200
+                ok = response.json().get("success", False)
+        except requests.RequestException:
+            pass
+        finished = time.perf_counter()
+        with self.lock:
+            self.samples.append({
+                "endpoint": endpoint,
+                "model": model,
+                "latency": finished - scheduled,
+                "ok": ok,
+                "status": status
+            })
+
+    def run(self) -> dict:
+        """Drive the target for the configured duration and return the report"""
+        total = int(self.rps * self.duration)
+        interval = 1 / self.rps
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for index in range(total):
+                scheduled = start + index * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                endpoint, model, call = self._next_request(index)
+                executor.submit(self._send, endpoint, model, call, scheduled)
+        elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        """Latency percentiles and error rates per endpoint and model"""
+        groups = defaultdict(list)
+        for sample in self.samples:
+            groups[(sample["endpoint"], sample["model"])].append(sample)
+
+        rows = []
+        for (endpoint, model), samples in sorted(groups.items()):
+            latencies = sorted(s["latency"] for s in samples)
+            errors = [s for s in samples if not s["ok"]]
+            statuses = defaultdict(int)
+            for s in errors:
+                statuses[str(s["status"])] += 1
+            rows.append({
+                "endpoint": endpoint,
+                "model": model,
+                "requests": len(samples),
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+                "error_rate": round(len(errors) / len(samples), 4),
+                "errors_by_status": dict(statuses)
+            })
+        return {
+            "target_rps": self.rps,
+            "achieved_rps": round(len(self.samples) / elapsed, 2),
+            "duration_s": round(elapsed, 2),
+            "results": rows
+        }
+
+
+def percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def parse_mix(values: list) -> dict:
+    """endpoint=weight pairs"""
+    mix = {}
+    for value in values:
+        endpoint, _, weight = value.partition("=")
+        if endpoint not in ("chat", "sessions", "knowledge"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {endpoint}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat backend at a target request rate")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Backend base URL")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load")
+    parser.add_argument("--mix", nargs="+", default=["chat=70", "sessions=20", "knowledge=10"],
+                        help="Endpoint weights, e.g. chat=70 sessions=20 knowledge=10")
+    parser.add_argument("--models", nargs="+", default=MODELS, help="Chat models to rotate through")
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct chat session ids")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    load_test = LoadTest(
+        args.url, args.rps, args.duration, parse_mix(args.mix), args.models,
+        sessions=args.sessions, concurrency=args.concurrency, timeout=args.timeout, seed=args.seed
+    )
+    print(f"Sending {args.rps} req/s to {args.url} for {args.duration}s...")
+    report = load_test.run()
+
+    print(f"\nAchieved {report['achieved_rps']} req/s (target {report['target_rps']})")
+    print(f"{'endpoint':<12}{'model':<14}{'requests':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>9}")
+    for row in report["results"]:
+        print(f"{row['endpoint']:<12}{row['model']:<14}{row['requests']:>9}"
+              f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms{row['p99_ms']:>8.1f}ms"
+              f"{row['error_rate']:>8.1%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
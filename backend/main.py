@@ -1,17 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, File, Request, UploadFile
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import logging
+import os
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from langchain.schema import HumanMessage, AIMessage
 import json
 from database import DatabaseManager
 from knowledge_service import KnowledgeService, ConversationService
+from knowledge_import import detect_format, read_entries
+from retrieval import load_embeddings_handler
 from enhanced_chat import ChatProcessor
-from models_config import model_selector
+from semantic_cache import create_semantic_cache
+from shared_cache import shared_cache
+from models_config import model_label, model_selector
 from chat_manager import ChatManager
+from auth_middleware import anonymous_session_cookie, get_current_user
+from image_store import image_store
+from metrics import instrument_requests, registry, timed, track_request
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,10 +35,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(anonymous_session_cookie)
 
 class Message(BaseModel):
     role: str
     content: str
+    images: Optional[List[str]] = None  # ids returned by /api/images
 
 class ChatRequest(BaseModel):
     messages: List[Message]
@@ -54,32 +66,44 @@ class KnowledgeResponse(BaseModel):
     data: Optional[Dict] = None
     error: Optional[str] = None
 
-# Global memory store for different sessions
-memory_store: Dict[str, ConversationBufferMemory] = {}
+# Conversation memory per session lives in the shared cache, so any worker can continue a session
+MEMORY_TTL = float(os.getenv("SESSION_MEMORY_TTL_SECONDS", "86400"))
+MEMORY_MAX_MESSAGES = int(os.getenv("SESSION_MEMORY_MAX_MESSAGES", "1000"))
 
 # Initialize database and services
 db_manager = DatabaseManager()
-knowledge_service = KnowledgeService(db_manager)
+embeddings_handler = load_embeddings_handler()
+knowledge_service = KnowledgeService(db_manager, embeddings_handler=embeddings_handler)
 conversation_service = ConversationService(db_manager)
 chat_manager = ChatManager(db_manager)
 
 def get_memory(session_id: str) -> ConversationBufferMemory:
-    if session_id not in memory_store:
-        memory_store[session_id] = ConversationBufferMemory(
-            return_messages=True,
-            memory_key="chat_history"
-        )
-    return memory_store[session_id]
+    memory = ConversationBufferMemory(
+        return_messages=True,
+        memory_key="chat_history"
+    )
+    for role, content in shared_cache.get_list(f"memory:{session_id}"):
+        if role == "user":
+            memory.chat_memory.add_user_message(content)
+        else:
+            memory.chat_memory.add_ai_message(content)
+    return memory
+
+def append_memory(session_id: str, user_message: str, ai_message: str):
+    """Append one exchange as compact [role, content] pairs; other workers' appends are kept"""
+    shared_cache.append(f"memory:{session_id}", [["user", user_message], ["assistant", ai_message]],
+                        MEMORY_TTL, max_items=MEMORY_MAX_MESSAGES)
 
 def initialize_qwen_llm():
+    # Any OpenAI-compatible endpoint can be configured, e.g. mock_llm_server.py for load tests
     try:
         llm = ChatOpenAI(
-            model="qwen-max-2025-01-25",
-            openai_api_key="sk-e7497e17ae164aa9b8509eaeee5ab614",
-            openai_api_base="https://dashscope-intl.aliyuncs.com/compatible-mode/v1",
+            model=os.getenv("LLM_MODEL", "qwen-max-2025-01-25"),
+            openai_api_key=os.getenv("LLM_API_KEY", "sk-e7497e17ae164aa9b8509eaeee5ab614"),
+            openai_api_base=os.getenv("LLM_API_BASE", "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"),
             temperature=0.7,
             max_tokens=400,
-            request_timeout=30
+            request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
         )
         return llm
     except Exception as e:
@@ -87,14 +111,25 @@ def initialize_qwen_llm():
         raise
 
 qwen_llm = initialize_qwen_llm()
-chat_processor = ChatProcessor(qwen_llm, knowledge_service, conversation_service)
+chat_processor = ChatProcessor(
+    qwen_llm, knowledge_service, conversation_service,
+    semantic_cache=create_semantic_cache(embeddings_handler, db_manager.knowledge_snapshot)
+)
+instrument_requests()
 
 @app.get("/")
 async def root():
     return {"message": "Qwen v2.5-Max Multi-Model Chatbot API is running"}
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
+    with track_request(model_label(request.model)) as request_trace:
+        response = await handle_chat(request, http_request)
+        if not response.success:
+            request_trace.status = "error"
+        return response
+
+async def handle_chat(request: ChatRequest, http_request: Request) -> ChatResponse:
     try:
         logger.info(f"Received chat request with {len(request.messages)} messages using model: {request.model}")
         
@@ -106,29 +141,39 @@ async def chat(request: ChatRequest):
         if latest_message.role != "user":
             raise HTTPException(status_code=400, detail="Last message must be from user")
         
+        # Resolve uploaded image ids to stored files; only ids travel in the request
+        images = None
+        stored_content = latest_message.content
+        if latest_message.images:
+            user_id = await get_current_user(http_request)
+            images = image_store.resolve(user_id, latest_message.images)
+            stored_content = "\n".join(
+                [latest_message.content] + [image_store.format_reference(i) for i in latest_message.images]
+            ).strip()
+        
         # Get memory for this session
         memory = get_memory(request.session_id)
         
         # Process chat with selected model
-        result = chat_processor.process_chat(request, memory)
+        result = chat_processor.process_chat(request, memory, images=images)
         
-        # Create session if it doesn't exist
-        existing_session = chat_manager.get_session(request.session_id)
-        if not existing_session:
-            chat_manager.create_session(request.session_id, "New Chat", request.model)
-        
-        # Save conversation to database
-        conversation_service.save_message(request.session_id, "user", latest_message.content)
-        conversation_service.save_message(request.session_id, "assistant", result['message'])
-        
-        # Update message count and auto-generate title if first message
-        chat_manager.update_message_count(request.session_id)
-        if not existing_session:
-            chat_manager.auto_generate_title(request.session_id, latest_message.content)
+        with timed("persistence"):
+            # Create session if it doesn't exist
+            existing_session = chat_manager.get_session(request.session_id)
+            if not existing_session:
+                chat_manager.create_session(request.session_id, "New Chat", request.model)
+            
+            # Save conversation to database
+            conversation_service.save_message(request.session_id, "user", stored_content)
+            conversation_service.save_message(request.session_id, "assistant", result['message'])
+            
+            # Update message count and auto-generate title if first message
+            chat_manager.increment_message_count(request.session_id, 2)
+            if not existing_session:
+                chat_manager.auto_generate_title(request.session_id, latest_message.content)
         
         # Add messages to memory
-        memory.chat_memory.add_user_message(latest_message.content)
-        memory.chat_memory.add_ai_message(result['message'])
+        append_memory(request.session_id, stored_content, result['message'])
         
         logger.info("Response generated successfully")
         
@@ -149,10 +194,53 @@ async def chat(request: ChatRequest):
             error=str(e)
         )
 
+# Image Upload Endpoints
+@app.post("/api/images", response_model=KnowledgeResponse)
+async def upload_image(http_request: Request, file: UploadFile = File(...)):
+    """Store an uploaded image and return the id chat messages use to reference it"""
+    try:
+        user_id = await get_current_user(http_request)
+        data = await file.read()
+        image_id = image_store.save(user_id, data, file.content_type)
+        
+        return KnowledgeResponse(
+            success=True,
+            data={
+                "image_id": image_id,
+                "size": len(data),
+                "reference": image_store.format_reference(image_id)
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error uploading image: {e}")
+        return KnowledgeResponse(
+            success=False,
+            error=str(e)
+        )
+
+@app.get("/api/images/{image_id}")
+async def get_image(image_id: str, http_request: Request):
+    """Serve a previously uploaded image"""
+    user_id = await get_current_user(http_request)
+    path = image_store.get_path(user_id, image_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path)
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "model": "qwen-max-2025-01-25"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: stage latencies per model, cache hit ratios, outbound HTTP"""
+    return registry.render()
+
+@app.get("/api/models/stats")
+async def get_model_stats():
+    """Usage count, mean response time and last use per model"""
+    return {model.value: stats for model, stats in model_selector.model_stats.items()}
+
 @app.get("/api/models")
 async def get_available_models():
     """Get information about available models"""
@@ -179,6 +267,27 @@ async def add_knowledge(entry: KnowledgeEntry):
             error=str(e)
         )
 
+@app.post("/api/knowledge/bulk", response_model=KnowledgeResponse)
+async def bulk_import_knowledge(file: UploadFile = File(...), format: Optional[str] = None, chunk_size: int = 1000):
+    """Upsert entries from an uploaded JSONL or CSV file on (category, title)"""
+    try:
+        fmt = format or detect_format(file.filename, file.content_type)
+        # The upload is spooled to disk; entries are streamed from it in a worker thread
+        stats = await run_in_threadpool(
+            knowledge_service.import_knowledge, read_entries(file.file, fmt), max(1, min(chunk_size, 10000))
+        )
+        return KnowledgeResponse(
+            success=stats['failed'] == 0,
+            data=stats,
+            error=f"{stats['failed']} entries failed" if stats['failed'] else None
+        )
+    except Exception as e:
+        logger.error(f"Error importing knowledge: {e}")
+        return KnowledgeResponse(
+            success=False,
+            error=str(e)
+        )
+
 @app.get("/api/knowledge", response_model=KnowledgeResponse)
 async def search_knowledge(query: str = None, category: str = None):
     try:
@@ -295,6 +404,7 @@ async def clear_conversation_history(session_id: str):
     try:
         success = conversation_service.clear_conversation(session_id)
         if success:
+            chat_manager.update_message_count(session_id)
             return KnowledgeResponse(
                 success=True,
                 data={"message": "Conversation history cleared successfully"}
@@ -333,13 +443,25 @@ async def create_chat_session(data: dict = {}):
         )
 
 @app.get("/api/sessions", response_model=KnowledgeResponse)
-async def get_chat_sessions(include_archived: bool = False):
-    """Get all chat sessions"""
+async def get_chat_sessions(include_archived: bool = False, cursor: Optional[str] = None,
+                            limit: Optional[int] = None, folder_id: Optional[str] = None,
+                            starred: Optional[bool] = None, archived: Optional[bool] = None):
+    """Get chat sessions, one page at a time when cursor or limit is given"""
     try:
-        sessions = chat_manager.get_all_sessions(include_archived)
+        if archived is None and not include_archived:
+            archived = False
+        if cursor is None and limit is None:
+            sessions = chat_manager.get_all_sessions(folder_id=folder_id, starred=starred, archived=archived)
+            return KnowledgeResponse(
+                success=True,
+                data={"sessions": sessions, "count": len(sessions), "next_cursor": None}
+            )
+        page = chat_manager.get_sessions_page(
+            limit=limit or 50, cursor=cursor, folder_id=folder_id, starred=starred, archived=archived
+        )
         return KnowledgeResponse(
             success=True,
-            data={"sessions": sessions, "count": len(sessions)}
+            data={"sessions": page["sessions"], "count": len(page["sessions"]), "next_cursor": page["next_cursor"]}
         )
     except Exception as e:
         logger.error(f"Error getting sessions: {e}")
@@ -402,8 +524,7 @@ async def delete_chat_session(session_id: str):
         success = chat_manager.delete_session(session_id)
         if success:
             # Also clear from memory
-            if session_id in memory_store:
-                del memory_store[session_id]
+            shared_cache.delete(f"memory:{session_id}")
             return KnowledgeResponse(
                 success=True,
                 data={"message": "Session deleted successfully"}
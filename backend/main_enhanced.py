@@ -4,6 +4,7 @@ Supports vision, embeddings, educational features, and more
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
@@ -13,7 +14,9 @@ from datetime import datetime
 from database import DatabaseManager
 from knowledge_service import KnowledgeService
 from enhanced_chat_v2 import EnhancedChatProcessor
-from models_config import model_selector
+from image_pipeline import image_preprocessor
+from models_config import model_label, model_selector
+from metrics import instrument_requests, registry, timed, track_request
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -90,6 +93,8 @@ try:
         conversation_service=None  # Add if needed
     )
     
+    instrument_requests()
+    
     logger.info("All services initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize services: {e}")
@@ -104,16 +109,28 @@ async def root():
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
+    with track_request(model_label(request.model)) as request_trace:
+        try:
+            return await handle_chat(request)
+        except HTTPException:
+            request_trace.status = "error"
+            raise
+
+async def handle_chat(request: ChatRequest) -> ChatResponse:
     try:
         logger.info(f"Chat request - Model: {request.model}, Has images: {bool(request.images)}")
         
         # Save user message
-        db.save_conversation(request.session_id, "user", request.message)
+        with timed("persistence"):
+            db.save_conversation(request.session_id, "user", request.message)
+        
+        # Compress images off the event loop before the synchronous chat path
+        images = await image_preprocessor.preprocess_async(request.images) if request.images else request.images
         
         # Process with enhanced chat processor
         result = chat_processor.process_chat({
             "message": request.message,
-            "images": request.images,
+            "images": images,
             "session_id": request.session_id,
             "model": request.model,
             "educational_mode": request.educational_mode,
@@ -121,7 +138,8 @@ async def chat(request: ChatRequest):
         })
         
         # Save assistant response
-        db.save_conversation(request.session_id, "assistant", result["response"])
+        with timed("persistence"):
+            db.save_conversation(request.session_id, "assistant", result["response"])
         
         # Create/update session
         if request.session_id not in sessions:
@@ -253,8 +271,10 @@ async def get_folders():
     }
 
 @app.post("/api/educational/socratic")
-async def socratic_dialogue(topic: str, response: str, depth: int = 1):
-    """Engage in Socratic dialogue"""
+async def socratic_dialogue(topic: str, response: str, depth: int = 1, session_id: Optional[str] = None):
+    """Engage in Socratic dialogue; with a session_id the depth and summary are tracked across turns"""
+    if session_id:
+        return chat_processor.educational_handler.continue_socratic_dialogue(session_id, response, topic=topic)
     result = chat_processor.educational_handler.create_socratic_dialogue(topic, response, depth)
     return result
 
@@ -276,6 +296,11 @@ async def semantic_search(query: str, documents: List[Dict], top_k: int = 5):
     results = chat_processor.embeddings_handler.semantic_search(query, documents, top_k)
     return {"results": results}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: stage latencies per model, cache hit ratios, outbound HTTP"""
+    return registry.render()
+
 @app.get("/api/health")
 async def health_check():
     return {
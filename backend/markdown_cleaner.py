@@ -1,56 +1,171 @@
 import re
 
-def clean_markdown_response(text: str) -> str:
-    """Clean AI response to ensure proper markdown formatting without HTML artifacts"""
-    
+# Patterns are compiled once at import; related passes are fused into single alternations.
+# Leaked HTML attributes: target="_blank", rel="noopener", class="...", style="...", id="..."
+HTML_ATTRIBUTE_PATTERN = re.compile(r'\s+(?:target="_blank"|(?:rel|class|style|id)="[^"]*")')
+HTML_TAG_PATTERN = re.compile(r'</?[a-zA-Z][^>]*>')
+# [text](url extra_attrs) -> [text](url)
+LINK_ATTRIBUTE_PATTERN = re.compile(r'\[([^\]]+)\]\(([^)\s]+)[^)]*\)')
+LINK_SPACING_PATTERN = re.compile(r'([.!?])\[')
+TRAILING_SPACES_PATTERN = re.compile(r' +$', re.MULTILINE)
+MULTIPLE_SPACES_PATTERN = re.compile(r'  +')
+BULLET_PATTERN = re.compile(r'^[-*]\s*', re.MULTILINE)
+NUMBERED_PATTERN = re.compile(r'^(\d+)\.\s*', re.MULTILINE)
+
+MARKDOWN_LINK_PATTERN = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+PLAIN_URL_PATTERN = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+')
+URL_TRAILING_PUNCTUATION = '.,;:!?)'
+
+# Constructs that may span a line break in a stream
+OPEN_TAG_PATTERN = re.compile(r'<[a-zA-Z]')
+ATTRIBUTE_START_PATTERN = re.compile(r'(?:target|rel|class|style|id)="')
+# An attribute whose quoted value is still open at the end of the text
+OPEN_ATTRIBUTE_PATTERN = re.compile(r'\s(?:rel|class|style|id)="[^"]*$')
+
+
+def _clean(text: str) -> str:
+    """All cleaning passes except the final strip"""
     # Remove any HTML attributes that might have leaked through
-    # Remove target="_blank", rel="noopener", class="..." etc
-    text = re.sub(r'\s+target="_blank"', '', text)
-    text = re.sub(r'\s+rel="[^"]*"', '', text)
-    text = re.sub(r'\s+class="[^"]*"', '', text)
-    text = re.sub(r'\s+style="[^"]*"', '', text)
-    text = re.sub(r'\s+id="[^"]*"', '', text)
-    
+    text = HTML_ATTRIBUTE_PATTERN.sub('', text)
+
     # Clean up any broken HTML tags
-    text = re.sub(r'</?[a-zA-Z][^>]*>', '', text)
-    
+    text = HTML_TAG_PATTERN.sub('', text)
+
     # Fix broken markdown links that might have HTML mixed in
-    # Convert [text](url extra_attrs) to just [text](url)
-    text = re.sub(r'\[([^\]]+)\]\(([^)\s]+)[^)]*\)', r'[\1](\2)', text)
-    
+    text = LINK_ATTRIBUTE_PATTERN.sub(r'[\1](\2)', text)
+
     # Ensure proper spacing around links
-    text = re.sub(r'([.!?])\[', r'\1 [', text)
-    
-    # Remove multiple consecutive spaces
-    text = re.sub(r' +', ' ', text)
-    
-    # Remove trailing spaces at end of lines
-    text = re.sub(r' +$', '', text, flags=re.MULTILINE)
-    
+    text = LINK_SPACING_PATTERN.sub(r'\1 [', text)
+
+    # Remove trailing spaces at end of lines, then collapse runs of spaces
+    text = TRAILING_SPACES_PATTERN.sub('', text)
+    text = MULTIPLE_SPACES_PATTERN.sub(' ', text)
+
     # Ensure bullet points are properly formatted
-    text = re.sub(r'^[-*]\s*', '- ', text, flags=re.MULTILINE)
-    
+    text = BULLET_PATTERN.sub('- ', text)
+
     # Ensure numbered lists are properly formatted
-    text = re.sub(r'^(\d+)\.\s*', r'\1. ', text, flags=re.MULTILINE)
-    
-    return text.strip()
+    return NUMBERED_PATTERN.sub(r'\1. ', text)
+
+
+def clean_markdown_response(text: str) -> str:
+    """Clean AI response to ensure proper markdown formatting without HTML artifacts"""
+    return _clean(text).strip()
+
+
+class StreamingMarkdownCleaner:
+    """Apply clean_markdown_response to a token stream
+
+    Text is released at line boundaries once no tag, link or list marker can still
+    span the cut, so feeding all chunks gives the same result as cleaning the whole
+    response. At most max_lookback characters are held back; beyond that the
+    buffer is released at the last line break regardless.
+    """
+
+    def __init__(self, max_lookback: int = 4096):
+        self.max_lookback = max_lookback
+        self.buffer = ""
+        self.pending_whitespace = ""  # only released once more text follows, as strip() would
+        self.started = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the cleaned text that is now final"""
+        self.buffer += chunk
+        # Cuts only move when a line completes
+        if '\n' not in chunk and len(self.buffer) <= self.max_lookback:
+            return ""
+        cut, cleaned = self._find_cut()
+        if cut <= 0:
+            return ""
+        self.buffer = self.buffer[cut:]
+        return self._release(cleaned)
+
+    def finish(self) -> str:
+        """Return whatever is still buffered, cleaned"""
+        text = self._release(_clean(self.buffer))
+        self.buffer = ""
+        self.pending_whitespace = ""
+        return text
+
+    def _release(self, text: str) -> str:
+        """Hold back trailing whitespace and drop leading whitespace of the response"""
+        body = text.rstrip()
+        if not body:
+            if self.started:
+                self.pending_whitespace += text
+            return ""
+        if self.started:
+            body = self.pending_whitespace + body
+        else:
+            body = body.lstrip()
+            self.started = True
+        self.pending_whitespace = text[len(text.rstrip()):]
+        return body
+
+    def _find_cut(self):
+        """Latest line start after which nothing can affect the text before it, with that text cleaned"""
+        buffer = self.buffer
+        # Only text followed by a complete, non-blank line is released
+        complete = buffer.rfind('\n')
+        cut = buffer.rfind('\n', 0, complete) + 1 if complete > 0 else 0
+        while cut > 0:
+            if buffer[cut:complete].strip() and self._can_cut(buffer[:cut], buffer[cut:]):
+                cleaned = _clean(buffer[:cut])
+                # A list marker or attribute that swallowed the line break would continue past the cut
+                if cleaned.endswith('\n'):
+                    return cut, cleaned
+            cut = buffer.rfind('\n', 0, cut - 1) + 1
+
+        if len(buffer) > self.max_lookback:
+            cut = buffer.rfind('\n') + 1 or len(buffer) - self.max_lookback // 2
+            return cut, _clean(buffer[:cut])
+        return 0, ""
+
+    @staticmethod
+    def _can_cut(prefix: str, rest: str) -> bool:
+        """Whether no tag, link, attribute or list marker spans the end of prefix"""
+        # Attribute values may contain line breaks and run on into the rest
+        without_attributes = HTML_ATTRIBUTE_PATTERN.sub('', prefix)
+        if OPEN_ATTRIBUTE_PATTERN.search(without_attributes):
+            return False
+        # Tags are matched after attributes are gone, which can join '<' to the text after them
+        if OPEN_TAG_PATTERN.search(without_attributes, without_attributes.rfind('>') + 1):
+            return False
+        # Links are matched after attributes and tags are gone, which can bring ']' and '(' together
+        stripped = HTML_TAG_PATTERN.sub('', without_attributes)
+        if stripped.rfind('[') > stripped.rfind(']'):
+            return False
+        link_open = stripped.rfind('](')
+        if link_open != -1 and stripped.find(')', link_open) == -1:
+            return False
+        return not ATTRIBUTE_START_PATTERN.match(rest.lstrip())
+
 
 def extract_clean_links(text: str) -> list:
     """Extract clean links from text, removing any HTML attributes"""
     links = []
-    
+    seen = set()
+    link_spans = []
+
     # Find markdown links
-    markdown_links = re.findall(r'\[([^\]]+)\]\(([^)]+)\)', text)
-    for link_text, url in markdown_links:
+    for match in MARKDOWN_LINK_PATTERN.finditer(text):
+        link_text, url = match.groups()
         # Clean the URL of any attributes
         clean_url = url.split()[0] if ' ' in url else url
         links.append({'text': link_text, 'url': clean_url})
-    
-    # Find plain URLs
-    plain_urls = re.findall(r'https?://[^\s<>"{}|\\^`\[\]]+', text)
-    for url in plain_urls:
-        # Make sure it's not already part of a markdown link
-        if not any(url in link['url'] for link in links):
+        seen.add(clean_url)
+        link_spans.append(match.span())
+
+    # Find plain URLs, skipping those inside a markdown link; spans are ordered so one pointer suffices
+    span_index = 0
+    for match in PLAIN_URL_PATTERN.finditer(text):
+        while span_index < len(link_spans) and link_spans[span_index][1] <= match.start():
+            span_index += 1
+        if span_index < len(link_spans) and link_spans[span_index][0] <= match.start():
+            continue
+        url = match.group().rstrip(URL_TRAILING_PUNCTUATION)
+        if url not in seen:
+            seen.add(url)
             links.append({'text': url, 'url': url})
-    
-    return links
\ No newline at end of file
+
+    return links
@@ -0,0 +1,309 @@
+"""
+Metrics and tracing for the chat path
+Prometheus-style counters and histograms, per-stage timers labelled with the request's model,
+and optional trace spans (OpenTelemetry when installed and TRACING_ENABLED is set)
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "").lower() in ("1", "true", "yes")
+# Include the per-stage trace in each chat response's metadata
+TRACE_RESPONSES = os.getenv("TRACE_RESPONSES", "").lower() in ("1", "true", "yes")
+
+# Hosts (and their subdomains) that get their own http_client label; scrape targets and search
+# results are user-driven, so every other host is counted as "other". The configured LLM
+# endpoint and METRICS_HTTP_HOSTS (comma-separated) are added to the list
+HTTP_HOSTS = tuple(host for host in (
+    "dashscope-intl.aliyuncs.com", "everestmanila.com", "duckduckgo.com", "wttr.in",
+    urlparse(os.getenv("LLM_API_BASE", "")).hostname,
+    *os.getenv("METRICS_HTTP_HOSTS", "").split(",")
+) if host)
+
+# Stage names used by the chat processors
+STAGES = (
+    "routing", "db_context", "website_cache", "dynamic_scrape", "web_search",
+    "grade9_search", "llm_call", "markdown_clean", "persistence", "semantic_cache"
+)
+
+
+def _escape_label(value) -> str:
+    """Label value with backslash, double quote and newline escaped, as the exposition format requires"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    """Render {name="value",...}"""
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        """Increase the counter for one label combination"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """Current value for one label combination"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self.values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        """Prometheus text exposition lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], Dict] = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, **labels):
+        """Record one observation"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, **labels) -> Optional[Dict]:
+        """Count, sum and mean for one label combination"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if not series:
+                return None
+            return {"count": series["count"], "sum": series["sum"], "mean": series["sum"] / series["count"]}
+
+    def render(self) -> List[str]:
+        """Prometheus text exposition lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """Get or create a counter"""
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, documentation, labelnames)
+            return self.metrics[name]
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram"""
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, documentation, labelnames, buckets)
+            return self.metrics[name]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        lines.extend(self._render_cache_ratios())
+        return "\n".join(lines) + "\n"
+
+    def _render_cache_ratios(self) -> List[str]:
+        """Hit ratio gauges derived from the cache counters"""
+        totals = {}
+        for (cache, result), value in list(CACHE_REQUESTS.values.items()):
+            hits, total = totals.get(cache, (0.0, 0.0))
+            totals[cache] = (hits + (value if result == "hit" else 0.0), total + value)
+        lines = ["# HELP cache_hit_ratio Fraction of cache lookups that were hits",
+                 "# TYPE cache_hit_ratio gauge"]
+        for cache, (hits, total) in sorted(totals.items()):
+            lines.append(f'cache_hit_ratio{{cache="{cache}"}} {hits / total if total else 0.0}')
+        return lines
+
+
+# Global metrics registry
+registry = MetricsRegistry()
+
+CHAT_REQUESTS = registry.counter("chat_requests_total", "Chat requests by model and outcome", ("model", "status"))
+CHAT_REQUEST_SECONDS = registry.histogram("chat_request_seconds", "End-to-end chat latency", ("model",))
+STAGE_SECONDS = registry.histogram("chat_stage_seconds", "Latency of each chat pipeline stage", ("stage", "model"))
+CACHE_REQUESTS = registry.counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+HTTP_CLIENT_REQUESTS = registry.counter(
+    "http_client_requests_total", "Outbound HTTP requests", ("host", "method", "status")
+)
+HTTP_CLIENT_SECONDS = registry.histogram("http_client_request_seconds", "Outbound HTTP latency", ("host",))
+SEMANTIC_CACHE_SAVED_SECONDS = registry.counter(
+    "semantic_cache_saved_llm_seconds_total", "LLM time of the original answers served by semantic cache hits", ("model",)
+)
+
+# Model label and collected spans of the request being processed
+_current_model: ContextVar[str] = ContextVar("current_model", default="none")
+_current_trace: ContextVar[Optional[List[Dict]]] = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Stage spans of one request; set status to 'error' for handled failures"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.spans: List[Dict] = []
+        self.status = "success"
+
+
+@contextmanager
+def track_request(model: str):
+    """Time one chat request and label the stages inside it with its model"""
+    request_trace = RequestTrace(model)
+    model_token = _current_model.set(model)
+    trace_token = _current_trace.set(request_trace.spans)
+    start = time.perf_counter()
+    try:
+        yield request_trace
+    except Exception:
+        request_trace.status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        # Stages may have relabelled the request once the model was resolved
+        model = _current_model.get()
+        CHAT_REQUESTS.inc(model=model, status=request_trace.status)
+        CHAT_REQUEST_SECONDS.observe(elapsed, model=model)
+        _current_model.reset(model_token)
+        _current_trace.reset(trace_token)
+
+
+def set_request_model(model: str):
+    """Relabel the current request once its model is known"""
+    _current_model.set(model)
+
+
+def current_spans() -> List[Dict]:
+    """Spans recorded so far for the current request"""
+    return _current_trace.get() or []
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a pipeline stage into chat_stage_seconds and the request trace"""
+    model = _current_model.get()
+    spans = _current_trace.get()
+    span_cm = None
+    if TRACING_ENABLED and otel_trace is not None:
+        span_cm = otel_trace.get_tracer(__name__).start_as_current_span(f"chat.{stage}")
+        span = span_cm.__enter__()
+        span.set_attribute("chat.model", model)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, model=model)
+        if spans is not None:
+            spans.append({"stage": stage, "duration_ms": round(elapsed * 1000, 3)})
+        if span_cm is not None:
+            span_cm.__exit__(None, None, None)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def host_label(url: str) -> str:
+    """The HTTP_HOSTS entry the URL's host falls under, else other"""
+    host = (urlparse(url).hostname or "").lower()
+    for known in HTTP_HOSTS:
+        if host == known or host.endswith("." + known):
+            return known
+    return "other"
+
+
+def record_http(url: str, method: str, status, seconds: float):
+    """Count an outbound HTTP request"""
+    host = host_label(url)
+    HTTP_CLIENT_REQUESTS.inc(host=host, method=method, status=status)
+    HTTP_CLIENT_SECONDS.observe(seconds, host=host)
+
+
+_requests_instrumented = False
+
+
+def instrument_requests():
+    """Count every request sent through the requests library (module functions and Sessions)"""
+    global _requests_instrumented
+    if _requests_instrumented:
+        return
+    import requests
+
+    original_send = requests.Session.send
+
+    def send(session, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = original_send(session, request, **kwargs)
+        except Exception:
+            record_http(request.url, request.method, "error", time.perf_counter() - start)
+            raise
+        record_http(request.url, request.method, response.status_code, time.perf_counter() - start)
+        return response
+
+    requests.Session.send = send
+    _requests_instrumented = True
+    logger.info("Outbound HTTP metrics enabled")
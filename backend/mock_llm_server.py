@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible mock LLM server for load tests
+Serves /v1/chat/completions (plain and streaming) with configurable time-to-first-token
+distributions, token rates and error rates, so load tests never reach DashScope.
+Point the backend at it with LLM_API_BASE=http://127.0.0.1:8100/v1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+DISTRIBUTIONS = ["fixed", "uniform", "normal", "lognormal", "exponential"]
+CANNED_ANSWER = (
+    "## Answer\n\n"
+    "Here is a short explanation generated by the mock server. "
+    "It stands in for a real model response so that latency and throughput can be measured "
+    "without calling an external API.\n\n"
+    "- First point with a [reference](https://everestmanila.com/admissions)\n"
+    "- Second point about the topic\n"
+    "- Third point with a summary\n\n"
+    "1. Review the key ideas\n"
+    "2. Practice with examples\n"
+    "3. Check your understanding"
+)
+
+
+@dataclass
+class MockConfig:
+    """Latency and output settings of the mock server"""
+    distribution: str = "lognormal"
+    latency_mean: float = 0.8  # seconds to first token
+    latency_stddev: float = 0.3
+    tokens_per_second: float = 50.0  # 0 sends the whole answer at once
+    response_tokens: int = 0  # 0 uses the canned answer length, capped by max_tokens
+    error_rate: float = 0.0  # fraction of requests answered with HTTP 500
+    rate_limit_rate: float = 0.0  # fraction answered with HTTP 429
+    seed: int = None
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        """Settings from MOCK_LLM_* environment variables"""
+        seed = os.getenv("MOCK_LLM_SEED")
+        return cls(
+            distribution=os.getenv("MOCK_LLM_DISTRIBUTION", cls.distribution),
+            latency_mean=float(os.getenv("MOCK_LLM_LATENCY_MEAN", cls.latency_mean)),
+            latency_stddev=float(os.getenv("MOCK_LLM_LATENCY_STDDEV", cls.latency_stddev)),
+            tokens_per_second=float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", cls.tokens_per_second)),
+            response_tokens=int(os.getenv("MOCK_LLM_RESPONSE_TOKENS", cls.response_tokens)),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", cls.error_rate)),
+            rate_limit_rate=float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", cls.rate_limit_rate)),
+            seed=int(seed) if seed else None
+        )
+
+
+class MockLLM:
+    """Samples latencies and produces token streams for one configuration"""
+
+    def __init__(self, config: MockConfig):
+        if config.distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {config.distribution}")
+        self.config = config
+        self.random = random.Random(config.seed)
+        # Each token keeps its leading whitespace, so joining them restores the text
+        self.tokens = re.findall(r"\s*\S+", CANNED_ANSWER)
+
+    def first_token_delay(self) -> float:
+        """Seconds before the first token, drawn from the configured distribution"""
+        mean, stddev = self.config.latency_mean, self.config.latency_stddev
+        distribution = self.config.distribution
+        if distribution == "fixed":
+            delay = mean
+        elif distribution == "uniform":
+            delay = self.random.uniform(max(0.0, mean - stddev), mean + stddev)
+        elif distribution == "normal":
+            delay = self.random.gauss(mean, stddev)
+        elif distribution == "exponential":
+            delay = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        else:
+            # Parameters chosen so the samples have the requested mean and standard deviation
+            if mean <= 0:
+                return 0.0
+            variance = stddev ** 2
+            sigma_sq = math.log(1 + variance / mean ** 2)
+            mu = math.log(mean) - sigma_sq / 2
+            delay = self.random.lognormvariate(mu, sigma_sq ** 0.5)
+        return max(0.0, delay)
+
+    def failure(self):
+        """Status code of an injected failure, or None"""
+        roll = self.random.random()
+        if roll < self.config.error_rate:
+            return 500
+        if roll < self.config.error_rate + self.config.rate_limit_rate:
+            return 429
+        return None
+
+    def answer_tokens(self, max_tokens: int = None) -> list:
+        """Tokens of the answer, repeating the canned text when more are configured"""
+        count = self.config.response_tokens or len(self.tokens)
+        if max_tokens:
+            count = min(count, max_tokens)
+        return [self.tokens[i % len(self.tokens)] for i in range(count)]
+
+    def token_delay(self) -> float:
+        """Seconds between tokens"""
+        rate = self.config.tokens_per_second
+        return 1 / rate if rate > 0 else 0.0
+
+
+def prompt_tokens(messages: list) -> int:
+    """Rough token count of the prompt, for the usage block"""
+    return sum(len(str(message.get("content", "")).split()) for message in messages)
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    """FastAPI app serving the OpenAI chat completions API"""
+    app = FastAPI(title="Mock LLM Server")
+    mock = MockLLM(config)
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock-qwen", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "config": config.__dict__}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock-qwen")
+        messages = body.get("messages", [])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        await asyncio.sleep(mock.first_token_delay())
+        status = mock.failure()
+        if status:
+            return JSONResponse(status_code=status, content={
+                "error": {"message": f"Injected mock failure ({status})", "type": "mock_error", "code": status}
+            })
+
+        tokens = mock.answer_tokens(body.get("max_tokens"))
+        usage = {
+            "prompt_tokens": prompt_tokens(messages),
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens(messages) + len(tokens)
+        }
+
+        if body.get("stream"):
+            async def events():
+                delay = mock.token_delay()
+                for token in tokens:
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if delay:
+                        await asyncio.sleep(delay)
+                final = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        # Without streaming the client still waits for every token to be generated
+        await asyncio.sleep(mock.token_delay() * len(tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+
+    return app
+
+
+def main():
+    defaults = MockConfig.from_env()
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default=defaults.distribution,
+                        help="Distribution of the time to first token")
+    parser.add_argument("--latency-mean", type=float, default=defaults.latency_mean)
+    parser.add_argument("--latency-stddev", type=float, default=defaults.latency_stddev)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--response-tokens", type=int, default=defaults.response_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockConfig(
+        distribution=args.distribution,
+        latency_mean=args.latency_mean,
+        latency_stddev=args.latency_stddev,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    )
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Mock LLM server on http://{args.host}:{args.port}/v1 with {config}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Model configuration system for different AI assistants
 from enum import Enum
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
+from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -109,6 +110,13 @@ class ModelSelector:
             } for model in ModelType
         }
     
+    def record_usage(self, model_type: ModelType, response_time: float):
+        """Update usage count, running mean response time and last use of a model"""
+        stats = self.model_stats[model_type]
+        stats["usage_count"] += 1
+        stats["avg_response_time"] += (response_time - stats["avg_response_time"]) / stats["usage_count"]
+        stats["last_used"] = datetime.now().isoformat()
+    
     def get_model_config(self, model_type: ModelType) -> ModelConfig:
         """Get configuration for a specific model"""
         return MODEL_CONFIGS[model_type]
@@ -190,4 +198,9 @@ def get_model_by_id(model_id: str) -> Optional[ModelType]:
     for model in ModelType:
         if model.value == model_id:
             return model
-    return None
\ No newline at end of file
+    return None
+
+def model_label(model_id: Optional[str]) -> str:
+    """Metrics label for a client-supplied model id; unknown ids share one label"""
+    model = get_model_by_id(model_id or ModelType.GENERAL.value)
+    return model.value if model else "unknown"
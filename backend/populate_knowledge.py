@@ -446,7 +446,8 @@ def main():
         logger.info(f"Adding {len(knowledge_entries)} knowledge entries...")
         added_ids = knowledge_service.bulk_add_knowledge(knowledge_entries)
         
-        logger.info(f"Successfully added {len(added_ids)} knowledge entries to the database!")
+        saved = sum(1 for knowledge_id in added_ids if knowledge_id is not None)
+        logger.info(f"Successfully added {saved} knowledge entries to the database!")
         
         # Verify the data was added
         logger.info("Verifying data...")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Script to pre-generate educational artifacts for every indexed Grade 9 topic
+Run offline so chat requests for common topics are served from the artifact store
+"""
+
+import argparse
+import logging
+import os
+
+from langchain_community.chat_models.tongyi import ChatTongyi
+
+from artifact_store import ArtifactStore
+from educational_features import DEFAULT_STUDENT_PROFILE, EducationalFeaturesHandler
+from grade9_knowledge_indexer import grade9_indexer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+# Command-line name -> EducationalFeaturesHandler method whose output is stored
+METHODS = {
+    "problem_sets": "mit_problem_sets",
+    "assessment": "generate_assessment",
+    "study_notes": "generate_study_notes",
+    "learning_path": "adaptive_learning_path"
+}
+
+
+def generate_for_topic(handler: EducationalFeaturesHandler, topic: str, methods):
+    """Generate every requested artifact for one topic; stored ones are skipped by the handler"""
+    if "problem_sets" in methods:
+        for difficulty in DIFFICULTIES:
+            handler.mit_problem_sets(topic, difficulty)
+    if "assessment" in methods:
+        handler.generate_assessment(topic, [f"Understand the key ideas of {topic}"], "mixed")
+    if "study_notes" in methods:
+        handler.generate_study_notes(topic, "cornell")
+    if "learning_path" in methods:
+        handler.adaptive_learning_path(DEFAULT_STUDENT_PROFILE, topic)
+
+
+def main():
+    """Main function to pre-generate the artifact store"""
+    parser = argparse.ArgumentParser(description="Pre-generate educational artifacts for Grade 9 topics")
+    parser.add_argument("--db", default="chatbot.db", help="SQLite database holding the artifact store")
+    parser.add_argument("--methods", nargs="+", choices=list(METHODS), default=list(METHODS))
+    parser.add_argument("--force", action="store_true", help="Regenerate artifacts that already exist")
+    args = parser.parse_args()
+
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        raise ValueError("DASHSCOPE_API_KEY not configured")
+
+    try:
+        store = ArtifactStore(args.db)
+        llm = ChatTongyi(model="qwen-max", api_key=api_key, temperature=0.7, max_tokens=8192)
+        handler = EducationalFeaturesHandler(llm, artifact_store=store)
+
+        topics = grade9_indexer.get_all_topics()
+        logger.info(f"Pre-generating {', '.join(args.methods)} for {len(topics)} topics...")
+
+        for topic in topics:
+            if args.force:
+                for method in args.methods:
+                    store.invalidate(method=METHODS[method], topic=topic["title"])
+            try:
+                generate_for_topic(handler, topic["title"], args.methods)
+                logger.info(f"Generated artifacts for {topic['subject']}: {topic['title']}")
+            except Exception as e:
+                logger.error(f"Failed to generate artifacts for {topic['title']}: {e}")
+
+        logger.info(f"Artifact store now holds {len(store.list_artifacts())} artifacts")
+
+    except Exception as e:
+        logger.error(f"Failed to pre-generate artifacts: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    main()
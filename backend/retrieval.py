@@ -0,0 +1,339 @@
+"""
+Hybrid retrieval over the knowledge base and scraped website pages
+BM25 and embedding rankings are merged with reciprocal rank fusion, after hits below a minimum
+score are dropped so weak matches never reach the prompt. Document embeddings are computed in
+the background and cached on disk; a query only waits for its own embedding for whatever is
+left of the latency budget, and falls back to BM25 alone when that runs out.
+"""
+import hashlib
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from similarity import normalize_rows, rank_top_k
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Function words that match nearly every entry and say nothing about the question
+STOP_WORDS = frozenset("""
+a about an and are as at be been but by can could do does for from had has have how i if in
+into is it its me my of on or our should so than that the their them then there these this
+those to was we were what when where which who why will with would you your
+""".split())
+# Hits scoring below these are not ranked: a BM25 score under 0.3 only comes from terms found
+# in most of the entries, and unrelated texts still reach cosine similarities around 0.3
+MIN_BM25_SCORE = float(os.getenv("RETRIEVAL_MIN_BM25_SCORE", "0.3"))
+MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0.4"))
+# Characters of a document sent to the embedding model
+EMBED_CHARS = 2000
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms, without stop words"""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.postings = defaultdict(list)  # term -> [(document, term frequency)]
+        lengths = []
+        for index, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((index, frequency))
+        self.size = len(lengths)
+        average = sum(lengths) / self.size if self.size else 0
+        # Length normalization per document, precomputed
+        self.norms = [k1 * (1 - b + b * length / average) if average else k1 for length in lengths]
+
+    def search(self, query: str, k: int, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """Indices and scores of the k best documents scoring at least min_score"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self.size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, frequency in postings:
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + self.norms[index])
+        hits = ((index, score) for index, score in scores.items() if score >= min_score)
+        return heapq.nlargest(k, hits, key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: List[List], k: int = 60) -> List[Tuple[object, float]]:
+    """Merge rankings of document keys; each contributes 1 / (k + rank)"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class VectorCache:
+    """Document embeddings keyed by text digest, persisted between runs"""
+
+    def __init__(self, embeddings_handler, path: Path, batch_size: int = 10):
+        self.handler = embeddings_handler
+        self.path = path
+        self.batch_size = batch_size
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('model') == self.handler.model:
+                self.vectors = state.get('vectors', {})
+                logger.info(f"Loaded {len(self.vectors)} cached retrieval embeddings")
+        except Exception as e:
+            logger.error(f"Failed to load retrieval embeddings: {e}")
+
+    def _save(self):
+        try:
+            with self.lock:
+                state = {'model': self.handler.model, 'vectors': dict(self.vectors)}
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(self.path)
+        except Exception as e:
+            logger.error(f"Failed to save retrieval embeddings: {e}")
+
+    def lookup(self, texts: Sequence[str]) -> Optional[Tuple[List[int], np.ndarray]]:
+        """Positions of the texts that have vectors and their normalized matrix, or None"""
+        rows, vectors = [], []
+        with self.lock:
+            for position, text in enumerate(texts):
+                vector = self.vectors.get(self.digest(text))
+                if vector is not None:
+                    rows.append(position)
+                    vectors.append(vector)
+        return (rows, normalize_rows(np.vstack(vectors))) if vectors else None
+
+    def fill(self, texts: Sequence[str]) -> int:
+        """Embed the texts that have no vector yet; number embedded"""
+        with self.lock:
+            missing = list(dict.fromkeys(t for t in texts if self.digest(t) not in self.vectors))
+        added = 0
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embeddings = self.handler.get_embeddings(batch)
+            if len(embeddings) != len(batch):
+                logger.error("Embedding request failed, retrieval continues with the vectors it has")
+                break
+            with self.lock:
+                for text, embedding in zip(batch, embeddings):
+                    self.vectors[self.digest(text)] = np.asarray(embedding, dtype=np.float32)
+            added += len(batch)
+        if added:
+            self._save()
+        return added
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        embeddings = self.handler.get_embeddings(query)
+        return embeddings[0] if len(embeddings) else None
+
+
+class DocumentSet:
+    """Entries with their BM25 index and, once embedded, their vectors"""
+
+    def __init__(self, source, entries: List[Dict], texts: List[str]):
+        self.source = source  # object the entries were built from, to detect changes
+        self.entries = entries
+        self.texts = texts
+        self.bm25 = BM25Index(texts)
+        # (positions of embedded entries, their normalized vectors), replaced as one value
+        self.embedded: Optional[Tuple[List[int], np.ndarray]] = None
+
+
+def _document_text(entry: Dict) -> str:
+    """Searchable text; the title is repeated as title matches used to weigh double"""
+    tags = entry.get('tags') or []
+    return "\n".join([entry.get('title', ''), entry.get('title', ''), entry.get('category', ''),
+                      " ".join(tags), entry.get('content', '')])
+
+
+def _embedding_text(entry: Dict) -> str:
+    return f"{entry.get('title', '')}\n{entry.get('content', '')}"[:EMBED_CHARS]
+
+
+class HybridRetriever:
+    """Ranks knowledge base entries and website pages for a query"""
+
+    def __init__(self, snapshot, embeddings_handler=None, budget_ms: float = 150.0, candidates: int = 20,
+                 min_bm25_score: float = MIN_BM25_SCORE, min_similarity: float = MIN_SIMILARITY):
+        self.snapshot = snapshot
+        self.budget = budget_ms / 1000
+        self.candidates = candidates
+        self.min_bm25_score = min_bm25_score
+        self.min_similarity = min_similarity
+        self.knowledge: Optional[DocumentSet] = None
+        self.pages: Optional[DocumentSet] = None
+        self.vectors: Optional[VectorCache] = None
+        self.rebuilding = False
+        self.lock = threading.Lock()
+        # Query embeddings must not queue behind document embedding
+        self.query_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval-query")
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-embed")
+        self.index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-index")
+        if embeddings_handler is not None:
+            self.set_embeddings_handler(embeddings_handler)
+
+    def set_embeddings_handler(self, embeddings_handler):
+        """Enable the vector side; document embeddings are computed in the background"""
+        cache_dir = Path(getattr(embeddings_handler, 'cache_dir', './embeddings_cache'))
+        cache_dir.mkdir(exist_ok=True)
+        self.vectors = VectorCache(embeddings_handler, cache_dir / "retrieval_vectors.pkl")
+        with self.lock:
+            documents = [d for d in (self.knowledge, self.pages) if d is not None]
+        for document_set in documents:
+            self._embed_in_background(document_set)
+
+    def has_vectors(self) -> bool:
+        return self.vectors is not None and self.knowledge is not None and self.knowledge.embedded is not None
+
+    def _embed_in_background(self, documents: DocumentSet):
+        if self.vectors is None:
+            return
+
+        def embed():
+            try:
+                self.vectors.fill([_embedding_text(e) for e in documents.entries])
+                documents.embedded = self.vectors.lookup([_embedding_text(e) for e in documents.entries])
+            except Exception as e:
+                logger.error(f"Failed to embed retrieval documents: {e}")
+
+        # Vectors already cached are usable right away
+        documents.embedded = self.vectors.lookup([_embedding_text(e) for e in documents.entries])
+        self.embed_executor.submit(embed)
+
+    @staticmethod
+    def _build_knowledge(entries: Dict[int, Dict]) -> DocumentSet:
+        values = list(entries.values())
+        return DocumentSet(entries, values, [_document_text(e) for e in values])
+
+    def _knowledge_documents(self) -> DocumentSet:
+        """Index of the knowledge snapshot
+        
+        Only the first index is built on the request path. After a knowledge write the index is
+        rebuilt in the background and searches use the previous one meanwhile; its hits are
+        looked up in the snapshot, so deleted entries are skipped and edited ones are current.
+        """
+        entries = self.snapshot.view()
+        with self.lock:
+            if self.knowledge is None:
+                self.knowledge = self._build_knowledge(entries)
+                self._embed_in_background(self.knowledge)
+            elif self.knowledge.source is not entries and not self.rebuilding:
+                self.rebuilding = True
+                self.index_executor.submit(self._rebuild_knowledge)
+            return self.knowledge
+
+    def _rebuild_knowledge(self):
+        """Index the latest snapshot and swap it in"""
+        try:
+            documents = self._build_knowledge(self.snapshot.view())
+            self._embed_in_background(documents)
+            with self.lock:
+                self.knowledge = documents
+        except Exception as e:
+            logger.error(f"Failed to rebuild the knowledge index: {e}")
+        finally:
+            with self.lock:
+                self.rebuilding = False
+
+    def _page_documents(self, pages: List[Dict]) -> DocumentSet:
+        """Index of the website pages; the website cache hands out the same list until it refreshes"""
+        with self.lock:
+            if self.pages is None or self.pages.source is not pages:
+                self.pages = DocumentSet(pages, pages, [_document_text(p) for p in pages])
+                self._embed_in_background(self.pages)
+            return self.pages
+
+    def search(self, query: str, limit: int, pages: Optional[List[Dict]] = None) -> List[Dict]:
+        """Best entries and pages by reciprocal rank fusion of BM25 and vector rankings"""
+        deadline = time.perf_counter() + self.budget
+        document_sets = {'kb': self._knowledge_documents()}
+        if pages:
+            document_sets['web'] = self._page_documents(pages)
+
+        # The query embedding is requested first so it overlaps the BM25 searches
+        query_vector = None
+        if self.vectors is not None and any(d.embedded is not None for d in document_sets.values()):
+            query_vector = self.query_executor.submit(self.vectors.embed_query, query)
+
+        rankings = []
+        for name, documents in document_sets.items():
+            hits = documents.bm25.search(query, self.candidates, min_score=self.min_bm25_score)
+            rankings.append([(name, index) for index, _ in hits])
+
+        if query_vector is not None:
+            try:
+                vector = query_vector.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeout:
+                logger.debug("Query embedding missed the retrieval budget, using BM25 only")
+                query_vector.cancel()
+                vector = None
+            if vector is not None:
+                vector = normalize_rows(vector)
+                scored = []
+                for name, documents in document_sets.items():
+                    if documents.embedded is None:
+                        continue
+                    positions, matrix = documents.embedded
+                    for row, score in rank_top_k(vector, matrix, self.candidates, normalized=True):
+                        if score >= self.min_similarity:
+                            scored.append((score, (name, positions[row])))
+                scored.sort(key=lambda item: item[0], reverse=True)
+                rankings.append([key for _, key in scored[:self.candidates]])
+
+        results = []
+        for (name, index), score in reciprocal_rank_fusion(rankings):
+            if name == 'kb':
+                entry = self.snapshot.get(document_sets['kb'].entries[index]['id'])
+                if entry is None:
+                    continue
+            else:
+                entry = {**document_sets['web'].entries[index], 'source': 'website'}
+            entry['relevance_score'] = round(score, 6)
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+
+def load_embeddings_handler():
+    """EmbeddingsHandler when DASHSCOPE_API_KEY is set and dashscope is installed, otherwise None"""
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        return None
+    try:
+        from embeddings_handler import EmbeddingsHandler
+    except ImportError as e:
+        logger.warning(f"Semantic retrieval disabled, embeddings are unavailable: {e}")
+        return None
+    return EmbeddingsHandler(api_key)
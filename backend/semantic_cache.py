@@ -0,0 +1,235 @@
+"""
+Semantic cache of chat answers
+Questions are embedded and matched against earlier questions to the same model; a paraphrase
+above the similarity threshold gets the earlier answer without another LLM call. Candidates come
+from random-hyperplane LSH buckets and are confirmed by exact cosine similarity. Entries expire
+after a TTL and are all dropped when the knowledge version changes.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import SEMANTIC_CACHE_SAVED_SECONDS, record_cache
+from similarity import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    """Case and whitespace folded, for exact repeats that need no embedding"""
+    return " ".join(text.lower().split())
+
+
+@dataclass
+class CachedAnswer:
+    model: str
+    key: str
+    vector: np.ndarray
+    result: Dict
+    llm_seconds: float
+    created: float
+    buckets: List[int] = field(default_factory=list)
+
+
+@dataclass
+class SemanticLookup:
+    """One question's lookup; handed back to store() once the answer is generated"""
+    model: str
+    key: str
+    vector: Optional[Future]
+    started: float
+    answer: Optional[CachedAnswer] = None
+    similarity: float = 0.0
+
+
+class SemanticQueryCache:
+    """Answers of recent questions, found again by embedding similarity"""
+
+    def __init__(self, embeddings_handler, version_source: Optional[Callable[[], int]] = None,
+                 threshold: float = 0.92, ttl: float = 3600.0, max_entries: int = 2000,
+                 budget_ms: float = 300.0, tables: int = 8, bits: int = 8):
+        self.handler = embeddings_handler
+        self.version_source = version_source
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.budget = budget_ms / 1000
+        self.tables = tables
+        self.bits = bits
+        self.planes: Optional[np.ndarray] = None  # (tables * bits, dimensions), drawn on first insert
+        self.entries = OrderedDict()  # entry id -> CachedAnswer, oldest first
+        self.exact = {}  # (model, key) -> entry id
+        self.buckets = defaultdict(set)  # (model, table, signature) -> entry ids
+        self.ids = count()
+        self.version = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="semantic-cache")
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        embeddings = self.handler.get_embeddings(question)
+        return normalize_rows(embeddings[0])[0] if len(embeddings) else None
+
+    def _signatures(self, vector: np.ndarray) -> List[int]:
+        """One LSH bucket per table: the sign pattern of the vector against that table's planes"""
+        signs = (self.planes @ vector > 0).reshape(self.tables, self.bits)
+        return [table * (1 << self.bits) + int(signature)
+                for table, signature in enumerate(signs @ (1 << np.arange(self.bits)))]
+
+    def _check_version(self):
+        """Drop everything once the knowledge base has changed; caller holds the lock"""
+        if self.version_source is None:
+            return
+        try:
+            version = self.version_source()
+        except Exception as e:
+            logger.error(f"Failed to read knowledge version: {e}")
+            return
+        if version != self.version:
+            if self.entries:
+                logger.info(f"Knowledge changed, dropping {len(self.entries)} cached answers")
+            self._clear()
+            self.version = version
+
+    def _clear(self):
+        self.entries.clear()
+        self.exact.clear()
+        self.buckets.clear()
+
+    def _remove(self, entry_id: int):
+        """Caller holds the lock"""
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self.exact.get((entry.model, entry.key)) == entry_id:
+            del self.exact[(entry.model, entry.key)]
+        for signature in entry.buckets:
+            bucket = self.buckets.get((entry.model, signature))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[(entry.model, signature)]
+
+    def _expire(self, now: float):
+        """Entries are in insertion order, so expired ones are at the front; caller holds the lock"""
+        while self.entries:
+            entry_id, entry = next(iter(self.entries.items()))
+            if now - entry.created <= self.ttl and len(self.entries) <= self.max_entries:
+                break
+            self._remove(entry_id)
+
+    def _nearest(self, model: str, vector: np.ndarray):
+        """Best entry in the query's buckets and its similarity; caller holds the lock"""
+        if self.planes is None or self.planes.shape[1] != len(vector):
+            return None, 0.0
+        candidates = set()
+        for signature in self._signatures(vector):
+            candidates |= self.buckets.get((model, signature), set())
+        if not candidates:
+            return None, 0.0
+        candidates = list(candidates)
+        scores = np.vstack([self.entries[i].vector for i in candidates]) @ vector
+        best = int(np.argmax(scores))
+        return self.entries[candidates[best]], float(scores[best])
+
+    def lookup(self, model: str, question: str) -> SemanticLookup:
+        """Cached answer for the question, or a pending lookup to store the new answer with"""
+        started = time.perf_counter()
+        key = normalize_question(question)
+        now = time.monotonic()
+        with self.lock:
+            self._check_version()
+            self._expire(now)
+            entry_id = self.exact.get((model, key))
+            if entry_id is not None:
+                record_cache("semantic", True)
+                return SemanticLookup(model, key, None, started, self.entries[entry_id], 1.0)
+
+        # Wait for the embedding only as long as the budget allows; the answer is stored with it later
+        vector = self.executor.submit(self._embed, question)
+        lookup = SemanticLookup(model, key, vector, started)
+        try:
+            embedding = vector.result(timeout=self.budget)
+        except FutureTimeout:
+            logger.debug("Question embedding missed the semantic cache budget")
+            embedding = None
+        except Exception as e:
+            logger.error(f"Failed to embed question for semantic cache: {e}")
+            embedding = None
+        if embedding is not None:
+            with self.lock:
+                entry, similarity = self._nearest(model, embedding)
+            if entry is not None and similarity >= self.threshold and now - entry.created <= self.ttl:
+                lookup.answer, lookup.similarity = entry, similarity
+        record_cache("semantic", lookup.answer is not None)
+        return lookup
+
+    def serve(self, lookup: SemanticLookup) -> Dict:
+        """Copy of the cached result, counting the LLM time it saves"""
+        SEMANTIC_CACHE_SAVED_SECONDS.inc(lookup.answer.llm_seconds, model=lookup.model)
+        result = dict(lookup.answer.result)
+        result['features_used'] = list(result.get('features_used', [])) + ['semantic_cache']
+        result['cache'] = {'similarity': round(lookup.similarity, 4),
+                           'age_seconds': round(time.monotonic() - lookup.answer.created, 1)}
+        return result
+
+    def store(self, lookup: SemanticLookup, result: Dict, llm_seconds: float):
+        """Cache a newly generated answer under the question's embedding"""
+        if lookup.vector is None:
+            return
+        try:
+            # The LLM call took longer than the embedding, so this rarely waits
+            vector = lookup.vector.result(timeout=self.budget)
+        except Exception as e:
+            logger.debug(f"No embedding to cache the answer under: {e}")
+            return
+        if vector is None:
+            return
+        entry = CachedAnswer(lookup.model, lookup.key, vector, dict(result), llm_seconds, time.monotonic())
+        with self.lock:
+            if self.planes is None or self.planes.shape[1] != len(vector):
+                # A new embedding model makes the old vectors incomparable
+                self._clear()
+                rng = np.random.default_rng(0)
+                self.planes = rng.standard_normal((self.tables * self.bits, len(vector))).astype(np.float32)
+            entry_id = next(self.ids)
+            previous = self.exact.get((entry.model, entry.key))
+            if previous is not None:
+                self._remove(previous)
+            entry.buckets = self._signatures(vector)
+            self.entries[entry_id] = entry
+            self.exact[(entry.model, entry.key)] = entry_id
+            for signature in entry.buckets:
+                self.buckets[(entry.model, signature)].add(entry_id)
+            self._expire(entry.created)
+
+    def stats(self) -> Dict:
+        """Cached answers per model"""
+        with self.lock:
+            models = defaultdict(int)
+            for entry in self.entries.values():
+                models[entry.model] += 1
+            return {'entries': len(self.entries), 'models': dict(models), 'knowledge_version': self.version}
+
+
+def create_semantic_cache(embeddings_handler, knowledge_snapshot=None) -> Optional[SemanticQueryCache]:
+    """Cache configured from the environment; None without embeddings or with SEMANTIC_CACHE_ENABLED=false"""
+    if embeddings_handler is None:
+        return None
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    return SemanticQueryCache(
+        embeddings_handler,
+        version_source=knowledge_snapshot.current_version if knowledge_snapshot is not None else None,
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000")),
+        budget_ms=float(os.getenv("SEMANTIC_CACHE_BUDGET_MS", "300"))
+    )
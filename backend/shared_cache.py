@@ -0,0 +1,369 @@
+"""
+Cache tier shared by every worker process
+Scrape results, website pages and session memory live here instead of in per-process dicts, so
+adding workers does not multiply outbound scraping. Backends only need get / set / delete with a
+TTL plus set-if-absent, compare-and-delete and append-to-list, which is what Redis offers; SQLite
+is the local default. Expensive refreshes take a lease lock so one process computes while the
+others wait.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Encoded values larger than this are zlib-compressed
+COMPRESS_THRESHOLD = 512
+LOCK_PREFIX = "lock:"
+
+
+def encode(value: Any) -> bytes:
+    """Compact JSON, compressed when large; the first byte tells which"""
+    data = json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+    if len(data) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(data, 6)
+    return b'j' + data
+
+
+def decode(data: bytes) -> Any:
+    data = bytes(data)
+    if data[:1] == b'z':
+        return json.loads(zlib.decompress(data[1:]))
+    return json.loads(data[1:])
+
+
+class MemoryBackend:
+    """Process-local backend, for single-worker runs and tests"""
+
+    def __init__(self):
+        self.items = {}  # key -> (value, expires_at)
+        self.lists = {}  # key -> (values, expires_at)
+        self.lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[bytes]:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if item[1] <= now:
+            del self.items[key]
+            return None
+        return item[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self.lock:
+            self.items[key] = (value, time.time() + ttl)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if the key is absent or expired"""
+        with self.lock:
+            now = time.time()
+            if self._live(key, now) is not None:
+                return False
+            self.items[key] = (value, now + ttl)
+            return True
+
+    def delete(self, key: str):
+        with self.lock:
+            self.items.pop(key, None)
+            self.lists.pop(key, None)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        """Delete only while the key still holds value"""
+        with self.lock:
+            if self._live(key, time.time()) != value:
+                return False
+            del self.items[key]
+            return True
+
+    def append(self, key: str, values: List[bytes], ttl: float, max_items: int):
+        """Add values to the end of a list, keep its last max_items and restart its TTL"""
+        with self.lock:
+            now = time.time()
+            items, expires_at = self.lists.get(key, ([], now))
+            items = (items if expires_at > now else []) + list(values)
+            self.lists[key] = (items[-max_items:], now + ttl)
+
+    def get_list(self, key: str) -> List[bytes]:
+        with self.lock:
+            items, expires_at = self.lists.get(key, ([], 0.0))
+            return list(items) if expires_at > time.time() else []
+
+
+class SQLiteBackend:
+    """Backend in a SQLite file that every worker on the host opens
+
+    The file is opened on first use, so importing the module does not create it.
+    """
+
+    def __init__(self, path: str, purge_every: int = 256):
+        self.path = path
+        self.purge_every = purge_every
+        self.writes = 0
+        self.local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection; autocommit, WAL so readers never wait for a writer"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            # List items; a list's TTL is kept on every item and restarted by each append
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_cache_lists (
+                    position INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_shared_cache_lists_key ON shared_cache_lists(key, position)')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            'SELECT value FROM shared_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO shared_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, value, now + ttl))
+        self.writes += 1
+        if self.writes % self.purge_every == 0:
+            conn.execute('DELETE FROM shared_cache WHERE expires_at <= ?', (now,))
+            conn.execute('DELETE FROM shared_cache_lists WHERE expires_at <= ?', (now,))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if the key is absent or expired"""
+        conn = self._connect()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so the check and the insert are one step
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM shared_cache WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO shared_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                                  (key, value, now + ttl))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        conn = self._connect()
+        conn.execute('DELETE FROM shared_cache WHERE key = ?', (key,))
+        conn.execute('DELETE FROM shared_cache_lists WHERE key = ?', (key,))
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        """Delete only while the key still holds value"""
+        cursor = self._connect().execute('DELETE FROM shared_cache WHERE key = ? AND value = ?', (key, value))
+        return cursor.rowcount == 1
+
+    def append(self, key: str, values: List[bytes], ttl: float, max_items: int):
+        """Add values to the end of a list, keep its last max_items and restart its TTL"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM shared_cache_lists WHERE key = ? AND expires_at <= ?', (key, now))
+            conn.executemany('INSERT INTO shared_cache_lists (key, value, expires_at) VALUES (?, ?, ?)',
+                             [(key, value, now + ttl) for value in values])
+            conn.execute('UPDATE shared_cache_lists SET expires_at = ? WHERE key = ?', (now + ttl, key))
+            conn.execute('''
+                DELETE FROM shared_cache_lists WHERE key = ? AND position <= (
+                    SELECT position FROM shared_cache_lists WHERE key = ?
+                    ORDER BY position DESC LIMIT 1 OFFSET ?
+                )
+            ''', (key, key, max_items))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_list(self, key: str) -> List[bytes]:
+        rows = self._connect().execute(
+            'SELECT value FROM shared_cache_lists WHERE key = ? AND expires_at > ? ORDER BY position',
+            (key, time.time())
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisBackend:
+    """Backend on a Redis server, for workers spread over several hosts"""
+
+    # Compare-and-delete has to run on the server to be atomic
+    DELETE_IF = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.delete_script = self.client.register_script(self.DELETE_IF)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self.client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def delete_if(self, key: str, value: bytes) -> bool:
+        return bool(self.delete_script(keys=[key], args=[value]))
+
+    def append(self, key: str, values: List[bytes], ttl: float, max_items: int):
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, *values)
+        pipeline.ltrim(key, -max_items, -1)
+        pipeline.pexpire(key, max(1, int(ttl * 1000)))
+        pipeline.execute()
+
+    def get_list(self, key: str) -> List[bytes]:
+        return self.client.lrange(key, 0, -1)
+
+
+class SharedCache:
+    """JSON values with TTLs on a backend, plus cross-process single-flight"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key: str) -> Any:
+        """Value, or None when missing, expired or unreadable"""
+        try:
+            data = self.backend.get(key)
+            return decode(data) if data is not None else None
+        except Exception as e:
+            logger.error(f"Shared cache read error for {key}: {e}")
+            return None
+
+    def set(self, key: str, value: Any, ttl: float):
+        try:
+            self.backend.set(key, encode(value), ttl)
+        except Exception as e:
+            logger.error(f"Shared cache write error for {key}: {e}")
+
+    def delete(self, key: str):
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.error(f"Shared cache delete error for {key}: {e}")
+
+    def append(self, key: str, values: List[Any], ttl: float, max_items: int = 1000):
+        """Add values to the end of the list at key without rewriting it, so concurrent appends all land"""
+        if not values:
+            return
+        try:
+            self.backend.append(key, [encode(value) for value in values], ttl, max_items)
+        except Exception as e:
+            logger.error(f"Shared cache append error for {key}: {e}")
+
+    def get_list(self, key: str) -> List[Any]:
+        """Values of the list at key in append order; empty when missing, expired or unreadable"""
+        try:
+            return [decode(data) for data in self.backend.get_list(key)]
+        except Exception as e:
+            logger.error(f"Shared cache read error for {key}: {e}")
+            return []
+
+    def acquire(self, name: str, lease: float) -> Optional[bytes]:
+        """Token of a lock held for at most lease seconds, or None if another holder has it"""
+        token = uuid.uuid4().hex.encode()
+        try:
+            return token if self.backend.add(LOCK_PREFIX + name, token, lease) else None
+        except Exception as e:
+            # Without a working lock, computing in every process beats not computing at all
+            logger.error(f"Shared cache lock error for {name}: {e}")
+            return token
+
+    def release(self, name: str, token: bytes):
+        try:
+            self.backend.delete_if(LOCK_PREFIX + name, token)
+        except Exception as e:
+            logger.error(f"Shared cache unlock error for {name}: {e}")
+
+    def wait(self, key: str, timeout: float) -> Any:
+        """Poll for a value another process is computing; None if it does not appear in time"""
+        deadline = time.monotonic() + timeout
+        delay = 0.02
+        while True:
+            value = self.get(key)
+            if value is not None or time.monotonic() >= deadline:
+                return value
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 0.5)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: float,
+                       lease: float = 60.0, wait: float = 30.0) -> Tuple[Any, bool]:
+        """Cached value, or one computed by a single process at a time; also whether it was cached
+
+        Processes that find the lock taken poll for the holder's result for up to wait seconds, then
+        compute it themselves. Empty results are returned but not stored, so they are retried.
+        """
+        deadline = time.monotonic() + wait
+        delay = 0.02
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value, True
+            token = self.acquire(key, lease)
+            if token is not None or time.monotonic() >= deadline:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        try:
+            if token is not None:
+                # The previous holder may have stored it between our read and the lock
+                value = self.get(key)
+                if value is not None:
+                    return value, True
+            value = compute()
+            if value:
+                self.set(key, value, ttl)
+            return value, False
+        finally:
+            if token is not None:
+                self.release(key, token)
+
+
+def create_backend(url: str):
+    """Backend for a SHARED_CACHE_URL: redis://..., memory://, or sqlite:///path (also a bare path)"""
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            return RedisBackend(url)
+        except ImportError as e:
+            logger.warning(f"Redis is unavailable, using the local SQLite shared cache: {e}")
+            url = "sqlite:///shared_cache.db"
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+    return SQLiteBackend(path)
+
+
+# Global shared cache
+shared_cache = SharedCache(create_backend(os.getenv("SHARED_CACHE_URL", "sqlite:///shared_cache.db")))
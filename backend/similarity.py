@@ -0,0 +1,58 @@
+"""
+Vectorized similarity utilities for embedding matrices
+Normalizes once and answers pairwise / nearest-neighbour questions with matrix products
+"""
+import numpy as np
+from typing import List, Tuple
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a copy of ``matrix`` with every row scaled to unit length.
+
+    Zero rows stay zero so their similarity to anything is 0.0, matching
+    ``EmbeddingsHandler.cosine_similarity``.
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity_matrix(left: np.ndarray, right: np.ndarray = None, normalized: bool = False) -> np.ndarray:
+    """Cosine similarity between every row of ``left`` and every row of ``right``.
+
+    With ``right`` omitted this is the Gram matrix of ``left``.
+    """
+    left_n = left if normalized else normalize_rows(left)
+    if right is None:
+        right_n = left_n
+    else:
+        right_n = right if normalized else normalize_rows(right)
+    return left_n @ right_n.T
+
+
+def thresholded_pairs(gram: np.ndarray, threshold: float) -> List[Tuple[int, int, float]]:
+    """Extract ``(i, j, similarity)`` for ``i < j`` where similarity exceeds ``threshold``.
+
+    Only the strict upper triangle is inspected, so each pair appears once.
+    """
+    rows, cols = np.nonzero(np.triu(gram > threshold, k=1))
+    return [(int(i), int(j), float(gram[i, j])) for i, j in zip(rows, cols)]
+
+
+def max_similarity(queries: np.ndarray, candidates: np.ndarray, normalized: bool = False) -> np.ndarray:
+    """Best cosine similarity from each query row to any candidate row."""
+    if len(candidates) == 0:
+        return np.zeros(len(queries), dtype=np.float32)
+    return similarity_matrix(queries, candidates, normalized=normalized).max(axis=1)
+
+
+def rank_top_k(query: np.ndarray, candidates: np.ndarray, k: int, normalized: bool = False) -> List[Tuple[int, float]]:
+    """Indices and scores of the ``k`` candidates most similar to ``query``, best first."""
+    if len(candidates) == 0 or k <= 0:
+        return []
+    scores = similarity_matrix(query, candidates, normalized=normalized)[0]
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(int(i), float(scores[i])) for i in best]
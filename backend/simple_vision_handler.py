@@ -2,30 +2,38 @@
 Simple Vision Handler using Qwen-VL via Dashscope
 """
 import logging
+from typing import List, Union
 import dashscope
 from dashscope import MultiModalConversation
 
+from vision_cache import vision_cache
+
 logger = logging.getLogger(__name__)
 
-def analyze_image_with_qwen_vl(image_data: str, text: str, api_key: str) -> str:
+def analyze_image_with_qwen_vl(image_data: Union[str, List[str]], text: str, api_key: str) -> str:
     """
     Analyze image using Qwen-VL model
     
     Args:
-        image_data: Base64 encoded image data URL
+        image_data: Base64 encoded image data URL, file:// path or URL (or a list of them)
         text: User's question about the image
         api_key: Dashscope API key
     """
     dashscope.api_key = api_key
     
+    if isinstance(image_data, str):
+        image_data = [image_data]
+    
     try:
-        # Prepare the message with image
+        cache_key = vision_cache.make_key(image_data, text, 'qwen-vl-max', namespace='simple_vision')
+        cached = vision_cache.get(cache_key)
+        if cached:
+            return cached['message']
+        
+        # Prepare the message with image(s)
         messages = [{
             'role': 'user',
-            'content': [
-                {'text': text},
-                {'image': image_data}
-            ]
+            'content': [{'text': text}] + [{'image': image} for image in image_data]
         }]
         
         # Call Qwen-VL
@@ -35,7 +43,9 @@ def analyze_image_with_qwen_vl(image_data: str, text: str, api_key: str) -> str:
         )
         
         if response.status_code == 200:
-            return response.output.choices[0].message.content
+            message = response.output.choices[0].message.content
+            vision_cache.set(cache_key, {'message': message})
+            return message
         else:
             logger.error(f"Qwen-VL API error: {response}")
             return f"I couldn't analyze the image. Error: {response.message}"
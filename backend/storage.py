@@ -0,0 +1,304 @@
+"""
+Storage backends shared by DatabaseManager, ChatManager and IsolatedDatabase
+Queries are written once with '?' placeholders; SQLiteStorage runs them as they are and
+PostgresStorage translates them and runs them on a bounded connection pool
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(ABC):
+    """Common interface of the storage backends; a backend missing a method cannot be constructed"""
+
+    dialect = None
+
+    @abstractmethod
+    def connect(self):
+        """Context manager yielding a connection for one unit of work; committed on success, rolled back on error"""
+
+    def ddl(self, sql: str) -> str:
+        """CREATE statement adapted to the backend"""
+        return sql
+
+    def execute(self, cursor, sql: str, params: Sequence = (), prepare: bool = False):
+        """Run a statement; prepare=True marks a hot statement worth preparing on the server"""
+        cursor.execute(sql, params)
+        return cursor
+
+    @abstractmethod
+    def insert(self, cursor, sql: str, params: Sequence = ()) -> int:
+        """Run an INSERT and return the id of the new row"""
+
+    def executemany(self, cursor, sql: str, rows: Iterable[Sequence]):
+        """Run one statement for many parameter rows"""
+        cursor.executemany(sql, rows)
+
+    @abstractmethod
+    def index_exists(self, cursor, name: str) -> bool:
+        """Whether an index of that name exists"""
+
+    def describe(self) -> str:
+        """Human-readable location for logs"""
+        return self.dialect
+
+
+class SQLiteStorage(Storage):
+    """A SQLite database file"""
+
+    dialect = "sqlite"
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def insert(self, cursor, sql: str, params: Sequence = ()) -> int:
+        cursor.execute(sql, params)
+        return cursor.lastrowid
+
+    def index_exists(self, cursor, name: str) -> bool:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+        return cursor.fetchone() is not None
+
+    def describe(self) -> str:
+        return f"sqlite:{self.db_path}"
+
+
+# SQLite spellings that differ in PostgreSQL
+DDL_REWRITES = [
+    (re.compile(r'INTEGER PRIMARY KEY AUTOINCREMENT', re.IGNORECASE), 'SERIAL PRIMARY KEY'),
+    # Flags are stored and compared as 0/1 by the queries, so keep them integers
+    (re.compile(r'BOOLEAN DEFAULT 0', re.IGNORECASE), 'INTEGER DEFAULT 0'),
+    (re.compile(r'BOOLEAN DEFAULT 1', re.IGNORECASE), 'INTEGER DEFAULT 1'),
+    (re.compile(r'\bBLOB\b', re.IGNORECASE), 'BYTEA'),
+    # SQLite's REAL is 8 bytes; PostgreSQL's is 4, too coarse for epoch timestamps
+    (re.compile(r'\bREAL\b', re.IGNORECASE), 'DOUBLE PRECISION'),
+]
+LIKE_PATTERN = re.compile(r'\bLIKE\b')
+
+
+def _to_postgres(sql: str) -> str:
+    """'?' placeholders to '%s'; LIKE to ILIKE, which is what SQLite's LIKE does for ASCII"""
+    return LIKE_PATTERN.sub('ILIKE', sql.replace('%', '%%').replace('?', '%s'))
+
+
+def _adapt_param(value):
+    """Booleans are stored as integers, as in SQLite"""
+    return int(value) if isinstance(value, bool) else value
+
+
+def _adapt_value(value):
+    """Timestamps are returned as ISO strings, as SQLite returns them"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+
+class PostgresCursor:
+    """DB-API cursor that accepts the SQLite dialect used across the backend"""
+
+    def __init__(self, connection: "PostgresConnection"):
+        self.connection = connection
+        self.cursor = connection.raw.cursor()
+
+    def execute(self, sql: str, params: Sequence = (), prepare: bool = False):
+        """Run a statement; prepare=True keeps it as a server-side prepared statement on this connection"""
+        translated = self.connection.storage.translate(sql)
+        params = tuple(_adapt_param(p) for p in params)
+        if prepare:
+            name = self.connection.prepare(translated, len(params))
+            if params:
+                self.cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                self.cursor.execute(f"EXECUTE {name}")
+        else:
+            self.cursor.execute(translated, params)
+        return self
+
+    def executemany(self, sql: str, rows: Iterable[Sequence]):
+        from psycopg2.extras import execute_batch
+
+        translated = self.connection.storage.translate(sql)
+        execute_batch(self.cursor, translated, [tuple(_adapt_param(p) for p in row) for row in rows],
+                      page_size=self.connection.storage.batch_size)
+        return self
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return tuple(_adapt_value(v) for v in row) if row is not None else None
+
+    def fetchall(self):
+        return [tuple(_adapt_value(v) for v in row) for row in self.cursor.fetchall()]
+
+    @property
+    def rowcount(self) -> int:
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        raise AttributeError("Use Storage.insert to get the id of a new row in PostgreSQL")
+
+    def close(self):
+        self.cursor.close()
+
+
+class PostgresConnection:
+    """Pooled psycopg2 connection with per-connection prepared statements"""
+
+    def __init__(self, storage: "PostgresStorage", raw):
+        self.storage = storage
+        self.raw = raw
+        # Prepared statements live as long as the server session, i.e. the pooled connection
+        self.prepared_statements = storage.prepared.setdefault(raw, set())
+
+    def cursor(self) -> PostgresCursor:
+        return PostgresCursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def prepare(self, translated: str, param_count: int) -> str:
+        """Name of the prepared statement for translated SQL, preparing it on first use"""
+        name = f"stmt_{zlib.crc32(translated.encode()):08x}"
+        if name not in self.prepared_statements:
+            # PREPARE uses $n parameters
+            counter = iter(range(1, param_count + 1))
+            body = re.sub(r'%s', lambda _: f"${next(counter)}", translated).replace('%%', '%')
+            with self.raw.cursor() as cursor:
+                cursor.execute(f"PREPARE {name} AS {body}")
+            self.prepared_statements.add(name)
+        return name
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL on a bounded, thread-safe connection pool"""
+
+    dialect = "postgres"
+
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 10,
+                 acquire_timeout: float = 30.0, batch_size: int = 500):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.dsn = dsn
+        self.pool = ThreadedConnectionPool(min_connections, max_connections, dsn)
+        # The pool raises instead of waiting when exhausted; the semaphore makes callers wait
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.acquire_timeout = acquire_timeout
+        self.batch_size = batch_size
+        self.translations = {}
+        self.prepared = {}  # pooled connection -> names of its prepared statements
+
+    def translate(self, sql: str) -> str:
+        """Cached translation of a query to psycopg2's dialect"""
+        translated = self.translations.get(sql)
+        if translated is None:
+            translated = self.translations[sql] = _to_postgres(sql)
+        return translated
+
+    @contextmanager
+    def connect(self):
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No database connection available within {self.acquire_timeout}s")
+        raw = None
+        try:
+            raw = self.pool.getconn()
+            conn = PostgresConnection(self, raw)
+            try:
+                yield conn
+                raw.commit()
+            except Exception:
+                raw.rollback()
+                raise
+        finally:
+            if raw is not None:
+                # Broken connections are discarded; the pool also closes idle ones beyond min_connections
+                self.pool.putconn(raw, close=bool(raw.closed))
+                if raw.closed:
+                    self.prepared.pop(raw, None)
+            self.slots.release()
+
+    def ddl(self, sql: str) -> str:
+        for pattern, replacement in DDL_REWRITES:
+            sql = pattern.sub(replacement, sql)
+        return sql
+
+    def execute(self, cursor, sql: str, params: Sequence = (), prepare: bool = False):
+        return cursor.execute(sql, params, prepare=prepare)
+
+    def insert(self, cursor, sql: str, params: Sequence = ()) -> int:
+        cursor.execute(sql.rstrip().rstrip(';') + " RETURNING id", params)
+        return cursor.fetchone()[0]
+
+    def executemany(self, cursor, sql: str, rows: Iterable[Sequence]):
+        cursor.executemany(sql, rows)
+
+    def index_exists(self, cursor, name: str) -> bool:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = ?", (name,))
+        return cursor.fetchone() is not None
+
+    def describe(self) -> str:
+        return "postgres:" + re.sub(r'//[^@/]*@', '//***@', self.dsn)
+
+    def close(self):
+        """Close every pooled connection"""
+        self.pool.closeall()
+
+
+def upsert_statement(table: str, columns: Sequence[str], key_columns: Sequence[str]) -> str:
+    """INSERT that overwrites the other columns of an existing row with the same key
+
+    SQLite (3.24+) and PostgreSQL share this syntax, unlike SQLite's INSERT OR REPLACE.
+    """
+    updates = [f"{column} = excluded.{column}" for column in columns if column not in key_columns]
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {', '.join(updates)}")
+
+
+_shared_postgres: Optional[PostgresStorage] = None
+_shared_lock = threading.Lock()
+
+
+def create_storage(db_path: str = "chatbot.db") -> Storage:
+    """PostgreSQL when DATABASE_URL points at it, otherwise the SQLite file at db_path
+
+    All PostgreSQL users in the process share one pool.
+    """
+    global _shared_postgres
+    database_url = os.getenv("DATABASE_URL", "")
+    if not database_url.startswith(("postgres://", "postgresql://")):
+        return SQLiteStorage(db_path)
+    with _shared_lock:
+        if _shared_postgres is None:
+            _shared_postgres = PostgresStorage(
+                database_url,
+                min_connections=int(os.getenv("DB_POOL_MIN", "2")),
+                max_connections=int(os.getenv("DB_POOL_MAX", "10"))
+            )
+            logger.info(f"Using {_shared_postgres.describe()} with up to {os.getenv('DB_POOL_MAX', '10')} connections")
+        return _shared_postgres
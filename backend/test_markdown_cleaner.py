@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Check that the streaming markdown cleaner matches clean_markdown_response"""
+
+import random
+import sys
+sys.path.append('.')
+
+from markdown_cleaner import StreamingMarkdownCleaner, clean_markdown_response
+
+# Fragments that exercise tags, attributes, links and list markers around line breaks
+FRAGMENTS = [
+    '<', '>', 'a', 'b', '[', ']', '(', ')', '\n', '\n', '\n\n', ' ', ' ', '  ', '\t', '-', '*',
+    '1.', ' 2. ', '"', 'class="c"', 'target="_blank"', 'rel="x"', 'style="', 'id=', '</b>', '<b>',
+    'http://x.y', '[x](http://a b)', '.', '!', 'x', 'text '
+]
+
+# Inputs that once came out differently when streamed
+REGRESSIONS = [
+    '<   class="c"btarget="_blank"\nfoo>bar\nbaz',
+    '<\nclass="c"rel="x"text xid=\n< ![id=> id=</b> rel="x"\n\n !<\n',
+    'target="_blank"<b>*rel="x"b id="b\nid=-)\nb-rel="x"\n < class="c"([(<\n\n <<b>(rel="x""*',
+]
+
+
+def stream(text: str, rng: random.Random) -> str:
+    """Feed text in random small chunks and join the output"""
+    cleaner = StreamingMarkdownCleaner(max_lookback=len(text) + 1)
+    output = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 6)
+        output.append(cleaner.feed(text[position:position + size]))
+        position += size
+    output.append(cleaner.finish())
+    return ''.join(output)
+
+
+def test_streaming_matches_batch():
+    rng = random.Random(0)
+    inputs = REGRESSIONS + [
+        ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 40)))
+        for _ in range(20000)
+    ]
+    for text in inputs:
+        assert stream(text, rng) == clean_markdown_response(text), repr(text)
+
+
+if __name__ == "__main__":
+    test_streaming_matches_batch()
+    print("Streaming cleaner matches clean_markdown_response")
@@ -0,0 +1,126 @@
+"""
+Near-duplicate detection for scraped text blocks
+Blocks are fingerprinted with a 64-bit simhash over word shingles; fingerprints a few bits apart
+are the same block with cosmetic differences (punctuation, spacing, a reworded phrase). Blocks
+whose numbers differ are never merged, since prices, grades and dates matter. Each fingerprint
+is split into bands, and two fingerprints within MAX_DISTANCE bits share at least one band
+exactly, so a lookup is a few dict probes instead of a scan.
+"""
+import hashlib
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+NUMBER_PATTERN = re.compile(r"\d+")
+SHINGLE_SIZE = 2
+# Unrelated blocks land around 32 bits apart; one changed word in a short block moves a few bits
+MAX_DISTANCE = 7
+# Blocks with fewer words are only matched exactly; a handful of shingles makes an unstable hash
+MIN_SIMHASH_WORDS = 8
+
+
+def block_words(text: str) -> List[str]:
+    """Lowercase words, ignoring punctuation and spacing"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def simhash(words: Sequence[str], shingle_size: int = SHINGLE_SIZE) -> int:
+    """64-bit simhash of the word shingles"""
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    digests = b"".join(hashlib.blake2b(s.encode(), digest_size=8).digest() for s in shingles)
+    # Each shingle votes on every bit; the fingerprint keeps the majority
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), 8), axis=1, bitorder='little')
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+
+class BlockIndex:
+    """Distinct text blocks; near-duplicates of a stored block resolve to its id"""
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.band_bits = 64 // (max_distance + 1)
+        self.blocks: List[str] = []
+        self.fingerprints: List[Optional[int]] = []
+        self.numbers: List[Tuple[str, ...]] = []
+        self.exact: Dict[str, int] = {}  # normalized text -> block id
+        self.bands = [defaultdict(list) for _ in range(max_distance + 1)]  # band value -> block ids
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(len(self.bands))]
+
+    def _lookup(self, key: str, fingerprint: Optional[int], numbers: Tuple[str, ...]) -> Optional[int]:
+        block_id = self.exact.get(key)
+        if block_id is not None or fingerprint is None:
+            return block_id
+        for band, value in zip(self.bands, self._band_values(fingerprint)):
+            for candidate in band.get(value, ()):
+                if self.numbers[candidate] == numbers and \
+                        bin(fingerprint ^ self.fingerprints[candidate]).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    @staticmethod
+    def _fingerprint(words: List[str]) -> Optional[int]:
+        return simhash(words) if len(words) >= MIN_SIMHASH_WORDS else None
+
+    def find(self, text: str) -> Optional[int]:
+        """Id of the stored block the text duplicates, if any"""
+        words = block_words(text)
+        key = " ".join(words)
+        return self._lookup(key, self._fingerprint(words), tuple(NUMBER_PATTERN.findall(key)))
+
+    def add(self, text: str) -> Tuple[int, bool]:
+        """Id of the text's block, and whether it was new"""
+        words = block_words(text)
+        key = " ".join(words)
+        fingerprint = self._fingerprint(words)
+        numbers = tuple(NUMBER_PATTERN.findall(key))
+        block_id = self._lookup(key, fingerprint, numbers)
+        if block_id is not None:
+            return block_id, False
+        block_id = len(self.blocks)
+        self.blocks.append(text)
+        self.fingerprints.append(fingerprint)
+        self.numbers.append(numbers)
+        self.exact[key] = block_id
+        if fingerprint is not None:
+            for band, value in zip(self.bands, self._band_values(fingerprint)):
+                band[value].append(block_id)
+        return block_id, True
+
+
+def factor_shared_blocks(pages: Sequence[Sequence[str]], min_pages: int = 2) -> Tuple[List[str], List[List[str]], List[List[int]]]:
+    """Split blocks that recur on min_pages or more pages out of the pages they appear on
+
+    Returns the shared blocks, each page's own blocks, and each page's references into the
+    shared blocks.
+    """
+    index = BlockIndex()
+    page_ids = [[index.add(text)[0] for text in blocks] for blocks in pages]
+    page_counts = defaultdict(int)
+    for ids in page_ids:
+        for block_id in set(ids):
+            page_counts[block_id] += 1
+
+    shared_ids = sorted(block_id for block_id, pages_seen in page_counts.items() if pages_seen >= min_pages)
+    shared_position = {block_id: position for position, block_id in enumerate(shared_ids)}
+    own_blocks, references = [], []
+    for ids in page_ids:
+        seen = set()
+        own, refs = [], []
+        for block_id in ids:
+            if block_id in seen:
+                continue
+            seen.add(block_id)
+            if block_id in shared_position:
+                refs.append(shared_position[block_id])
+            else:
+                own.append(index.blocks[block_id])
+        own_blocks.append(own)
+        references.append(refs)
+    return [index.blocks[block_id] for block_id in shared_ids], own_blocks, references
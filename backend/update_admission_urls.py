@@ -103,24 +103,14 @@ Note: Always use these official URLs. The admissions section is found under the
         
         logger.info("Adding updated admission entries...")
         
-        # Add the main admission entry
-        knowledge_id = knowledge_service.add_knowledge_entry(
-            admission_entry['category'],
-            admission_entry['title'],
-            admission_entry['content'],
-            admission_entry['tags']
-        )
-        logger.info(f"Added main admission entry with ID: {knowledge_id}")
-        
-        # Add additional entries
-        for entry in additional_entries:
-            knowledge_id = knowledge_service.add_knowledge_entry(
-                entry['category'],
-                entry['title'],
-                entry['content'],
-                entry['tags']
-            )
-            logger.info(f"Added entry '{entry['title']}' with ID: {knowledge_id}")
+        # Main admission entry and additional entries in one transaction; reruns update them in place
+        entries = [admission_entry] + additional_entries
+        knowledge_ids = knowledge_service.bulk_add_knowledge(entries)
+        for entry, knowledge_id in zip(entries, knowledge_ids):
+            if knowledge_id is None:
+                logger.error(f"Entry '{entry['title']}' was rejected")
+            else:
+                logger.info(f"Saved entry '{entry['title']}' with ID: {knowledge_id}")
         
         logger.info("Successfully updated admission information with correct URLs!")
         
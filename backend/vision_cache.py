@@ -0,0 +1,174 @@
+"""
+Persistent cache for Qwen-VL results
+Keys results by caller namespace, image content hash, normalized prompt and model, with LRU eviction
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Union
+
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Text-extraction requests share one cache entry per image and model, whatever the wording
+OCR_PROMPT_KEY = "__ocr__"
+OCR_PATTERN = re.compile(
+    r'\b(extract|read|transcribe|ocr|copy)\b.*\b(text|words|writing|contents?)\b'
+    r'|\bwhat does (it|this|the \w+) say\b'
+)
+# Requests that go beyond reading the text need their own answer
+BEYOND_OCR_PATTERN = re.compile(r'\b(solve|explain|answer|why|how|calculate|summari[sz]e|translate|analy[sz]e)\b')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    prompt = re.sub(r'\s+', ' ', (prompt or '').lower()).strip()
+    return prompt.rstrip(' ?.!')
+
+
+def is_ocr_request(prompt: str) -> bool:
+    """Whether a prompt only asks for the text in the image"""
+    prompt = normalize_prompt(prompt)
+    return bool(OCR_PATTERN.search(prompt)) and not BEYOND_OCR_PATTERN.search(prompt)
+
+
+def hash_image(image: str) -> str:
+    """Content hash for a data URL, bare base64, file:// path or remote URL"""
+    if image.startswith('file://'):
+        hasher = hashlib.sha256()
+        with open(image[len('file://'):], 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+    if image.startswith('data:') and ',' in image:
+        image = image.split(',', 1)[1]
+    return hashlib.sha256(image.encode()).hexdigest()
+
+
+class VisionResultCache:
+    """SQLite-backed LRU cache of vision model answers"""
+
+    def __init__(self, db_path: str = None, max_entries: int = None):
+        self.db_path = db_path or os.getenv("VISION_CACHE_PATH", "vision_cache.db")
+        self.max_entries = max_entries or int(os.getenv("VISION_CACHE_SIZE", "2000"))
+        self.hits = 0
+        self.misses = 0
+        self._ready = False
+
+    def _init_db(self):
+        """Create the cache table on first use, so importing the module creates no file"""
+        if self._ready:
+            return
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS vision_results (
+                        cache_key TEXT PRIMARY KEY,
+                        image_hash TEXT NOT NULL,
+                        prompt TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        result TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_vision_last_used ON vision_results(last_used)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_vision_image ON vision_results(image_hash)')
+                conn.commit()
+            self._ready = True
+        except Exception as e:
+            logger.error(f"Failed to initialize vision cache: {e}")
+
+    def make_key(self, images: Union[str, List[str]], prompt: str, model: str,
+                 namespace: str = "vision") -> Dict[str, str]:
+        """Build the cache key parts for a request
+
+        Callers that store differently shaped results pass their own namespace, so one never
+        reads the other's entries.
+        """
+        if isinstance(images, str):
+            images = [images]
+        image_hash = hashlib.sha256('|'.join(hash_image(img) for img in images).encode()).hexdigest()
+
+        prompt_key = OCR_PROMPT_KEY if is_ocr_request(prompt) else normalize_prompt(prompt)
+        model_key = f"{namespace}:{model}"
+
+        cache_key = hashlib.sha256(f"{image_hash}\0{prompt_key}\0{model_key}".encode()).hexdigest()
+        return {'cache_key': cache_key, 'image_hash': image_hash, 'prompt': prompt_key, 'model': model_key}
+
+    def get(self, key: Dict[str, str]) -> Optional[Dict]:
+        """Return a cached result and mark it recently used"""
+        self._init_db()
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT result FROM vision_results WHERE cache_key = ?', (key['cache_key'],))
+                row = cursor.fetchone()
+                if not row:
+                    self.misses += 1
+                    record_cache("vision", False)
+                    return None
+                cursor.execute(
+                    'UPDATE vision_results SET last_used = ? WHERE cache_key = ?',
+                    (time.time(), key['cache_key'])
+                )
+                conn.commit()
+                self.hits += 1
+                record_cache("vision", True)
+                return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Vision cache read error: {e}")
+            return None
+
+    def set(self, key: Dict[str, str], result: Dict):
+        """Store a result, evicting the least recently used entries over the size bound"""
+        self._init_db()
+        try:
+            now = time.time()
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO vision_results
+                        (cache_key, image_hash, prompt, model, result, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (key['cache_key'], key['image_hash'], key['prompt'], key['model'],
+                      json.dumps(result), now, now))
+
+                cursor.execute('SELECT COUNT(*) FROM vision_results')
+                overflow = cursor.fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    cursor.execute('''
+                        DELETE FROM vision_results WHERE cache_key IN (
+                            SELECT cache_key FROM vision_results ORDER BY last_used ASC LIMIT ?
+                        )
+                    ''', (overflow,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Vision cache write error: {e}")
+
+    def clear(self):
+        """Remove every cached result"""
+        self._init_db()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM vision_results')
+            conn.commit()
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters for this process"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'max_entries': self.max_entries
+        }
+
+
+# Global cache instance
+vision_cache = VisionResultCache()
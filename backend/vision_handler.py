@@ -2,21 +2,22 @@
 Vision Handler for Qwen-VL Models
 Handles image analysis, OCR, diagram understanding, etc.
 """
-import base64
 import logging
 from typing import List, Dict, Optional, Union
-from io import BytesIO
-from PIL import Image
 import dashscope
 from dashscope import MultiModalConversation
 from langchain_core.messages import HumanMessage, AIMessage
 
+from image_pipeline import compress_image_data
+from vision_cache import VisionResultCache, vision_cache
+
 logger = logging.getLogger(__name__)
 
 class VisionHandler:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[VisionResultCache] = None):
         self.api_key = api_key
         dashscope.api_key = api_key
+        self.cache = cache or vision_cache
         
     def analyze_image(self, image_data: Union[str, List[str]], query: str, model: str = "qwen-vl-max") -> Dict:
         """
@@ -28,6 +29,12 @@ class VisionHandler:
             model: Which Qwen-VL model to use
         """
         try:
+            # Same image, same question, same model: reuse the earlier answer
+            cache_key = self.cache.make_key(image_data, query, model)
+            cached = self.cache.get(cache_key)
+            if cached:
+                return {**cached, "cached": True}
+            
             # Prepare messages for vision model
             messages = []
             
@@ -65,12 +72,14 @@ class VisionHandler:
             )
             
             if response.status_code == 200:
-                return {
+                result = {
                     "success": True,
                     "message": response.output.choices[0].message.content,
                     "model_used": model,
                     "features": ["image_analysis", "visual_qa"]
                 }
+                self.cache.set(cache_key, result)
+                return result
             else:
                 logger.error(f"Vision API error: {response}")
                 return {
@@ -127,33 +136,4 @@ class ImageProcessor:
     @staticmethod
     def compress_image(image_data: str, max_size: int = 1024 * 1024) -> str:
         """Compress image to reduce size while maintaining quality"""
-        try:
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
-            
-            # Convert RGBA to RGB if necessary
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            
-            # Resize if too large
-            max_dimension = 1920
-            if image.width > max_dimension or image.height > max_dimension:
-                image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
-            
-            # Save with compression
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=85, optimize=True)
-            compressed_data = base64.b64encode(output.getvalue()).decode()
-            
-            return f"data:image/jpeg;base64,{compressed_data}"
-            
-        except Exception as e:
-            logger.error(f"Image compression error: {e}")
-            return image_data  # Return original if compression fails
\ No newline at end of file
+        return compress_image_data(image_data, max_size=max_size)
@@ -11,6 +11,8 @@ from typing import List, Dict, Optional
 from datetime import datetime
 import re
 
+from intent_router import classify
+
 logger = logging.getLogger(__name__)
 
 class WebSearcher:
@@ -202,17 +204,8 @@ class WebSearcher:
         """
         Determine if a query needs web search
         """
-        # Keywords that indicate need for current information
-        current_info_keywords = [
-            'today', 'current', 'latest', 'now', 'weather', 'news',
-            'price', 'stock', 'score', 'result', 'update', 'recent',
-            'happening', 'temperature', 'forecast', 'trending',
-            'live', 'real-time', 'at the moment', 'right now'
-        ]
-        
         # Check if query contains time-sensitive keywords
-        query_lower = query.lower()
-        return any(keyword in query_lower for keyword in current_info_keywords)
+        return classify(query).has('time_sensitive')
 
 
 # Global instance
@@ -10,6 +10,8 @@ from urllib.parse import quote
 import json
 import re
 
+from intent_router import classify
+
 logger = logging.getLogger(__name__)
 
 class WebSearchHelper:
@@ -98,24 +100,14 @@ class WebSearchHelper:
     
     def needs_web_search(self, query: str) -> bool:
         """Determine if a query needs web search for current information"""
-        # Keywords that indicate need for current information
-        current_indicators = [
-            'today', 'current', 'latest', 'now', 'recent',
-            'news', 'update', 'price', 'weather', 'score',
-            'president', 'election', 'stock', 'covid',
-            'ukraine', 'ai news', 'openai', 'anthropic',
-            'this year', 'this month', 'this week',
-            '2024', '2025', 'happening'
-        ]
-        
-        query_lower = query.lower()
+        routing = classify(query)
         
         # Check for date-specific queries
-        if any(word in query_lower for word in ['when', 'what time', 'what date']):
+        if routing.has('date_question'):
             return False  # We handle dates internally
         
         # Check for current information needs
-        return any(indicator in query_lower for indicator in current_indicators)
+        return routing.has('current_events')
     
     def format_search_results(self, results: List[Dict]) -> str:
         """Format search results for inclusion in response"""
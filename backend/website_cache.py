@@ -7,13 +7,26 @@ import time
 import logging
 from typing import Dict, List, Optional
 from threading import Lock
-from website_scraper import scrape_everest_website
+from website_scraper import resolve_shared_blocks, scrape_everest_website
+from metrics import record_cache
+from shared_cache import SharedCache, shared_cache
 
 logger = logging.getLogger(__name__)
 
+# Shared tier key of the scraped Everest Academy pages
+WEBSITE_KEY = "website:everestmanila.com"
+
+
 class WebsiteCache:
-    def __init__(self, cache_duration: int = 14400):  # 4 hours default for better performance
+    def __init__(self, cache_duration: int = 14400, cache: Optional[SharedCache] = None,
+                 stale_duration: int = 604800, refresh_lease: int = 300):  # 4 hours default for better performance
         self.cache_duration = cache_duration
+        self.cache = cache or shared_cache
+        # Pages stay in the shared tier a week, to serve while a refresh runs or after it fails
+        self.stale_duration = stale_duration
+        self.refresh_lease = refresh_lease
+        # This worker's copy with shared blocks resolved; the same list is handed out until it is
+        # refreshed. The shared tier keeps the compact form, with each shared block stored once
         self.global_cache = None
         self.global_cache_timestamp = 0
         self.lock = Lock()
@@ -22,16 +35,35 @@ class WebsiteCache:
         """Check if cache has expired"""
         return time.time() - timestamp > self.cache_duration
     
+    def _adopt_shared(self) -> bool:
+        """Take the shared pages if another worker scraped after our copy; caller holds the lock"""
+        entry = self.cache.get(WEBSITE_KEY)
+        if entry and entry['scraped_at'] > self.global_cache_timestamp:
+            self.global_cache = resolve_shared_blocks(entry['pages'])
+            self.global_cache_timestamp = entry['scraped_at']
+            return True
+        return False
+    
     def get_website_content_for_session(self, session_id: str) -> List[Dict]:
         """Get website content with global caching (no session-specific caching)"""
         with self.lock:
-            current_time = time.time()
-            
-            # Check if we have fresh global cache
+            # Check if we have fresh global cache, here or from another worker
+            if self.global_cache is None or self._is_cache_expired(self.global_cache_timestamp):
+                self._adopt_shared()
             if (self.global_cache is not None and 
                 not self._is_cache_expired(self.global_cache_timestamp)):
-                logger.debug(f"Using existing global cache (age: {current_time - self.global_cache_timestamp:.1f}s)")
+                logger.debug(f"Using existing global cache (age: {time.time() - self.global_cache_timestamp:.1f}s)")
+                record_cache("website", True)
                 return self.global_cache
+            record_cache("website", False)
+            
+            # One worker scrapes at a time
+            token = self.cache.acquire(WEBSITE_KEY, self.refresh_lease)
+            if token is None:
+                # Waiting here would hold the lock and stall every request in this worker; the
+                # other worker's pages are adopted on a later request
+                logger.debug("Another worker is refreshing the website cache, serving the previous pages")
+                return self.global_cache or []
             
             # Need to scrape fresh content
             logger.info("Scraping fresh website content (global cache expired)")
@@ -39,22 +71,28 @@ class WebsiteCache:
                 website_content = scrape_everest_website()
                 
                 # Update global cache
-                self.global_cache = website_content
-                self.global_cache_timestamp = current_time
+                self.global_cache = resolve_shared_blocks(website_content)
+                self.global_cache_timestamp = time.time()
+                self.cache.set(WEBSITE_KEY, {'scraped_at': self.global_cache_timestamp, 'pages': website_content},
+                               self.stale_duration)
                 
-                logger.info(f"Updated global cache with {len(website_content)} website pages")
-                return website_content
+                logger.info(f"Updated global cache with {len(self.global_cache)} website pages")
+                return self.global_cache
                 
             except Exception as e:
                 logger.error(f"Failed to scrape website: {e}")
                 # Return cached content even if expired, or empty list
                 return self.global_cache if self.global_cache else []
+            finally:
+                if token is not None:
+                    self.cache.release(WEBSITE_KEY, token)
     
     def invalidate_cache(self):
-        """Invalidate global cache"""
+        """Invalidate global cache; other workers notice once their own copy expires"""
         with self.lock:
             self.global_cache = None
             self.global_cache_timestamp = 0
+            self.cache.delete(WEBSITE_KEY)
             logger.info("Invalidated global cache")
     
     def get_cache_stats(self) -> Dict:
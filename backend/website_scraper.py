@@ -12,8 +12,14 @@ from typing import List, Dict, Set
 import time
 import re
 
+from text_dedup import BlockIndex, factor_shared_blocks
+
 logger = logging.getLogger(__name__)
 
+CONTENT_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div', 'li']
+# Tag of the entry that holds the blocks several pages share
+SITE_WIDE_TAG = 'site_wide'
+
 class EverestWebsiteScraper:
     def __init__(self, base_url: str = "https://everestmanila.com"):
         self.base_url = base_url
@@ -76,10 +82,14 @@ class EverestWebsiteScraper:
                 main_content = soup.find('body')
             
             if main_content:
-                # Extract headings and paragraphs
-                for element in main_content.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div', 'li']):
+                # Extract headings and paragraphs; repeated blocks are kept once
+                blocks = BlockIndex()
+                for element in main_content.find_all(CONTENT_TAGS):
+                    # A div around other blocks only repeats their text
+                    if element.name == 'div' and element.find(CONTENT_TAGS):
+                        continue
                     text = self.clean_text(element.get_text())
-                    if text and len(text) > 10:  # Only meaningful content
+                    if text and len(text) > 10 and blocks.add(text)[1]:  # Only meaningful content
                         content_areas.append(text)
             
             # Extract meta description
@@ -105,6 +115,7 @@ class EverestWebsiteScraper:
                 'title': page_title,
                 'description': description,
                 'content': full_content,
+                'blocks': content_areas,
                 'links': links,
                 'scraped_at': time.time()
             }
@@ -165,7 +176,12 @@ class EverestWebsiteScraper:
         """Format scraped data for knowledge base integration"""
         formatted_data = []
         
-        for page in self.scraped_data:
+        # Blocks that recur across pages (contact boxes, banners) are stored once, in a site-wide
+        # entry that the pages reference by position; resolve_shared_blocks puts them back
+        shared_blocks, own_blocks, references = factor_shared_blocks([page['blocks'] for page in self.scraped_data])
+        
+        for page, blocks, shared_refs in zip(self.scraped_data, own_blocks, references):
+            content = ' '.join(blocks)
             # Determine category based on URL and title
             url_path = urlparse(page['url']).path.lower()
             title = page['title'].lower()
@@ -187,16 +203,49 @@ class EverestWebsiteScraper:
             formatted_entry = {
                 'category': category,
                 'title': f"{page['title']} (Website)",
-                'content': f"{page['description']}\n\n{page['content']}" if page['description'] else page['content'],
+                'content': f"{page['description']}\n\n{content}" if page['description'] else content,
                 'tags': ['website', 'live_content', url_path.split('/')[-1] if url_path else 'home'],
                 'source_url': page['url'],
+                'shared_blocks': shared_refs,
                 'scraped_at': page['scraped_at']
             }
             
             formatted_data.append(formatted_entry)
         
+        if shared_blocks:
+            formatted_data.append({
+                'category': "Website Content",
+                'title': "Site-wide content (Website)",
+                'blocks': shared_blocks,
+                'tags': ['website', 'live_content', SITE_WIDE_TAG],
+                'source_url': self.base_url,
+                'scraped_at': max(page['scraped_at'] for page in self.scraped_data)
+            })
+        
         return formatted_data
 
+
+def resolve_shared_blocks(entries: List[Dict]) -> List[Dict]:
+    """Pages with the site-wide blocks they reference appended to their content
+    
+    The site-wide entry itself is left out, so each shared block is retrieved and quoted with
+    the pages it appears on rather than as one large entry.
+    """
+    shared_blocks = []
+    for entry in entries:
+        if SITE_WIDE_TAG in entry.get('tags', []):
+            shared_blocks = entry.get('blocks', [])
+    pages = []
+    for entry in entries:
+        if SITE_WIDE_TAG in entry.get('tags', []):
+            continue
+        refs = entry.get('shared_blocks') or []
+        page = {key: value for key, value in entry.items() if key != 'shared_blocks'}
+        if refs:
+            page['content'] = ' '.join([entry['content']] + [shared_blocks[i] for i in refs])
+        pages.append(page)
+    return pages
+
 def scrape_everest_website() -> List[Dict]:
     """Main function to scrape Everest Academy website"""
     scraper = EverestWebsiteScraper()